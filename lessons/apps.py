@@ -0,0 +1,14 @@
+from django.apps import AppConfig
+
+
+class LessonsConfig(AppConfig):
+    name = 'lessons'
+
+    def ready(self):
+        # Connect the signal receivers that keep caches and indexes current,
+        # whether or not the modules using them were imported yet
+        import lessons.bootstrap
+        import lessons.caching
+        import lessons.changes
+        import lessons.closure
+        import lessons.commits
@@ -0,0 +1,277 @@
+import bisect
+import heapq
+import threading
+
+from lessons.changes import ChangeLogIndex
+from lessons.models import Activity, Tag
+from lessons.search import TOKEN_RE
+
+# Kind of entry for each model that is completed
+KINDS = {
+    Tag: 'tag',
+    Activity: 'activity',
+}
+
+
+def normalize(name):
+    """
+    Lowercase a name and collapse its whitespace
+    """
+    return ' '.join((name or '').lower().split())
+
+
+def word_starts(name):
+    """
+    Positions in a (normalized) name where completion can start: the name itself and each of its words
+    """
+    return sorted(set([0] + [match.start() for match in TOKEN_RE.finditer(name)]))
+
+
+class TrieNode(object):
+    __slots__ = ('children', 'keys', 'top')
+
+    def __init__(self):
+        self.children = {}
+        # Entries with a name (or word of a name) starting with the prefix of this node
+        self.keys = set()
+        # Kind -> cached best entries (see `TopEntries`)
+        self.top = None
+
+
+class TopEntries(object):
+    """
+    Ranks of the best entries of a kind below a trie node, best first.
+    `complete` tells whether they are all of the entries, so entries added with a worse rank belong in the list too.
+    """
+    __slots__ = ('ranks', 'complete')
+
+    def __init__(self, ranks, complete):
+        self.ranks = ranks
+        self.complete = complete
+
+
+class AutocompleteIndex(ChangeLogIndex):
+    """
+    In-process autocomplete over tag and activity names.
+
+    A prefix trie finds names (or words within names) starting with the query. When there are not
+    enough of those, the trie is walked again for prefixes within a few typos of the query
+    (only following branches that can stay within the typo budget).
+    The index is built on first use and then catches up with the changes recorded in the database
+    (see lessons.changes). The best entries of each node are kept up to date as names change,
+    with room for some removals before they are computed again.
+    """
+    # Deepest trie level; longer queries are checked against the names of the deepest node
+    max_depth = 16
+    max_limit = 50
+    # Best entries kept for each trie node
+    top_size = 2 * max_limit
+    # Leading characters that must be typed without typos, which keeps the fuzzy walk small
+    prefix_length = 1
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.clear()
+
+    def clear(self):
+        with self.lock:
+            self.version = None
+            self.root = TrieNode()
+            # (kind, id) -> name
+            self.names = {}
+
+    def load(self):
+        self.clear()
+        for model, kind in KINDS.items():
+            for obj_ID, name in model.objects.values_list('id', 'name'):
+                self.add((kind, obj_ID), name)
+
+    def apply_changes(self, changes):
+        for model, kind in KINDS.items():
+            obj_IDs = changes.get(kind)
+            if not obj_IDs:
+                continue
+            names = dict(model.objects.filter(id__in=obj_IDs).values_list('id', 'name'))
+            for obj_ID in obj_IDs:
+                self.update((kind, obj_ID), names.get(obj_ID))
+
+    def update(self, key, name):
+        """
+        Change the name of an entry (None removes it)
+        """
+        with self.lock:
+            if self.names.get(key) == name:
+                return
+            self.remove(key)
+            if name is not None:
+                self.add(key, name)
+
+    def add(self, key, name):
+        self.names[key] = name
+        normalized = normalize(name)
+        for start in word_starts(normalized):
+            node = self.root
+            prefix = normalized[start:start + self.max_depth]
+            for depth, char in enumerate(prefix, start=1):
+                child = node.children.get(char)
+                if child is None:
+                    child = node.children[char] = TrieNode()
+                node = child
+                if key in node.keys:
+                    # Reached through another word of the name
+                    continue
+                node.keys.add(key)
+                if node.top:
+                    self.add_top(node, self.prefix_rank(prefix[:depth], key, name))
+
+    def remove(self, key):
+        name = self.names.pop(key, None)
+        if name is None:
+            return
+        normalized = normalize(name)
+        for start in word_starts(normalized):
+            path = [self.root]
+            prefix = normalized[start:start + self.max_depth]
+            for depth, char in enumerate(prefix, start=1):
+                node = path[-1].children.get(char)
+                if node is None:
+                    break
+                node.keys.discard(key)
+                if node.top:
+                    self.remove_top(node, self.prefix_rank(prefix[:depth], key, name))
+                path.append(node)
+            # Drop nodes that no longer lead to any name
+            for parent, (char, node) in zip(path, zip(normalized[start:], path[1:])):
+                if not node.keys:
+                    del parent.children[char]
+                    break
+
+    def rank(self, key, name=None):
+        # Shorter names first, then alphabetical order
+        if name is None:
+            name = self.names[key]
+        return (len(name), name.lower(), key)
+
+    def get_budget(self, query):
+        """
+        Number of typos allowed in a query of this length
+        """
+        if len(query) < 4:
+            return 0
+        if len(query) < 8:
+            return 1
+        return 2
+
+    def complete(self, query, kind=None, limit=10):
+        """
+        Return up to `limit` (kind, id, name) entries whose name matches the start of the query
+        """
+        query = normalize(query)
+        limit = min(limit, self.max_limit)
+        if not query:
+            return []
+
+        with self.lock:
+            self.sync()
+            keys = self.complete_prefix(query, kind)[:limit]
+            if len(keys) < limit:
+                keys += self.complete_fuzzy(query, kind, set(keys))[:limit - len(keys)]
+            return [key + (self.names[key],) for key in keys]
+
+    def complete_prefix(self, query, kind):
+        node = self.root
+        for char in query[:self.max_depth]:
+            node = node.children.get(char)
+            if node is None:
+                return []
+
+        if len(query) > self.max_depth:
+            # Check the rest of the query against the names themselves
+            matches = [
+                key for key in node.keys
+                if (kind is None or key[0] == kind) and any(
+                    normalize(self.names[key]).startswith(query, start)
+                    for start in word_starts(normalize(self.names[key]))
+                )
+            ]
+            return sorted(matches, key=self.full_rank(query))
+
+        return self.get_top(node, query, kind)
+
+    def get_top(self, node, prefix, kind):
+        """
+        Best entries of the given kind below a trie node (cached and then kept up to date by `add` and `remove`)
+        """
+        if node.top is None:
+            node.top = {}
+        top = node.top.get(kind)
+        if top is None:
+            keys = [key for key in node.keys if kind is None or key[0] == kind]
+            ranks = heapq.nsmallest(self.top_size, (self.prefix_rank(prefix, key, self.names[key]) for key in keys))
+            top = node.top[kind] = TopEntries(ranks, len(keys) <= self.top_size)
+        return [rank[-1] for rank in top.ranks[:self.max_limit]]
+
+    def add_top(self, node, rank):
+        for kind, top in node.top.items():
+            if kind is not None and kind != rank[-1][0]:
+                continue
+            if top.complete or rank < top.ranks[-1]:
+                bisect.insort(top.ranks, rank)
+                if len(top.ranks) > self.top_size:
+                    top.ranks.pop()
+                    top.complete = False
+
+    def remove_top(self, node, rank):
+        for kind, top in list(node.top.items()):
+            index = bisect.bisect_left(top.ranks, rank)
+            if index < len(top.ranks) and top.ranks[index] == rank:
+                del top.ranks[index]
+                if not top.complete and len(top.ranks) < self.max_limit:
+                    # Too few left to know the best entries: compute them again on next use
+                    del node.top[kind]
+
+    def prefix_rank(self, prefix, key, name):
+        # Names starting with the prefix rank before names with a word starting with it
+        return (not normalize(name).startswith(prefix),) + self.rank(key, name)
+
+    def full_rank(self, query):
+        return lambda key: self.prefix_rank(query, key, self.names[key])
+
+    def complete_fuzzy(self, query, kind, exclude):
+        budget = self.get_budget(query)
+        if not budget:
+            return []
+        query = query[:self.max_depth]
+
+        # Walk the trie with the edit distances between each prefix of the query and the current node
+        distances = {}
+        stack = [(self.root, '', range(len(query) + 1))]
+        while stack:
+            node, prefix, row = stack.pop()
+            if len(prefix) < self.prefix_length:
+                char = query[len(prefix)]
+                children = [(char, node.children[char])] if char in node.children else []
+            else:
+                children = node.children.items()
+            for char, child in children:
+                child_row = [row[0] + 1]
+                for i, query_char in enumerate(query, start=1):
+                    child_row.append(min(
+                        row[i] + 1
+                        , child_row[i - 1] + 1
+                        , row[i - 1] + (query_char != char)
+                    ))
+                if min(child_row) > budget:
+                    continue
+                if child_row[-1] <= budget:
+                    # The whole query is within budget of this prefix, and so of every name below it
+                    for key in self.get_top(child, prefix + char, kind):
+                        if key not in exclude and child_row[-1] < distances.get(key, budget + 1):
+                            distances[key] = child_row[-1]
+                stack.append((child, prefix + char, child_row))
+
+        return sorted(distances, key=lambda key: (distances[key],) + self.rank(key))
+
+
+autocomplete_index = AutocompleteIndex()
+
@@ -0,0 +1,311 @@
+import binascii
+import operator
+import re
+import threading
+from collections import defaultdict
+
+from django.db.models import Q
+
+from lessons.changes import ChangeLogIndex
+from lessons.models import Activity, Tag
+
+
+class TagQueryError(ValueError):
+    """
+    Raised when a tag query cannot be parsed or names an unknown tag
+    """
+
+
+# Positions of the set bits of each byte value
+BYTE_BITS = [[position for position in range(8) if value >> position & 1] for value in range(256)]
+
+
+def IDs_to_bits(IDs):
+    """
+    Bitmap with the given positions set
+    """
+    # Set the bits in a byte array and convert it once (setting them in the int copies it every time)
+    IDs = list(IDs)
+    if not IDs:
+        return 0
+    data = bytearray((max(IDs) >> 3) + 1)
+    for ID in IDs:
+        data[ID >> 3] |= 1 << (ID & 7)
+    data.reverse()
+    return int(binascii.hexlify(data), 16)
+
+
+def count_bits(bits):
+    return bin(bits).count('1')
+
+
+def bits_to_IDs(bits):
+    """
+    List the positions of the set bits, in increasing order
+    """
+    IDs = []
+    if not bits:
+        return IDs
+    digits = '%x' % bits
+    data = bytearray(binascii.unhexlify('0' * (len(digits) % 2) + digits))
+    data.reverse()
+    for index, byte in enumerate(data):
+        if byte:
+            IDs.extend((index << 3) + position for position in BYTE_BITS[byte])
+    return IDs
+
+
+class TagBitmapIndex(ChangeLogIndex):
+    """
+    In-process bitmaps of which activities have each tag (and each activity category).
+
+    Each bitmap is a Python int with bit N set when activity N belongs to it, so combining
+    tags with AND / OR / NOT is a single bitwise operation however many activities exist.
+    The index is built on first use and then catches up with the changes recorded in the database
+    (see lessons.changes) before each query.
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.clear()
+
+    def clear(self):
+        with self.lock:
+            self.version = None
+            # tag id -> bitmap of activity ids
+            self.tags = defaultdict(int)
+            # lowercase tag name -> tag id
+            self.tag_IDs = {}
+            # tag id -> (name, category)
+            self.tag_info = {}
+            # tag id -> number of activities with the tag (cleared when the tag's bitmap changes)
+            self.tag_counts = {}
+            # activity category -> bitmap of activity ids
+            self.categories = defaultdict(int)
+            # bitmap of every activity id
+            self.activities = 0
+
+    def load(self):
+        self.clear()
+        for tag_ID, name, category in Tag.objects.values_list('id', 'name', 'category'):
+            self.set_tag(tag_ID, name, category)
+        self.add_activities(Activity.objects.all())
+        self.add_tags(Activity.tags.through.objects.all())
+
+    def apply_changes(self, changes):
+        tag_IDs = changes.get('tag')
+        if tag_IDs:
+            # Read the changed tags and their activities again
+            for tag_ID in tag_IDs:
+                self.set_tag(tag_ID, None, None)
+            for tag_ID, name, category in Tag.objects.filter(id__in=tag_IDs).values_list('id', 'name', 'category'):
+                self.set_tag(tag_ID, name, category)
+            self.add_tags(Activity.tags.through.objects.filter(tag__in=tag_IDs))
+
+        activity_IDs = changes.get('activity')
+        if activity_IDs:
+            self.remove_activities(IDs_to_bits(activity_IDs))
+            self.add_activities(Activity.objects.filter(id__in=activity_IDs))
+            self.add_tags(Activity.tags.through.objects.filter(activity__in=activity_IDs))
+
+    def add_activities(self, queryset):
+        activity_IDs = defaultdict(list)
+        for activity_ID, category in queryset.values_list('id', 'category'):
+            activity_IDs[category].append(activity_ID)
+        for category, IDs in activity_IDs.items():
+            bits = IDs_to_bits(IDs)
+            self.activities |= bits
+            if category:
+                self.categories[category] |= bits
+
+    def add_tags(self, queryset):
+        """
+        Add the (activity, tag) rows of a queryset of Activity.tags.through
+        """
+        activity_IDs = defaultdict(list)
+        for activity_ID, tag_ID in queryset.values_list('activity', 'tag'):
+            activity_IDs[tag_ID].append(activity_ID)
+        for tag_ID, IDs in activity_IDs.items():
+            self.tags[tag_ID] |= IDs_to_bits(IDs)
+            self.tag_counts.pop(tag_ID, None)
+
+    def remove_activities(self, bits):
+        mask = ~bits
+        self.activities &= mask
+        for key in self.categories:
+            self.categories[key] &= mask
+        for key in self.tags:
+            self.tags[key] &= mask
+        self.tag_counts = {}
+
+    def set_tag(self, tag_ID, name, category):
+        """
+        Add, rename or re-categorize a tag (a name of None removes it)
+        """
+        if tag_ID in self.tag_info:
+            old_name = self.tag_info[tag_ID][0].lower()
+            if self.tag_IDs.get(old_name) == tag_ID:
+                del self.tag_IDs[old_name]
+        if name is None:
+            self.tags.pop(tag_ID, None)
+            self.tag_info.pop(tag_ID, None)
+            self.tag_counts.pop(tag_ID, None)
+        else:
+            self.tag_IDs[name.lower()] = tag_ID
+            self.tag_info[tag_ID] = (name, category)
+
+    def get_term(self, term):
+        """
+        Bitmap of the activities with the tag named `term`, or else in the activity category named `term`
+        """
+        name = term.lower()
+        if name in self.tag_IDs:
+            return self.tags.get(self.tag_IDs[name], 0)
+        for category, bits in self.categories.items():
+            if category.lower() == name:
+                return bits
+        for category, display in Activity.CATEGORIES:
+            if category.lower() == name:
+                return 0
+        raise TagQueryError(u'Unknown tag: "{}".'.format(term))
+
+    def get_term_filter(self, term):
+        """
+        Same as `get_term`, as a filter of the activities in the database
+        """
+        name = term.lower()
+        if name in self.tag_IDs:
+            return Q(id__in=Activity.tags.through.objects.filter(tag=self.tag_IDs[name]).values('activity'))
+        for category in list(self.categories) + [category for category, display in Activity.CATEGORIES]:
+            if category.lower() == name:
+                return Q(category=category)
+        raise TagQueryError(u'Unknown tag: "{}".'.format(term))
+
+    def query(self, expression):
+        """
+        Return the sorted ids of the activities matching a tag query such as
+        python AND (beginner OR "30 minutes") AND NOT offline
+        """
+        return bits_to_IDs(self.query_bits(expression))
+
+    def query_bits(self, expression):
+        with self.lock:
+            self.sync()
+            return TagQueryParser(expression, self.get_term, lambda bits: self.activities & ~bits).parse()
+
+    def query_filter(self, expression):
+        """
+        Return a filter of the activities matching a tag query, which the database evaluates with subqueries
+        (for matches too many to list by id)
+        """
+        with self.lock:
+            self.sync()
+            return TagQueryParser(expression, self.get_term_filter, operator.invert).parse()
+
+    def count_tags(self, bits=None):
+        """
+        Return {tag id: number of activities with the tag} among the activities in `bits` (default: all)
+        Tags without any of those activities are left out.
+        """
+        with self.lock:
+            self.sync()
+            if bits is None:
+                # Counts over every activity only change with the tag's bitmap
+                for tag_ID in self.tag_info:
+                    if tag_ID not in self.tag_counts:
+                        self.tag_counts[tag_ID] = count_bits(self.tags.get(tag_ID, 0))
+                counts = self.tag_counts
+            else:
+                counts = dict(
+                    (tag_ID, count_bits(self.tags.get(tag_ID, 0) & bits))
+                    for tag_ID in self.tag_info
+                )
+            return dict((tag_ID, count) for tag_ID, count in counts.items() if count)
+
+
+class TagQueryParser(object):
+    """
+    Evaluate a tag query while parsing it (recursive descent), on values that combine with | and &,
+    such as the bitmaps or the Q filters of a TagBitmapIndex:
+    query := term (OR term)*
+    term := factor ([AND] factor)*
+    factor := NOT factor | "(" query ")" | word | "quoted words"
+    """
+    TOKEN_RE = re.compile(r'\s*(?:(\()|(\))|"([^"]*)"|([^\s()"]+))')
+
+    def __init__(self, expression, get_term, negate):
+        self.get_term = get_term
+        self.negate = negate
+        self.tokens = []
+        position = 0
+        expression = expression.strip()
+        while position < len(expression):
+            match = self.TOKEN_RE.match(expression, position)
+            if match is None:
+                raise TagQueryError('Unmatched quote.')
+            opening, closing, quoted, word = match.groups()
+            if quoted is not None:
+                self.tokens.append(('name', quoted))
+            elif word is not None and word.upper() in ('AND', 'OR', 'NOT'):
+                self.tokens.append((word.upper(), word))
+            elif word is not None:
+                self.tokens.append(('name', word))
+            else:
+                self.tokens.append((opening or closing, opening or closing))
+            position = match.end()
+        self.position = 0
+
+    def peek(self):
+        if self.position < len(self.tokens):
+            return self.tokens[self.position][0]
+        return None
+
+    def next(self):
+        token = self.tokens[self.position]
+        self.position += 1
+        return token
+
+    def parse(self):
+        if not self.tokens:
+            raise TagQueryError('Empty query.')
+        bits = self.parse_query()
+        if self.peek() is not None:
+            raise TagQueryError(u'Unexpected "{}".'.format(self.next()[1]))
+        return bits
+
+    def parse_query(self):
+        bits = self.parse_term()
+        while self.peek() == 'OR':
+            self.next()
+            bits |= self.parse_term()
+        return bits
+
+    def parse_term(self):
+        bits = self.parse_factor()
+        # Terms next to each other are combined with AND
+        while self.peek() in ('AND', 'NOT', 'name', '('):
+            if self.peek() == 'AND':
+                self.next()
+            bits &= self.parse_factor()
+        return bits
+
+    def parse_factor(self):
+        kind = self.peek()
+        if kind is None:
+            raise TagQueryError('Unexpected end of query.')
+        token = self.next()
+        if kind == 'NOT':
+            return self.negate(self.parse_factor())
+        if kind == '(':
+            bits = self.parse_query()
+            if self.peek() != ')':
+                raise TagQueryError('Missing ")".')
+            self.next()
+            return bits
+        if kind == 'name':
+            return self.get_term(token[1])
+        raise TagQueryError(u'Unexpected "{}".'.format(token[1]))
+
+
+tag_bitmap_index = TagBitmapIndex()
+
@@ -0,0 +1,89 @@
+from collections import OrderedDict
+
+from django.core.cache import cache
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from rest_framework.renderers import JSONRenderer
+
+from lessons import dependencies
+from lessons.commits import after_commit, run_pending
+from lessons.models import Activity, Curriculum, CurriculumActivityRelationship, Tag
+from lessons.serializers import ActivitySerializer, CurriculumSerializer, TagSerializer
+from lessons.signals import curricula_changed
+
+# Fields of the activity index: what the curriculum list shows before an activity is opened
+# (free text such as teaching notes is loaded when it is shown)
+ACTIVITY_INDEX_FIELDS = ('id', 'name', 'category', 'video_url', 'tags')
+
+BOOTSTRAP_CACHE_KEY = 'lessons:bootstrap'
+
+
+def get_bootstrap_data(request=None):
+    """
+    Everything the app shell needs for its first paint, normalized so each object appears once:
+    {"curricula": {"<id>": {..., "tags": [<tag ids>], "activities": [<activity ids in order>]}, ...},
+     "activities": {"<id>": {"id": 1, "name": "...", ..., "tags": [<tag ids>]}, ...},
+     "tags": {"<id>": {"id": 1, "name": "Python", "logo": "...", "category": "Language"}, ...}}
+    Related objects are output as IDs (see DynamicFieldsMixin), so this costs six queries.
+    """
+    context = {'request': request, 'expand': ()}
+    return OrderedDict([
+        ('curricula', serialize_by_ID(
+            CurriculumSerializer
+            , Curriculum.objects.all()
+            , dict(context, fields=CurriculumSerializer.Meta.fields)
+        )),
+        ('activities', serialize_by_ID(
+            ActivitySerializer
+            , Activity.objects.all()
+            , dict(context, fields=ACTIVITY_INDEX_FIELDS)
+        )),
+        ('tags', serialize_by_ID(TagSerializer, Tag.objects.all(), context)),
+    ])
+
+
+def serialize_by_ID(serializer_class, queryset, context):
+    """
+    Serialize every object of `queryset` (prefetching what the serializer reads) into a dict keyed by id
+    """
+    prefetch_fields = getattr(serializer_class(context=context), 'get_prefetch_fields', list)()
+    objects = serializer_class(queryset.prefetch_related(*prefetch_fields), many=True, context=context).data
+    return OrderedDict((obj['id'], obj) for obj in objects)
+
+
+def get_bootstrap_json():
+    """
+    The bootstrap data as JSON that is safe to embed in a <script> element.
+    It is cached with Django's cache framework until a curriculum, activity or tag changes
+    (or for LESSONS_BOOTSTRAP_CACHE_TIMEOUT seconds), by default only with a cache shared between processes
+    (see dependencies.get_timeout).
+    """
+    timeout = dependencies.get_timeout('LESSONS_BOOTSTRAP_CACHE_TIMEOUT', 300)
+    run_pending()
+    snapshot = cache.get(BOOTSTRAP_CACHE_KEY) if timeout else None
+    if snapshot is None:
+        snapshot = JSONRenderer().render(get_bootstrap_data())
+        # Escape the characters that could end the <script> element or start a comment
+        for character, escaped in (('<', '\\u003c'), ('>', '\\u003e'), ('&', '\\u0026')):
+            snapshot = snapshot.replace(character, escaped)
+        if timeout:
+            cache.set(BOOTSTRAP_CACHE_KEY, snapshot, timeout)
+    return snapshot
+
+
+""" Signal Receivers """
+
+@receiver(post_save, sender=Curriculum)
+@receiver(post_save, sender=Activity)
+@receiver(post_save, sender=Tag)
+@receiver(post_save, sender=CurriculumActivityRelationship)
+@receiver(post_delete, sender=Curriculum)
+@receiver(post_delete, sender=Activity)
+@receiver(post_delete, sender=Tag)
+@receiver(post_delete, sender=CurriculumActivityRelationship)
+@receiver(m2m_changed, sender=Activity.tags.through)
+@receiver(curricula_changed)
+def lessons_changed(sender, **kwargs):
+    # Deleted again once the write commits, in case a concurrent request cached the old rows meanwhile
+    after_commit(BOOTSTRAP_CACHE_KEY, lambda: cache.delete(BOOTSTRAP_CACHE_KEY))
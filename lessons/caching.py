@@ -0,0 +1,250 @@
+import hashlib
+import warnings
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from rest_framework import status
+from rest_framework.response import Response
+
+from lessons import dependencies
+from lessons.models import Activity, ActivityRelationship, Curriculum, CurriculumActivityRelationship
+from lessons.models import Material, Resource, Step, Tag
+from lessons.signals import activities_changed, curricula_changed
+from lessons.singleflight import response_flights
+
+# Kinds of cached responses
+ACTIVITY = 'activity'
+CURRICULUM = 'curriculum'
+
+# Object "id" of the lists of a kind
+LIST = 'list'
+
+# Query parameters that only choose how the rows of a list are output (see DynamicFieldsMixin and KeysetPaginationMixin)
+OUTPUT_PARAMS = ('fields', 'expand', 'cursor', 'page_size', 'format')
+
+
+def response_key(kind, object_ID, request):
+    """
+    Key of a cached response: the object (or "list") and a hash of the full URL (query parameters included)
+    """
+    url_hash = hashlib.md5(request.build_absolute_uri().encode('utf-8')).hexdigest()
+    return 'lessons:response:{}:{}:{}'.format(kind, object_ID, url_hash)
+
+
+class ResponseCacheMixin(object):
+    """
+    Cache the data of successful `list` and `retrieve` responses with Django's cache framework.
+
+    Each cached response keeps the versions of the rows it embedded while it was serialized
+    (see lessons/dependencies.py), and is only served while none of those rows changed.
+    Lists also depend on their table, so added rows show up, and on the tables read by the filters they use
+    (`cache_filter_models`), so rows that start or stop matching show up too.
+    Lists using any other query parameter than those and `cache_filter_params` are not cached,
+    since their filters could read tables whose writes they would miss.
+    Concurrent requests for the same missing response are computed once (see lessons/singleflight.py),
+    across processes too if LESSONS_RESPONSE_CACHE_LOCK is set.
+    Responses are only cached with a cache shared between processes, unless LESSONS_RESPONSE_CACHE_TIMEOUT
+    is set (0 turns the cache off).
+    """
+    cache_kind = None
+    # Query parameters of the list filters that match on the listed rows, or on rows whose writes bump them
+    cache_filter_params = ()
+    # {query parameter: model} of the list filters that match on the columns of another table
+    cache_filter_models = {}
+
+    def list(self, request, *args, **kwargs):
+        view = super(ResponseCacheMixin, self).list
+        return self.get_cached_response(LIST, view, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        view = super(ResponseCacheMixin, self).retrieve
+        object_ID = kwargs[self.lookup_url_kwarg or self.lookup_field]
+        return self.get_cached_response(object_ID, view, request, *args, **kwargs)
+
+    def get_cached_response(self, object_ID, view, request, *args, **kwargs):
+        timeout = dependencies.get_timeout('LESSONS_RESPONSE_CACHE_TIMEOUT')
+        # A response computed inside a transaction could show rows that are rolled back
+        if not timeout or transaction.get_connection().in_atomic_block:
+            return view(request, *args, **kwargs)
+        if object_ID == LIST and not self.is_list_cacheable(request):
+            return view(request, *args, **kwargs)
+
+        key = response_key(self.cache_kind, object_ID, request)
+        data = get_current_data(key)
+        if data is not None:
+            return Response(data)
+
+        # Concurrent requests for a missing response wait for one of them to compute it
+        with response_flights.lead(
+            key
+            , timeout=getattr(settings, 'LESSONS_RESPONSE_CACHE_LOCK_TIMEOUT', 30)
+            , cache_lock=use_cache_lock()
+        ) as leading:
+            if not leading:
+                data = get_current_data(key)
+                if data is not None:
+                    return Response(data)
+            return self.compute_response(key, object_ID, timeout, view, request, *args, **kwargs)
+
+    def is_list_cacheable(self, request):
+        """
+        Whether the keys of a list cover every table its query parameters read
+        """
+        covered = set(OUTPUT_PARAMS) | set(self.cache_filter_params) | set(self.cache_filter_models)
+        return all(param in covered for param in request.query_params)
+
+    def compute_response(self, key, object_ID, timeout, view, request, *args, **kwargs):
+        generation = dependencies.get_generation()
+        with dependencies.recording() as row_keys:
+            if object_ID == LIST:
+                row_keys.add(dependencies.row_key(self.queryset.model, dependencies.TABLE))
+                for param, model in self.cache_filter_models.items():
+                    if param in request.query_params:
+                        row_keys.add(dependencies.row_key(model, dependencies.TABLE))
+            response = view(request, *args, **kwargs)
+        if response.status_code == status.HTTP_200_OK:
+            versions = dependencies.get_versions(row_keys)
+            # Rows written meanwhile could be recorded with their new versions but old data
+            if dependencies.get_generation() == generation:
+                cache.set(key, {'data': get_cacheable_data(response.data), 'versions': versions}, timeout)
+        return response
+
+
+def use_cache_lock():
+    """
+    Whether to lock missing responses across processes (LESSONS_RESPONSE_CACHE_LOCK),
+    which only works with a cache shared between them
+    """
+    if not getattr(settings, 'LESSONS_RESPONSE_CACHE_LOCK', False):
+        return False
+    if not dependencies.is_cache_shared():
+        warnings.warn(
+            "LESSONS_RESPONSE_CACHE_LOCK is ignored: the default cache is not shared between processes."
+            , RuntimeWarning
+        )
+        return False
+    return True
+
+
+def get_current_data(key):
+    """
+    Return the data of a cached response if none of the rows it embedded changed since
+    """
+    entry = cache.get(key)
+    if entry is not None and dependencies.is_current(entry['versions']):
+        return entry['data']
+    return None
+
+
+def get_cacheable_data(data):
+    # ReturnDict / ReturnList hold their serializer; keep the data (and its key order) only
+    if isinstance(data, dict):
+        return OrderedDict(data)
+    return list(data)
+
+
+""" Signal Receivers """
+
+# Each write outdates the rows whose serialized form it changes
+
+@receiver(post_save, sender=Tag)
+@receiver(post_save, sender=Material)
+@receiver(post_save, sender=Resource)
+@receiver(post_save, sender=Activity)
+@receiver(post_save, sender=Curriculum)
+@receiver(post_delete, sender=Tag)
+@receiver(post_delete, sender=Material)
+@receiver(post_delete, sender=Resource)
+@receiver(post_delete, sender=Activity)
+@receiver(post_delete, sender=Curriculum)
+def row_changed(sender, instance, **kwargs):
+    dependencies.bump(sender, [instance.id])
+
+
+@receiver(post_save, sender=Step)
+@receiver(post_delete, sender=Step)
+def step_changed(sender, instance, **kwargs):
+    # Activities show their steps
+    dependencies.bump(Step, [instance.id])
+    dependencies.bump(Activity, [instance.activity_id])
+
+
+# Related model of each of the activity many-to-many tables, and whether it shows its activities
+RELATED_MODELS = {
+    Activity.tags.through: (Tag, False),
+    Activity.materials.through: (Material, True),
+    Activity.resources.through: (Resource, True),
+}
+
+
+def activity_related_changed(sender, activity_IDs, related_IDs):
+    model, shows_activities = RELATED_MODELS[sender]
+    dependencies.bump(Activity, activity_IDs)
+    if shows_activities:
+        dependencies.bump(model, related_IDs)
+
+
+@receiver(m2m_changed, sender=Activity.tags.through)
+@receiver(m2m_changed, sender=Activity.materials.through)
+@receiver(m2m_changed, sender=Activity.resources.through)
+def activity_related_m2m_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'pre_clear':
+        # The cleared rows are only known beforehand
+        model = RELATED_MODELS[sender][0]
+        if reverse:
+            pk_set = sender.objects.filter(**{model._meta.model_name: instance}).values_list('activity', flat=True)
+        else:
+            pk_set = sender.objects.filter(activity=instance).values_list(model._meta.model_name, flat=True)
+        instance._cleared_IDs = set(pk_set)
+        return
+    if action == 'post_clear':
+        pk_set = instance.__dict__.pop('_cleared_IDs', ())
+    elif action not in ('post_add', 'post_remove'):
+        return
+
+    if reverse:
+        # e.g. material.activities changed
+        activity_related_changed(sender, pk_set, [instance.id])
+    else:
+        # e.g. activity.materials changed
+        activity_related_changed(sender, [instance.id], pk_set)
+
+
+@receiver(pre_delete, sender=Activity)
+def activity_deleting(sender, instance, **kwargs):
+    # The rows relating the activity to its materials and resources are deleted without signals
+    for through in (Activity.materials.through, Activity.resources.through):
+        related_IDs = through.objects.filter(activity=instance).values_list(
+            RELATED_MODELS[through][0]._meta.model_name, flat=True
+        )
+        activity_related_changed(through, (), related_IDs)
+
+
+@receiver(post_save, sender=ActivityRelationship)
+@receiver(post_delete, sender=ActivityRelationship)
+def activity_relationship_changed(sender, instance, **kwargs):
+    # Activities show the relationships to them
+    dependencies.bump(Activity, [instance.to_activity_id])
+
+
+@receiver(post_save, sender=CurriculumActivityRelationship)
+@receiver(post_delete, sender=CurriculumActivityRelationship)
+def curriculum_activity_changed(sender, instance, **kwargs):
+    # Activities show the ids of their curricula and curricula show their activities
+    dependencies.bump(Activity, [instance.activity_id])
+    dependencies.bump(Curriculum, [instance.curriculum_id])
+
+
+@receiver(activities_changed)
+def activities_written(sender, activity_IDs, **kwargs):
+    dependencies.bump(Activity, activity_IDs)
+
+
+@receiver(curricula_changed)
+def curricula_written(sender, curriculum_IDs, **kwargs):
+    dependencies.bump(Curriculum, curriculum_IDs)
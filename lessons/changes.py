@@ -0,0 +1,180 @@
+import random
+import time
+import uuid
+from collections import defaultdict
+
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from lessons.models import Activity, IndexChange, Material, Resource, Tag
+
+# Kind of change telling every index to rebuild (see `manage.py rebuild_search_index`)
+ALL = 'all'
+
+# Changes that are kept: an index further behind rebuilds
+KEPT_CHANGES = 10000
+# One write in how many deletes older changes
+PRUNE_INTERVAL = 100
+# Seconds an id skipped by the committed changes is waited for: ids are taken when a change is inserted,
+# so a transaction that started writing earlier can commit a lower id later (or roll it back, leaving it unused)
+GAP_TIMEOUT = 60
+
+
+def record_changes(kind, object_IDs):
+    """
+    Record that the given objects ('activity', 'tag', 'material' or 'resource') changed.
+    Writes only insert rows, which take no lock that other writers would wait for until this one commits.
+    """
+    object_IDs = set(object_IDs)
+    if not object_IDs:
+        return
+    token = uuid.uuid4().hex
+    IndexChange.objects.bulk_create([
+        IndexChange(token=token, kind=kind, object_id=object_ID)
+        for object_ID in object_IDs
+    ])
+    if random.randrange(PRUNE_INTERVAL) == 0:
+        latest_ID = IndexChange.objects.order_by('-id').values_list('id', flat=True).first()
+        IndexChange.objects.filter(id__lte=latest_ID - KEPT_CHANGES).delete()
+
+
+def get_latest_change():
+    """
+    Return (id, token, gaps) of the latest committed change, where `gaps` holds {id: time first missed}
+    for the ids below it that are not committed yet (or were rolled back)
+    """
+    rows = list(IndexChange.objects.order_by('-id').values_list('id', 'token')[:KEPT_CHANGES])
+    if not rows:
+        return 0, '', {}
+    now = time.time()
+    IDs = set(ID for ID, token in rows)
+    lowest_ID = max(rows[-1][0], rows[0][0] - KEPT_CHANGES)
+    gaps = dict((ID, now) for ID in range(lowest_ID, rows[0][0]) if ID not in IDs)
+    return rows[0][0], rows[0][1], gaps
+
+
+def get_changes(since, token, gaps):
+    """
+    Return ({kind: ids}, id, token, gaps) of the changes committed after change `since` (whose token was `token`)
+    or with an id in `gaps`, along with the latest change and the ids still missing below it,
+    or None if they can't be told: `since` was rolled back or pruned, or a rebuild was asked for
+    """
+    rows = IndexChange.objects.filter(id__gte=min([since] + list(gaps))).order_by('id').values_list(
+        'id', 'token', 'kind', 'object_id'
+    )
+    changes = defaultdict(set)
+    gaps = dict(gaps)
+    now = time.time()
+    latest_ID, latest_token = since, token
+    since_found = not since
+    for ID, row_token, kind, object_ID in rows:
+        if ID < since and ID not in gaps:
+            # Applied already
+            continue
+        if ID == since:
+            if row_token != token:
+                return None
+            since_found = True
+            continue
+        if kind == ALL:
+            return None
+        changes[kind].add(object_ID)
+        gaps.pop(ID, None)
+        if ID > latest_ID:
+            if ID - latest_ID > KEPT_CHANGES:
+                return None
+            # Ids skipped on the way may still be committed
+            for missing_ID in range(latest_ID + 1, ID):
+                gaps[missing_ID] = now
+            latest_ID, latest_token = ID, row_token
+    if not since_found:
+        return None
+    gaps = dict((ID, missed) for ID, missed in gaps.items() if now - missed < GAP_TIMEOUT)
+    return changes, latest_ID, latest_token, gaps
+
+
+class ChangeLogIndex(object):
+    """
+    Base of the in-process indexes built from the database (search, autocomplete, tag bitmaps).
+
+    Every process keeps its own copy. Before each use, `sync()` reads the changes committed since the latest one
+    the index applied (a single query) and applies them, so writes of other processes show up
+    and rolled back writes never do. Changes can commit out of id order, so the ids skipped are read again
+    until they show up or GAP_TIMEOUT passes.
+    Subclasses set `lock` and implement `load()` (index everything) and `apply_changes({kind: ids})`.
+    """
+    # Id (and token) of the latest change the index applied, None until it is built
+    version = None
+    token = ''
+    # {id: time first missed} of the changes below it that may still commit
+    gaps = {}
+
+    def rebuild(self):
+        """
+        Index everything from scratch
+        """
+        with self.lock:
+            version, token, gaps = get_latest_change()
+            self.load()
+            self.version, self.token, self.gaps = version, token, gaps
+
+    def sync(self):
+        """
+        Catch up with the changes committed since the index was built
+        """
+        with self.lock:
+            if self.version is not None:
+                result = get_changes(self.version, self.token, self.gaps)
+                if result is not None:
+                    changes, version, token, gaps = result
+                    if changes:
+                        self.apply_changes(changes)
+                    self.version, self.token, self.gaps = version, token, gaps
+                    return
+            self.rebuild()
+
+
+""" Signal Receivers """
+
+KINDS = {
+    Activity: 'activity',
+    Tag: 'tag',
+    Material: 'material',
+    Resource: 'resource',
+}
+
+# Kind of related object for each of the activity many-to-many tables
+RELATED_KINDS = {
+    Activity.tags.through: 'tag',
+    Activity.materials.through: 'material',
+    Activity.resources.through: 'resource',
+}
+
+
+@receiver(post_save, sender=Activity)
+@receiver(post_save, sender=Tag)
+@receiver(post_save, sender=Material)
+@receiver(post_save, sender=Resource)
+@receiver(post_delete, sender=Activity)
+@receiver(post_delete, sender=Tag)
+@receiver(post_delete, sender=Material)
+@receiver(post_delete, sender=Resource)
+def object_changed(sender, instance, **kwargs):
+    record_changes(KINDS[sender], [instance.id])
+
+
+@receiver(m2m_changed, sender=Activity.tags.through)
+@receiver(m2m_changed, sender=Activity.materials.through)
+@receiver(m2m_changed, sender=Activity.resources.through)
+def activity_related_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        # e.g. activity.tags changed
+        record_changes('activity', [instance.id])
+    elif pk_set is not None:
+        # e.g. tag.activities changed
+        record_changes('activity', pk_set)
+    else:
+        # e.g. tag.activities was cleared: the indexes know which activities had it
+        record_changes(RELATED_KINDS[sender], [instance.id])
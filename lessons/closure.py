@@ -0,0 +1,251 @@
+import threading
+from collections import OrderedDict, defaultdict, deque
+from contextlib import contextmanager
+
+from django.db.models import Q
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from lessons.models import Activity, ActivityClosure, ActivityRelationship
+
+# Relationship types that make up each closure type (a SUP row mirrors a SUB row)
+CLOSURE_REL_TYPES = {
+    'SUB': ('SUB', 'SUP'),
+    'EXT': ('EXT',),
+}
+
+# Edges of the relationships deleted inside batch_closure_updates() by the current thread
+_local = threading.local()
+
+
+class CycleError(ValueError):
+    """
+    Raised when a relationship would make an activity its own ancestor
+    """
+    def __init__(self, ancestor_ID, descendant_ID):
+        super(CycleError, self).__init__(ancestor_ID, descendant_ID)
+        self.ancestor_ID = ancestor_ID
+        self.descendant_ID = descendant_ID
+
+
+def get_edge(from_activity_ID, to_activity_ID, rel_type):
+    """
+    Return the (ancestor id, descendant id, closure type) edge for a relationship row
+    ("from activity is a <rel_type> of to activity"), so that SUB rows and their SUP mirrors give the same edge
+    """
+    if rel_type == 'SUP':
+        return (from_activity_ID, to_activity_ID, 'SUB')
+    return (to_activity_ID, from_activity_ID, rel_type)
+
+
+def add_closure_edges(relationships):
+    """
+    Add new relationship rows to the closure, updating only the rows for paths through them.
+    Raises CycleError if a relationship would create a cycle (call this inside a transaction).
+    """
+    edges = []
+    for relationship in relationships:
+        edge = get_edge(relationship.from_activity_id, relationship.to_activity_id, relationship.rel_type)
+        if edge not in edges:
+            edges.append(edge)
+
+    for ancestor_ID, descendant_ID, rel_type in edges:
+        if ancestor_ID == descendant_ID or ActivityClosure.objects.filter(
+            ancestor=descendant_ID
+            , descendant=ancestor_ID
+            , rel_type=rel_type
+        ).exists():
+            raise CycleError(ancestor_ID, descendant_ID)
+
+        # Every path through the new edge joins an ancestor of its top with a descendant of its bottom
+        ancestors = [(ancestor_ID, 0)] + list(ActivityClosure.objects.filter(
+            descendant=ancestor_ID
+            , rel_type=rel_type
+        ).values_list('ancestor', 'depth'))
+        descendants = [(descendant_ID, 0)] + list(ActivityClosure.objects.filter(
+            ancestor=descendant_ID
+            , rel_type=rel_type
+        ).values_list('descendant', 'depth'))
+        existing = dict(
+            ((row_ancestor_ID, row_descendant_ID), (row_ID, depth))
+            for row_ID, row_ancestor_ID, row_descendant_ID, depth in ActivityClosure.objects.filter(
+                ancestor__in=[ID for ID, depth in ancestors]
+                , descendant__in=[ID for ID, depth in descendants]
+                , rel_type=rel_type
+            ).values_list('id', 'ancestor', 'descendant', 'depth')
+        )
+
+        new_rows = []
+        for top_ID, top_depth in ancestors:
+            for bottom_ID, bottom_depth in descendants:
+                depth = top_depth + 1 + bottom_depth
+                if (top_ID, bottom_ID) not in existing:
+                    new_rows.append(ActivityClosure(
+                        ancestor_id=top_ID
+                        , descendant_id=bottom_ID
+                        , rel_type=rel_type
+                        , depth=depth
+                    ))
+                elif existing[(top_ID, bottom_ID)][1] > depth:
+                    # The new edge is a shortcut
+                    ActivityClosure.objects.filter(id=existing[(top_ID, bottom_ID)][0]).update(depth=depth)
+        ActivityClosure.objects.bulk_create(new_rows)
+
+
+def remove_closure_edges(edges):
+    """
+    Remove the edges of deleted relationship rows from the closure, updating only the rows for paths through them:
+    the paths from the ancestors of the top of an edge to the descendants of its bottom are deleted,
+    and the ones still connected through other relationships are added back with their new depth.
+    The edges are removed one after the other, each from the closure of the relationships left by the ones before.
+    """
+    edges = list(OrderedDict.fromkeys(edges))
+    for index, (ancestor_ID, descendant_ID, rel_type) in enumerate(edges):
+        closure = ActivityClosure.objects.filter(rel_type=rel_type)
+        tops = set([ancestor_ID]) | set(closure.filter(descendant=ancestor_ID).values_list('ancestor', flat=True))
+        bottoms = set([descendant_ID]) | set(closure.filter(ancestor=descendant_ID).values_list('descendant', flat=True))
+        closure.filter(ancestor__in=tops, descendant__in=bottoms).delete()
+
+        # A remaining path from a top to a bottom goes down among the tops, leaves them through one relationship
+        # and goes on outside of them, and the rows for both of those parts are unchanged
+        top_paths = dict((top_ID, {top_ID: 0}) for top_ID in tops)
+        for top_ID, lower_ID, depth in closure.filter(
+            ancestor__in=tops
+            , descendant__in=tops
+        ).values_list('ancestor', 'descendant', 'depth'):
+            top_paths[top_ID][lower_ID] = depth
+        bottom_paths = defaultdict(dict, ((bottom_ID, {bottom_ID: 0}) for bottom_ID in bottoms))
+        for activity_ID, bottom_ID, depth in closure.filter(
+            descendant__in=bottoms
+        ).exclude(ancestor__in=tops).values_list('ancestor', 'descendant', 'depth'):
+            bottom_paths[activity_ID][bottom_ID] = depth
+        children = get_children(rel_type, tops)
+        # The rows of the edges removed next are already deleted
+        for parent_ID, child_ID, edge_type in edges[index + 1:]:
+            if edge_type == rel_type and parent_ID in tops:
+                children[parent_ID].add(child_ID)
+
+        depths = {}
+        for top_ID, lower_IDs in top_paths.items():
+            for lower_ID, top_depth in lower_IDs.items():
+                for child_ID in children.get(lower_ID, ()):
+                    if child_ID in tops:
+                        continue
+                    for bottom_ID, bottom_depth in bottom_paths.get(child_ID, {}).items():
+                        depth = top_depth + 1 + bottom_depth
+                        if depth < depths.get((top_ID, bottom_ID), depth + 1):
+                            depths[(top_ID, bottom_ID)] = depth
+        ActivityClosure.objects.bulk_create([
+            ActivityClosure(ancestor_id=top_ID, descendant_id=bottom_ID, rel_type=rel_type, depth=depth)
+            for (top_ID, bottom_ID), depth in depths.items()
+        ])
+
+
+@contextmanager
+def batch_closure_updates():
+    """
+    Update the closure once for all the relationship rows deleted inside the block,
+    e.g. by a queryset .delete() (which sends a signal per row)
+    """
+    if getattr(_local, 'edges', None) is not None:
+        # Already batching
+        yield
+        return
+    _local.edges = edges = []
+    try:
+        yield
+    finally:
+        _local.edges = None
+    remove_closure_edges(edges)
+
+
+def rebuild_closure():
+    """
+    Recompute every closure row from the relationships, e.g. after they were written without signals
+    """
+    for rel_type in CLOSURE_REL_TYPES:
+        children = get_children(rel_type)
+        rows = [
+            ActivityClosure(ancestor_id=ancestor_ID, descendant_id=descendant_ID, rel_type=rel_type, depth=depth)
+            for ancestor_ID in children
+            for descendant_ID, depth in walk(children, ancestor_ID).items()
+        ]
+        ActivityClosure.objects.filter(rel_type=rel_type).delete()
+        ActivityClosure.objects.bulk_create(rows)
+
+
+def walk(children, start_ID):
+    """
+    Return {activity id: depth} for every activity below `start_ID` (breadth first, so depths are shortest)
+    """
+    depths = {start_ID: 0}
+    queue = deque([start_ID])
+    while queue:
+        activity_ID = queue.popleft()
+        for child_ID in children.get(activity_ID, ()):
+            if child_ID not in depths:
+                depths[child_ID] = depths[activity_ID] + 1
+                queue.append(child_ID)
+    del depths[start_ID]
+    return depths
+
+
+def get_children(rel_type, parent_IDs=None):
+    """
+    Return {activity id: ids of the activities right below it} for a closure type and the given parent activities
+    (all of them by default)
+    """
+    children = defaultdict(set)
+    # The parent is the to activity of a relationship, except for SUP rows
+    parents = Q()
+    for edge_type in CLOSURE_REL_TYPES[rel_type]:
+        if parent_IDs is None:
+            parents |= Q(rel_type=edge_type)
+            continue
+        parent_field = 'from_activity__in' if edge_type == 'SUP' else 'to_activity__in'
+        parents |= Q(rel_type=edge_type, **{parent_field: parent_IDs})
+    relationships = ActivityRelationship.objects.filter(parents).values_list('from_activity', 'to_activity', 'rel_type')
+    for relationship in relationships:
+        ancestor_ID, descendant_ID, edge_type = get_edge(*relationship)
+        children[ancestor_ID].add(descendant_ID)
+    return children
+
+
+""" Signal Receivers """
+
+# Relationships created with bulk_create() send no signals and are added with add_closure_edges()
+@receiver(pre_save, sender=ActivityRelationship)
+def relationship_saving(sender, instance, **kwargs):
+    # An edited row leaves the closure with its old edge
+    if instance.pk is not None:
+        row = ActivityRelationship.objects.filter(pk=instance.pk).values_list(
+            'from_activity', 'to_activity', 'rel_type'
+        ).first()
+        instance._old_edge = get_edge(*row) if row else None
+
+
+@receiver(post_save, sender=ActivityRelationship)
+def relationship_saved(sender, instance, **kwargs):
+    old_edge = instance.__dict__.pop('_old_edge', None)
+    edge = get_edge(instance.from_activity_id, instance.to_activity_id, instance.rel_type)
+    if old_edge != edge:
+        if old_edge is not None:
+            remove_closure_edges([old_edge])
+        add_closure_edges([instance])
+
+
+@receiver(post_delete, sender=ActivityRelationship)
+def relationship_deleted(sender, instance, **kwargs):
+    edge = get_edge(instance.from_activity_id, instance.to_activity_id, instance.rel_type)
+    edges = getattr(_local, 'edges', None)
+    if edges is not None:
+        edges.append(edge)
+    else:
+        remove_closure_edges([edge])
+
+
+@receiver(pre_delete, sender=Activity)
+def activity_deleting(sender, instance, **kwargs):
+    # Removing the edges of its relationships needs its closure rows, which are deleted with it
+    with batch_closure_updates():
+        ActivityRelationship.objects.filter(Q(from_activity=instance) | Q(to_activity=instance)).delete()
@@ -0,0 +1,45 @@
+import threading
+from collections import OrderedDict
+
+from django.core.signals import request_finished
+from django.db import transaction
+from django.dispatch import receiver
+
+# Calls waiting for the transaction of the current thread to end, by key
+_local = threading.local()
+
+
+def in_transaction():
+    return transaction.get_connection().in_atomic_block
+
+
+def after_commit(key, func):
+    """
+    Call `func` now and, inside a transaction, once more after it ends.
+
+    Invalidating a cache before the write commits leaves a window in which a concurrent reader
+    caches the old rows again. Django 1.7 has no commit hook, so the call is repeated when the request finishes
+    or on the next `run_pending()` made outside a transaction, whichever comes first.
+    Calls queued with the same key run once.
+    """
+    func()
+    if in_transaction():
+        _local.__dict__.setdefault('pending', OrderedDict())[key] = func
+
+
+def run_pending(force=False):
+    """
+    Repeat the calls queued by `after_commit`, unless their transaction is still open (or `force`)
+    """
+    pending = _local.__dict__.get('pending')
+    if not pending or (in_transaction() and not force):
+        return
+    _local.pending = OrderedDict()
+    for func in pending.values():
+        func()
+
+
+@receiver(request_finished)
+def request_ended(sender, **kwargs):
+    # The transactions of a request are over once its response is sent
+    run_pending(force=True)
@@ -0,0 +1,134 @@
+import threading
+import uuid
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+
+from lessons.commits import after_commit, run_pending
+
+# Row "id" standing for every row of a table, e.g. for lists, which change when rows are added
+TABLE = '*'
+
+# Cache backends whose entries only the current process sees
+LOCAL_CACHE_BACKENDS = (
+    'django.core.cache.backends.locmem.LocMemCache'
+    , 'django.core.cache.backends.dummy.DummyCache'
+)
+
+# Seconds cached payloads are kept for by default, with a shared cache
+DEFAULT_TIMEOUT = 600
+
+# Changed by every bump: a payload is only cached if no row changed while it was computed
+GENERATION_KEY = 'lessons:generation'
+
+# Sets of the rows being recorded by the current thread, innermost last
+_local = threading.local()
+
+
+def is_cache_shared():
+    """
+    Whether the default cache is shared between processes
+    """
+    return settings.CACHES['default']['BACKEND'] not in LOCAL_CACHE_BACKENDS
+
+
+def get_timeout(setting_name, default=DEFAULT_TIMEOUT):
+    """
+    Return the timeout set by `setting_name` for cached payloads. By default they are only cached
+    (for `default` seconds) with a cache shared between processes: in a per-process cache, what a write
+    invalidates is only invalidated in the writing process, and the others would keep serving the old payloads.
+    """
+    return getattr(settings, setting_name, default if is_cache_shared() else 0)
+
+
+def row_key(model, row_ID):
+    return 'lessons:row:{}:{}'.format(model._meta.concrete_model._meta.model_name, row_ID)
+
+
+@contextmanager
+def recording():
+    """
+    Record the keys of the model rows serialized inside the block:
+
+        with recording() as row_keys:
+            data = ActivitySerializer(activity).data
+    """
+    stack = _local.__dict__.setdefault('stack', [])
+    row_keys = set()
+    stack.append(row_keys)
+    try:
+        yield row_keys
+    finally:
+        stack.pop()
+
+
+def record(instance):
+    """
+    Add a row to everything being recorded (a payload embeds the rows of the payloads it contains)
+    """
+    key = row_key(type(instance), instance.pk)
+    for row_keys in _local.__dict__.get('stack', ()):
+        row_keys.add(key)
+
+
+def get_generation():
+    """
+    Return the current generation, to be read before computing a payload and compared after reading its versions:
+
+        generation = get_generation()
+        with recording() as row_keys:
+            data = ...
+        versions = get_versions(row_keys)
+        if get_generation() == generation:
+            ...cache data with versions...
+
+    A row written while the payload was computed could otherwise get its new version
+    recorded with its old data.
+    """
+    run_pending()
+    return cache.get(GENERATION_KEY)
+
+
+def get_versions(row_keys):
+    """
+    Return {row key: current version}, starting new versions for the rows that have none
+    """
+    run_pending()
+    versions = cache.get_many(list(row_keys))
+    missing = dict((key, uuid.uuid4().hex) for key in row_keys if key not in versions)
+    if missing:
+        cache.set_many(missing, None)
+        versions.update(missing)
+    return versions
+
+
+def is_current(versions):
+    """
+    Whether none of the rows recorded with `versions` changed since
+    """
+    run_pending()
+    return cache.get_many(list(versions)) == versions
+
+
+def bump(model, row_IDs):
+    """
+    Start new versions of the given rows and of their table, which outdates exactly the payloads that embedded them.
+    Inside a transaction they are started again once it is over (see lessons/commits.py),
+    in case a concurrent request cached the old rows meanwhile.
+    """
+    keys = [row_key(model, row_ID) for row_ID in set(row_IDs)]
+    if not keys:
+        return
+    keys += [row_key(model, TABLE), GENERATION_KEY]
+    after_commit(tuple(keys), lambda: cache.set_many(dict((key, uuid.uuid4().hex) for key in keys), None))
+
+
+class RecordDependenciesMixin(object):
+    """
+    Record every object a serializer outputs (see `recording`)
+    """
+
+    def to_representation(self, instance):
+        record(instance)
+        return super(RecordDependenciesMixin, self).to_representation(instance)
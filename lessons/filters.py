@@ -0,0 +1,70 @@
+import django_filters
+
+from rest_framework.exceptions import ParseError
+from rest_framework.filters import BaseFilterBackend
+
+from lessons.bitmaps import TagQueryError, bits_to_IDs, count_bits, tag_bitmap_index
+from lessons.models import Activity, Curriculum
+
+
+class ActivityFilter(django_filters.FilterSet):
+    """
+    Filters for listing activities, e.g. /api/activities/?tag_category=Language&curriculum=1
+    """
+    tag = django_filters.NumberFilter(name='tags')
+    tag_name = django_filters.CharFilter(name='tags__name')
+    # An activity can have several tags in the same category
+    tag_category = django_filters.CharFilter(name='tags__category', distinct=True)
+    curriculum = django_filters.NumberFilter(name='curriculum_relationships__curriculum')
+
+    class Meta:
+        model = Activity
+        fields = ('tag', 'tag_name', 'tag_category', 'category', 'curriculum')
+
+
+class TagQueryFilter(BaseFilterBackend):
+    """
+    Filter activities with a boolean tag query, evaluated on the tag bitmap index, e.g.
+    /api/activities/?tag_query=python AND (beginner OR "30 minutes") AND NOT offline
+    Matching activities are listed in id order.
+    """
+    query_param = 'tag_query'
+    # Most matching activities filtered by id (e.g. SQLite allows 999 query parameters)
+    max_IDs = 500
+
+    def filter_queryset(self, request, queryset, view):
+        expression = request.query_params.get(self.query_param)
+        if expression is None:
+            return queryset
+        try:
+            with tag_bitmap_index.lock:
+                bits = tag_bitmap_index.query_bits(expression)
+                if count_bits(bits) > self.max_IDs:
+                    # Too many ids to pass as query parameters: let the database match the tags itself
+                    return queryset.filter(tag_bitmap_index.query_filter(expression)).order_by('id')
+        except TagQueryError as e:
+            raise ParseError(e.args[0])
+        return queryset.filter(id__in=bits_to_IDs(bits)).order_by('id')
+
+
+def filter_grade(queryset, value):
+    """
+    Only keep curricula taught in the given grade
+    """
+    if value in ([], (), {}, None, ''):
+        return queryset
+    return queryset.filter(lower_grade__lte=value, upper_grade__gte=value)
+
+
+class CurriculumFilter(django_filters.FilterSet):
+    """
+    Filters for listing curricula, e.g. /api/curricula/?grade=3&tag_name=Python
+    Tags are the Language and Technology tags curricula inherit from their activities.
+    """
+    grade = django_filters.NumberFilter(action=filter_grade)
+    tag = django_filters.NumberFilter(name='tags')
+    tag_name = django_filters.CharFilter(name='tags__name')
+
+    class Meta:
+        model = Curriculum
+        fields = ('grade', 'lower_grade', 'upper_grade', 'tag', 'tag_name')
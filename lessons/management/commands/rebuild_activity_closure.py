@@ -0,0 +1,14 @@
+from django.db import transaction
+from django.core.management.base import NoArgsCommand
+
+from lessons.closure import rebuild_closure
+from lessons.models import ActivityClosure
+
+
+class Command(NoArgsCommand):
+    help = "Recompute the activity closure table from the activity relationships."
+
+    def handle_noargs(self, **options):
+        with transaction.atomic():
+            rebuild_closure()
+        self.stdout.write("Stored {} closure rows.".format(ActivityClosure.objects.count()))
@@ -0,0 +1,17 @@
+from django.core.management.base import NoArgsCommand
+
+from lessons.changes import ALL, record_changes
+from lessons.search import search_index
+
+
+class Command(NoArgsCommand):
+    help = "Rebuild the activity search index from the database (in every process, on its next search)."
+
+    def handle_noargs(self, **options):
+        # Other processes rebuild when they see this change
+        record_changes(ALL, [0])
+        search_index.rebuild()
+        self.stdout.write("Indexed {} activities ({} terms).".format(
+            len(search_index.documents),
+            len(search_index.postings)
+        ))
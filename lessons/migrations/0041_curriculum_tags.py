@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+def inherit_curriculum_tags(apps, schema_editor):
+    """
+    Give existing curricula the Language and Technology tags of their activities
+    """
+    Curriculum = apps.get_model('lessons', 'Curriculum')
+    CurriculumActivityRelationship = apps.get_model('lessons', 'CurriculumActivityRelationship')
+    pairs = set(
+        CurriculumActivityRelationship.objects
+        .filter(activity__tags__category__in=('Language', 'Technology'))
+        .values_list('curriculum', 'activity__tags')
+    )
+    Curriculum.tags.through.objects.bulk_create([
+        Curriculum.tags.through(curriculum_id=curriculum_ID, tag_id=tag_ID)
+        for curriculum_ID, tag_ID in pairs
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lessons', '0040_auto_20150419_2231'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='curriculum',
+            name='tags',
+            field=models.ManyToManyField(related_name='curricula', editable=False, to='lessons.Tag', blank=True),
+            preserve_default=True,
+        ),
+        migrations.RunPython(inherit_curriculum_tags, lambda apps, schema_editor: None),
+    ]
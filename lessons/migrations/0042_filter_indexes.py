@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lessons', '0041_curriculum_tags'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='activity',
+            name='category',
+            field=models.CharField(blank=True, max_length=15, null=True, db_index=True, choices=[(b'Offline', b'Offline'), (b'Online', b'Online'), (b'Discussion', b'Discussion'), (b'Extension', b'Extension')]),
+            preserve_default=True,
+        ),
+        migrations.AlterField(
+            model_name='tag',
+            name='category',
+            field=models.CharField(db_index=True, max_length=15, choices=[(b'Language', b'Language'), (b'Technology', b'Technology'), (b'Difficulty', b'Difficulty'), (b'Length', b'Length'), (b'Concept', b'Concept'), (b'Misc', b'Miscellaneous')]),
+            preserve_default=True,
+        ),
+        migrations.AlterIndexTogether(
+            name='curriculum',
+            index_together=set([('lower_grade', 'upper_grade')]),
+        ),
+    ]
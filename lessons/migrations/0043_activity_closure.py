@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from collections import defaultdict, deque
+
+from django.db import models, migrations
+
+
+def build_activity_closure(apps, schema_editor):
+    """
+    Record every (ancestor, descendant) pair of the existing sub-activity and extension relationships
+    """
+    ActivityRelationship = apps.get_model('lessons', 'ActivityRelationship')
+    ActivityClosure = apps.get_model('lessons', 'ActivityClosure')
+    children = {'SUB': defaultdict(set), 'EXT': defaultdict(set)}
+    for from_ID, to_ID, rel_type in ActivityRelationship.objects.values_list('from_activity', 'to_activity', 'rel_type'):
+        if rel_type == 'SUP':
+            children['SUB'][from_ID].add(to_ID)
+        elif rel_type in children:
+            children[rel_type][to_ID].add(from_ID)
+
+    rows = []
+    for rel_type, edges in children.items():
+        for ancestor_ID in list(edges):
+            depths = {ancestor_ID: 0}
+            queue = deque([ancestor_ID])
+            while queue:
+                activity_ID = queue.popleft()
+                for child_ID in edges.get(activity_ID, ()):
+                    if child_ID not in depths:
+                        depths[child_ID] = depths[activity_ID] + 1
+                        queue.append(child_ID)
+                        rows.append(ActivityClosure(
+                            ancestor_id=ancestor_ID
+                            , descendant_id=child_ID
+                            , rel_type=rel_type
+                            , depth=depths[child_ID]
+                        ))
+    ActivityClosure.objects.bulk_create(rows)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lessons', '0042_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ActivityClosure',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('rel_type', models.CharField(max_length=3, choices=[(b'SUB', b'sub-activity'), (b'EXT', b'extension')])),
+                ('depth', models.PositiveIntegerField()),
+                ('ancestor', models.ForeignKey(related_name='closure_descendants', to='lessons.Activity')),
+                ('descendant', models.ForeignKey(related_name='closure_ancestors', to='lessons.Activity')),
+            ],
+            options={
+            },
+            bases=(models.Model,),
+        ),
+        migrations.AlterUniqueTogether(
+            name='activityclosure',
+            unique_together=set([('ancestor', 'rel_type', 'descendant')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='activityclosure',
+            index_together=set([('descendant', 'rel_type')]),
+        ),
+        migrations.RunPython(build_activity_closure, lambda apps, schema_editor: None),
+    ]
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lessons', '0043_activity_closure'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IndexChange',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('version', models.PositiveIntegerField(db_index=True)),
+                ('token', models.CharField(max_length=32)),
+                ('kind', models.CharField(max_length=10, choices=[(b'activity', b'activity'), (b'tag', b'tag'), (b'material', b'material'), (b'resource', b'resource'), (b'all', b'all')])),
+                ('object_id', models.IntegerField()),
+            ],
+            options={
+            },
+            bases=(models.Model,),
+        ),
+        migrations.CreateModel(
+            name='IndexVersion',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('version', models.PositiveIntegerField(default=0)),
+                ('token', models.CharField(max_length=32, blank=True)),
+            ],
+            options={
+            },
+            bases=(models.Model,),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lessons', '0044_index_changes'),
+    ]
+
+    operations = [
+        migrations.DeleteModel(
+            name='IndexVersion',
+        ),
+        migrations.RemoveField(
+            model_name='indexchange',
+            name='version',
+        ),
+    ]
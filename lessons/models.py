@@ -1,4 +1,8 @@
 from django.db import models
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from lessons.signals import curricula_changed
 
 
 class Tag(models.Model):
@@ -20,7 +24,7 @@ class Tag(models.Model):
     )
     # REQUIRED
     name = models.CharField(max_length=50, unique=True)
-    category = models.CharField(max_length=15, choices=CATEGORIES)
+    category = models.CharField(max_length=15, choices=CATEGORIES, db_index=True)
     # A tag has a many-to-many relationship with activities (DEFINED IN ACTIVITY)
 
     # OPTIONAL
@@ -79,7 +83,7 @@ class Activity(models.Model):
     tags = models.ManyToManyField(Tag, related_name='activities')
     # OPTIONAL
     description = models.TextField(blank=True)
-    category = models.CharField(max_length=15, choices=CATEGORIES, blank=True, null=True)
+    category = models.CharField(max_length=15, choices=CATEGORIES, blank=True, null=True, db_index=True)
     teaching_notes = models.TextField(blank=True)
     video_url = models.URLField(blank=True)  # Assuming link to YouTube
     image = models.ImageField(upload_to='activity_images', blank=True)
@@ -102,10 +106,12 @@ class Activity(models.Model):
             return self.name
 
     def get_curricula(self):
-        return [relationship.curriculum.id for relationship in self.curriculum_relationships.all()]
+        # Read the foreign key column directly so a prefetched `curriculum_relationships` needs no further queries
+        return [relationship.curriculum_id for relationship in self.curriculum_relationships.all()]
 
     def get_relationships(self):
-        return [(relationship.from_activity.id, relationship.get_rel_type_display()) for relationship in self.relationships_to.all()]
+        # Read the foreign key column directly so a prefetched `relationships_to` needs no further queries
+        return [(relationship.from_activity_id, relationship.get_rel_type_display()) for relationship in self.relationships_to.all()]
 
 
 class Step(models.Model):
@@ -153,15 +159,23 @@ class Curriculum(models.Model):
     # OPTIONAL
     tagline = models.CharField(max_length=100, blank=True)
     activities = models.ManyToManyField(Activity, through="CurriculumActivityRelationship", blank=True, related_name='curricula')
+    # Language and Technology tags inherited from the activities (kept up to date by update_curriculum_tags)
+    tags = models.ManyToManyField(Tag, blank=True, editable=False, related_name='curricula')
 
     class Meta:
+        # Backs filtering curricula by grade
+        index_together = ('lower_grade', 'upper_grade')
         verbose_name_plural = "curricula"
 
     def __unicode__(self):
         return self.name
 
     def get_activities(self):
-        return [relationship.activity.id for relationship in self.activity_relationships.all()]
+        return [relationship.activity_id for relationship in self.activity_relationships.all()]
+
+    def get_ordered_activities(self):
+        # Relationships are ordered by `number` (see CurriculumActivityRelationship.Meta)
+        return [relationship.activity for relationship in self.activity_relationships.all()]
 
 
 class ActivityRelationship(models.Model):
@@ -190,10 +204,42 @@ class ActivityRelationship(models.Model):
         return self.from_activity.name + " is a " + self.get_rel_type_display() + " of " + self.to_activity.name
 
 
+class ActivityClosure(models.Model):
+    """
+    Transitive closure of the activity relationships (kept up to date by lessons.closure)
+    There is a row for every activity reachable from another through relationships of one type:
+    SUB: descendant is a sub-activity (of a sub-activity...) of ancestor
+    EXT: descendant is an extension (of an extension...) of ancestor
+    """
+    REL_TYPES = (
+        ('SUB', 'sub-activity'),
+        ('EXT', 'extension'),
+    )
+    # ALL REQUIRED
+    ancestor = models.ForeignKey(Activity, related_name='closure_descendants')
+    descendant = models.ForeignKey(Activity, related_name='closure_ancestors')
+    rel_type = models.CharField(max_length=3, choices=REL_TYPES)
+    # Number of relationships on the shortest path from ancestor to descendant
+    depth = models.PositiveIntegerField()
+
+    class Meta:
+        # Indexes for listing the descendants and the ancestors of an activity
+        unique_together = ('ancestor', 'rel_type', 'descendant')
+        index_together = ('descendant', 'rel_type')
+
+    def __unicode__(self):
+        return "{} -> {} ({}, depth {})".format(self.ancestor_id, self.descendant_id, self.rel_type, self.depth)
+
+
 class CurriculumActivityRelationship(models.Model):
     """
     Relationship to capture the ordering of activities within a curriculum.
+    `number` is a sort key: moved activities get a number between their neighbours', so numbers
+    may have gaps and the position shown by the API is the rank within the curriculum (1, 2, 3...).
     """
+    # Space left between numbers when a curriculum is renumbered
+    NUMBER_GAP = 1024
+
     # ALL REQUIRED
     curriculum = models.ForeignKey(Curriculum, related_name='activity_relationships')
     activity = models.ForeignKey(Activity, related_name='curriculum_relationships')
@@ -211,3 +257,117 @@ class CurriculumActivityRelationship(models.Model):
             self.number,
             self.curriculum.name
         )
+
+    def get_position(self):
+        # Querysets can select `position` in bulk (see CurriculumActivityRelationshipViewSet)
+        if not hasattr(self, 'position'):
+            self.position = CurriculumActivityRelationship.objects.filter(
+                curriculum=self.curriculum_id
+                , number__lte=self.number
+            ).count()
+        return self.position
+
+
+class IndexChange(models.Model):
+    """
+    Object changed by a write to the activity data, for the in-process indexes to catch up (see lessons.changes).
+    Ids order the changes; `token` is new for every write, so an id reused after a rollback is told apart.
+    """
+    KINDS = (
+        ('activity', 'activity'),
+        ('tag', 'tag'),
+        ('material', 'material'),
+        ('resource', 'resource'),
+        ('all', 'all'),
+    )
+    # ALL REQUIRED
+    token = models.CharField(max_length=32)
+    kind = models.CharField(max_length=10, choices=KINDS)
+    object_id = models.IntegerField()
+
+    def __unicode__(self):
+        return "{} {} changed (change {})".format(self.kind, self.object_id, self.id)
+
+
+""" Curriculum Tag Inheritance """
+
+# Tag categories a curriculum inherits from its activities
+INHERITED_TAG_CATEGORIES = ('Language', 'Technology')
+
+
+def update_curriculum_tags(curriculum_IDs):
+    """
+    Bring the inherited tags of the given curricula up to date with the tags of their activities.
+    Only rows that change are written.
+    """
+    curriculum_IDs = set(curriculum_IDs)
+    if not curriculum_IDs:
+        return
+    CurriculumTag = Curriculum.tags.through
+
+    wanted = set(
+        CurriculumActivityRelationship.objects
+        .filter(curriculum__in=curriculum_IDs, activity__tags__category__in=INHERITED_TAG_CATEGORIES)
+        .values_list('curriculum', 'activity__tags')
+    )
+    current = dict(
+        ((curriculum_ID, tag_ID), row_ID)
+        for row_ID, curriculum_ID, tag_ID
+        in CurriculumTag.objects.filter(curriculum__in=curriculum_IDs).values_list('id', 'curriculum', 'tag')
+    )
+
+    stale_IDs = [row_ID for key, row_ID in current.items() if key not in wanted]
+    if stale_IDs:
+        CurriculumTag.objects.filter(id__in=stale_IDs).delete()
+    new_rows = [
+        CurriculumTag(curriculum_id=curriculum_ID, tag_id=tag_ID)
+        for curriculum_ID, tag_ID in wanted
+        if (curriculum_ID, tag_ID) not in current
+    ]
+    if new_rows:
+        CurriculumTag.objects.bulk_create(new_rows)
+    if stale_IDs or new_rows:
+        curricula_changed.send(sender=CurriculumTag, curriculum_IDs=curriculum_IDs)
+
+
+@receiver(m2m_changed, sender=Activity.tags.through)
+def activity_tags_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Update curricula when tags are added to or removed from activities
+    """
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        # activity.tags changed
+        curricula = CurriculumActivityRelationship.objects.filter(activity=instance)
+    elif pk_set is not None:
+        # tag.activities changed
+        curricula = CurriculumActivityRelationship.objects.filter(activity__in=pk_set)
+    else:
+        # tag.activities was cleared: only curricula that inherited the tag can change
+        curricula = Curriculum.tags.through.objects.filter(tag=instance)
+    update_curriculum_tags(curricula.values_list('curriculum', flat=True))
+
+
+@receiver(post_save, sender=Tag)
+def tag_saved(sender, instance, created, **kwargs):
+    """
+    Update curricula when the category of a tag changes
+    """
+    if created:
+        return
+    curriculum_IDs = set(
+        CurriculumActivityRelationship.objects.filter(activity__tags=instance).values_list('curriculum', flat=True)
+    )
+    curriculum_IDs.update(Curriculum.tags.through.objects.filter(tag=instance).values_list('curriculum', flat=True))
+    update_curriculum_tags(curriculum_IDs)
+
+
+@receiver(post_save, sender=CurriculumActivityRelationship)
+@receiver(post_delete, sender=CurriculumActivityRelationship)
+def curriculum_activities_changed(sender, instance, **kwargs):
+    """
+    Update a curriculum when an activity is added to or removed from it
+    (bulk_create() sends no signals, so bulk inserts call update_curriculum_tags() themselves)
+    """
+    update_curriculum_tags([instance.curriculum_id])
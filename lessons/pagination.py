@@ -0,0 +1,110 @@
+import base64
+import json
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+from rest_framework.exceptions import ParseError
+from rest_framework.response import Response
+from rest_framework.templatetags.rest_framework import replace_query_param
+
+
+class KeysetPaginationMixin(object):
+    """
+    Opt-in keyset (cursor) pagination for viewset list actions.
+
+    Lists are returned whole unless the request asks for a page with `?page_size=` or `?cursor=`.
+    Pages are ordered by `keyset_fields` (which should be unique and indexed) and each page
+    starts right after the last row of the previous one, so deep pages cost the same as the first:
+    {"next": "<url of the next page or null>", "results": [...]}
+    """
+    keyset_fields = ('id',)
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    # Read from LESSONS_PAGE_SIZE / LESSONS_MAX_PAGE_SIZE on each request unless set on the viewset
+    page_size = None
+    max_page_size = None
+
+    def list(self, request, *args, **kwargs):
+        params = request.query_params
+        if self.cursor_query_param not in params and self.page_size_query_param not in params:
+            return super(KeysetPaginationMixin, self).list(request, *args, **kwargs)
+
+        queryset = self.filter_queryset(self.get_queryset())
+        objects, next_cursor = self.paginate_by_keyset(queryset)
+        serializer = self.get_serializer(objects, many=True)
+
+        next_url = None
+        if next_cursor is not None:
+            next_url = replace_query_param(request.build_absolute_uri(), self.cursor_query_param, next_cursor)
+        return Response(OrderedDict([
+            ('next', next_url),
+            ('results', serializer.data),
+        ]))
+
+    def paginate_by_keyset(self, queryset):
+        """
+        Return the objects on the requested page and the cursor of the next page (None on the last page).
+        """
+        page_size = self.get_page_size()
+        queryset = queryset.order_by(*self.keyset_fields)
+
+        cursor = self.request.query_params.get(self.cursor_query_param)
+        if cursor:
+            fields = [queryset.model._meta.get_field(name) for name in self.keyset_fields]
+            queryset = queryset.filter(self.get_keyset_filter(decode_cursor(cursor, fields)))
+
+        # Fetch one extra row to know whether there is another page
+        objects = list(queryset[:page_size + 1])
+        if len(objects) <= page_size:
+            return objects, None
+        objects = objects[:page_size]
+        last = objects[-1]
+        return objects, encode_cursor([last.serializable_value(field) for field in self.keyset_fields])
+
+    def get_keyset_filter(self, values):
+        """
+        Build the filter selecting rows that come after `values` in keyset order, e.g. for (a, b):
+        a > x OR (a = x AND b > y)
+        """
+        keyset_filter = Q()
+        for i, field in enumerate(self.keyset_fields):
+            condition = Q(**{field + '__gt': values[i]})
+            for previous_field, previous_value in zip(self.keyset_fields[:i], values[:i]):
+                condition &= Q(**{previous_field: previous_value})
+            keyset_filter |= condition
+        return keyset_filter
+
+    def get_page_size(self):
+        default_page_size = self.page_size or getattr(settings, 'LESSONS_PAGE_SIZE', 100)
+        max_page_size = self.max_page_size or getattr(settings, 'LESSONS_MAX_PAGE_SIZE', 1000)
+        try:
+            page_size = int(self.request.query_params.get(self.page_size_query_param, default_page_size))
+        except ValueError:
+            raise ParseError('Invalid page size.')
+        if page_size < 1:
+            raise ParseError('Invalid page size.')
+        return min(page_size, max_page_size)
+
+
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values))
+
+
+def decode_cursor(cursor, fields):
+    """
+    Return the values of a cursor, converted to the types of the model `fields` it orders by.
+    Raises ParseError if the cursor was not made by encode_cursor for these fields.
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(str(cursor)))
+    except (TypeError, ValueError):
+        raise ParseError('Invalid cursor.')
+    if not isinstance(values, list) or len(values) != len(fields):
+        raise ParseError('Invalid cursor.')
+    try:
+        return [field.to_python(value) for field, value in zip(fields, values)]
+    except ValidationError:
+        raise ParseError('Invalid cursor.')
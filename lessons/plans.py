@@ -0,0 +1,116 @@
+from collections import OrderedDict
+
+from django.core.cache import cache
+
+from lessons import dependencies
+from lessons.models import Activity, Step
+
+
+class StepCycleError(ValueError):
+    """
+    Raised when the steps of an activity lead back to an activity being expanded
+    """
+
+
+class LessonPlans(object):
+    """
+    Compiled lesson plans: the steps of an activity with the steps of each step activity
+    expanded in place, recursively, in `number` order.
+
+    Steps are loaded one tree level at a time (one query per level, not per activity) and the
+    expansion of an activity used by several steps is only computed once. Compiled plans are
+    cached with Django's cache framework along with the versions of the activities and steps they include
+    (see lessons/dependencies.py), and only served while none of those changed.
+    Plans are only cached with a cache shared between processes, unless LESSONS_PLAN_CACHE_TIMEOUT
+    is set (0 turns the cache off).
+    """
+
+    def get(self, activity_ID):
+        """
+        Return the plan of an activity, or None if the activity does not exist
+        """
+        timeout = dependencies.get_timeout('LESSONS_PLAN_CACHE_TIMEOUT')
+        key = 'lessons:plan:{}'.format(activity_ID)
+        if timeout:
+            entry = cache.get(key)
+            if entry is not None and dependencies.is_current(entry['versions']):
+                return entry['plan']
+
+        generation = dependencies.get_generation()
+        plan, activity_IDs, step_IDs = self.compile(activity_ID)
+        if not plan and not Activity.objects.filter(id=activity_ID).exists():
+            return None
+        if timeout:
+            row_keys = [dependencies.row_key(Activity, ID) for ID in activity_IDs]
+            row_keys += [dependencies.row_key(Step, ID) for ID in step_IDs]
+            versions = dependencies.get_versions(row_keys)
+            # Activities or steps written meanwhile could be recorded with their new versions but old data
+            if dependencies.get_generation() == generation:
+                cache.set(key, {'plan': plan, 'versions': versions}, timeout)
+        return plan
+
+    def load_steps(self, activity_ID):
+        """
+        Return {activity id: [step values, ...] in number order} for every activity reachable from `activity_ID`
+        """
+        steps = {}
+        level = set([activity_ID])
+        while level:
+            for activity_ID in level:
+                steps[activity_ID] = []
+            rows = Step.objects.filter(activity__in=level).order_by('number', 'id').values(
+                'id', 'activity', 'number', 'text', 'step_activity', 'step_activity__name'
+            )
+            for row in rows:
+                steps[row['activity']].append(row)
+            level = set(row['step_activity'] for row in rows if row['step_activity'] is not None) - set(steps)
+        return steps
+
+    def compile(self, activity_ID):
+        """
+        Return the flat plan of an activity with the ids of the activities and steps it includes.
+        Raises StepCycleError if a step activity contains itself.
+        """
+        steps = self.load_steps(activity_ID)
+        # activity id -> its expanded steps as (depth, numbers, step values), relative to the activity
+        expanded = {}
+        expanding = []
+
+        def expand(activity_ID):
+            if activity_ID in expanded:
+                return expanded[activity_ID]
+            if activity_ID in expanding:
+                raise StepCycleError(u'The steps of activity {} lead back to activity {}.'.format(
+                    expanding[-1], activity_ID
+                ))
+            expanding.append(activity_ID)
+            items = []
+            for step in steps[activity_ID]:
+                items.append((0, (step['number'],), step))
+                if step['step_activity'] is not None:
+                    items.extend(
+                        (depth + 1, (step['number'],) + numbers, nested)
+                        for depth, numbers, nested in expand(step['step_activity'])
+                    )
+            expanding.pop()
+            expanded[activity_ID] = items
+            return items
+
+        plan = [
+            OrderedDict([
+                ('id', step['id']),
+                ('number', '.'.join(str(number) for number in numbers)),
+                ('depth', depth),
+                ('text', step['text']),
+                ('activity', step['activity']),
+                ('step_activity', step['step_activity']),
+                ('step_activity_name', step['step_activity__name']),
+            ])
+            for depth, numbers, step in expand(activity_ID)
+        ]
+        step_IDs = set(step['id'] for activity_steps in steps.values() for step in activity_steps)
+        return plan, set(steps), step_IDs
+
+
+lesson_plans = LessonPlans()
+
@@ -0,0 +1,204 @@
+import math
+import re
+import threading
+from collections import defaultdict
+
+from django.utils.html import escape
+
+from lessons.changes import ChangeLogIndex
+from lessons.models import Activity
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def tokenize(text):
+    """
+    Split text into lowercase words
+    """
+    return [token.lower() for token in TOKEN_RE.findall(text or '')]
+
+
+class SearchIndex(ChangeLogIndex):
+    """
+    In-process inverted index over activities, ranked with BM25.
+
+    Each activity is indexed by its name, description and teaching notes and by the names of its tags,
+    materials and resources. Searching only reads the postings of the query terms.
+    The index is built on first use and then catches up with the changes recorded in the database
+    (see lessons.changes): one query per search when nothing changed.
+    """
+    # How much one occurrence of a word in each field counts towards its term frequency
+    field_weights = {
+        'name': 3,
+        'tags': 2,
+        'description': 1,
+        'teaching_notes': 1,
+        'materials': 1,
+        'resources': 1,
+    }
+    # BM25 parameters: term frequency saturation and document length normalization
+    k1 = 1.2
+    b = 0.75
+    # Characters of context shown around the first match of a highlight
+    snippet_length = 160
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.clear()
+
+    def clear(self):
+        """
+        Empty the index (it will be rebuilt on next use)
+        """
+        with self.lock:
+            self.version = None
+            # term -> {activity id: weighted term frequency}
+            self.postings = defaultdict(dict)
+            # activity id -> {'name', 'fields', 'terms', 'length', 'related'}
+            self.documents = {}
+            # ('tag' / 'material' / 'resource', id) -> ids of the activities that are indexed with its name
+            self.related = defaultdict(set)
+            self.total_length = 0
+
+    def load(self):
+        self.clear()
+        for activity in Activity.objects.prefetch_related('tags', 'materials', 'resources'):
+            self.add(activity)
+
+    def apply_changes(self, changes):
+        activity_IDs = set(changes.get('activity', ()))
+        for kind in ('tag', 'material', 'resource'):
+            for obj_ID in changes.get(kind, ()):
+                # The activities indexed with its old name (activities it was added to are changes of their own)
+                activity_IDs |= self.related.pop((kind, obj_ID), set())
+        self.update(activity_IDs)
+
+    def update(self, activity_IDs):
+        """
+        Re-index the given activities from the database (removing the ones that no longer exist)
+        """
+        activity_IDs = set(activity_IDs)
+        with self.lock:
+            if not activity_IDs:
+                return
+            for activity_ID in activity_IDs:
+                self.remove(activity_ID)
+            for activity in Activity.objects.filter(id__in=activity_IDs).prefetch_related('tags', 'materials', 'resources'):
+                self.add(activity)
+
+    def add(self, activity):
+        related = {
+            'tag': activity.tags.all(),
+            'material': activity.materials.all(),
+            'resource': activity.resources.all(),
+        }
+        fields = {
+            'name': activity.name,
+            'description': activity.description,
+            'teaching_notes': activity.teaching_notes,
+            'tags': ' '.join(tag.name for tag in related['tag']),
+            'materials': ' '.join(material.name for material in related['material']),
+            'resources': ' '.join(resource.name for resource in related['resource']),
+        }
+
+        terms = defaultdict(int)
+        for field_name, text in fields.items():
+            for token in tokenize(text):
+                terms[token] += self.field_weights[field_name]
+        length = sum(terms.values())
+
+        for term, frequency in terms.items():
+            self.postings[term][activity.id] = frequency
+        related_keys = [(kind, obj.id) for kind, objects in related.items() for obj in objects]
+        for key in related_keys:
+            self.related[key].add(activity.id)
+        self.documents[activity.id] = {
+            'name': activity.name,
+            'fields': fields,
+            'terms': terms,
+            'length': length,
+            'related': related_keys,
+        }
+        self.total_length += length
+
+    def remove(self, activity_ID):
+        document = self.documents.pop(activity_ID, None)
+        if document is None:
+            return
+        for term in document['terms']:
+            postings = self.postings[term]
+            postings.pop(activity_ID, None)
+            if not postings:
+                del self.postings[term]
+        for key in document['related']:
+            self.related[key].discard(activity_ID)
+        self.total_length -= document['length']
+
+    def search(self, query):
+        """
+        Return (score, activity id) for every activity matching any word of the query, best match first
+        """
+        terms = set(tokenize(query))
+        with self.lock:
+            self.sync()
+            count = len(self.documents)
+            if not count:
+                return []
+            average_length = float(self.total_length) / count
+
+            scores = defaultdict(float)
+            for term in terms:
+                postings = self.postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+                for activity_ID, frequency in postings.items():
+                    length = self.documents[activity_ID]['length']
+                    norm = self.k1 * (1 - self.b + self.b * length / average_length)
+                    scores[activity_ID] += idf * frequency * (self.k1 + 1) / (frequency + norm)
+
+        return sorted(((score, activity_ID) for activity_ID, score in scores.items()), key=lambda hit: (-hit[0], hit[1]))
+
+    def get_hit(self, activity_ID, score, query):
+        """
+        Describe a search hit: the activity name and the matching text of each field, with matches in <em>
+        """
+        terms = set(tokenize(query))
+        with self.lock:
+            document = self.documents[activity_ID]
+        highlights = {}
+        for field_name, text in document['fields'].items():
+            snippet = self.highlight(text, terms)
+            if snippet:
+                highlights[field_name] = snippet
+        return {
+            'id': activity_ID,
+            'name': document['name'],
+            'score': round(score, 4),
+            'highlights': highlights,
+        }
+
+    def highlight(self, text, terms):
+        matches = [match for match in TOKEN_RE.finditer(text or '') if match.group().lower() in terms]
+        if not matches:
+            return None
+
+        # Show the text around the first match (starting at a word boundary)
+        start = max(0, min(matches[0].start() - self.snippet_length // 4, len(text) - self.snippet_length))
+        if start:
+            start = text.find(' ', start, matches[0].start()) + 1 or start
+        end = min(len(text), start + self.snippet_length)
+        pieces = ['...' if start else '']
+        position = start
+        for match in matches:
+            if match.end() > end:
+                break
+            pieces.append(escape(text[position:match.start()]))
+            pieces.append('<em>' + escape(match.group()) + '</em>')
+            position = match.end()
+        pieces.append(escape(text[position:end]))
+        pieces.append('...' if end < len(text) else '')
+        return ''.join(pieces)
+
+
+search_index = SearchIndex()
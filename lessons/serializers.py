@@ -1,10 +1,115 @@
+import bisect
+import copy
+from collections import defaultdict
+
+from django.db import connection, transaction
+from django.db.models import Count, Min, Prefetch, Q
 from django.shortcuts import get_object_or_404
 
-from rest_framework import serializers
+from rest_framework import serializers, status
+from rest_framework.exceptions import APIException
 from lessons.models import Tag, Resource, Material, Activity, Curriculum, ActivityRelationship, CurriculumActivityRelationship, Step
+from lessons.models import update_curriculum_tags
+from lessons.dependencies import RecordDependenciesMixin
+from lessons.signals import activities_changed, curricula_changed
+from lessons.closure import CycleError, add_closure_edges, batch_closure_updates
+
+
+class ObjectsNotFound(APIException):
+    """
+    Raised when IDs passed in to associate objects with each other do not exist.
+    The response lists the missing IDs under the name of the field they were passed in, e.g.
+    {'detail': 'Not found', 'tag_IDs': [100]}
+    """
+    status_code = status.HTTP_404_NOT_FOUND
+
+    def __init__(self, missing):
+        self.detail = dict(missing, detail='Not found')
+
+
+class DynamicFieldsMixin(object):
+    """
+    Lets clients ask for only the parts of an object they need with query parameters:
+    ?fields=id,name          only output these fields (applies to the top-level object)
+    ?expand=tags,activities.tags
+                             once `expand` is given, nested collections are output as lists of IDs
+                             unless they are named here (dotted names reach into nested serializers)
+    Without either parameter every field is output in full.
+    The same options can be given as lists of names in the serializer context, which takes precedence.
+    Fields that are left out or output as IDs are also left out of `get_prefetch_fields()`.
+    """
+    # Nested collections that can be output as IDs instead: {field name: ID-only field}
+    shallow_fields = {}
+    # Lookups to prefetch for each field, the first one being enough for its ID-only form
+    field_prefetches = {}
+
+    def get_fields(self):
+        fields = super(DynamicFieldsMixin, self).get_fields()
+        only, expand = self.get_field_options()
+
+        if only is not None:
+            for field_name in list(fields):
+                if field_name not in only:
+                    del fields[field_name]
+
+        self.shallow = set()
+        if expand is not None:
+            for field_name, field in self.shallow_fields.items():
+                if field_name in fields and field_name not in expand:
+                    fields[field_name] = copy.deepcopy(field)
+                    self.shallow.add(field_name)
+        return fields
+
+    def get_field_options(self):
+        """
+        Return the (`fields`, `expand`) sets that apply to this serializer, or None for each option not given.
+        Nested serializers only see the `expand` names under their own path, e.g. `activities.tags` -> `tags`.
+        """
+        request = self.context.get('request')
+        params = dict(
+            (name, split_names(request.query_params[name]))
+            for name in ('fields', 'expand')
+            if request is not None and name in request.query_params
+        )
+        params.update((name, self.context[name]) for name in ('fields', 'expand') if name in self.context)
+
+        # Path of this serializer from the top-level one, e.g. ['activities']
+        path = []
+        node = self
+        while node.parent is not None:
+            if node.field_name:
+                path.insert(0, node.field_name)
+            node = node.parent
+
+        only = None
+        if 'fields' in params and not path:
+            only = set(params['fields'])
+
+        expand = None
+        if 'expand' in params:
+            prefix = ''.join(name + '.' for name in path)
+            expand = set(
+                name[len(prefix):].split('.')[0]
+                for name in params['expand']
+                if name.startswith(prefix)
+            )
+        return only, expand
+
+    def get_prefetch_fields(self):
+        """
+        Related objects read while serializing the fields that will be output.
+        Pass these to prefetch_related() so listing objects costs a fixed number of queries.
+        """
+        lookups = []
+        for field_name in self.fields:
+            field_lookups = self.field_prefetches.get(field_name, ())
+            if field_name in self.shallow:
+                field_lookups = field_lookups[:1]
+            lookups.extend(field_lookups)
+        return lookups
 
 
-class TagSerializer(serializers.ModelSerializer):
+class TagSerializer(RecordDependenciesMixin, serializers.ModelSerializer):
 
     class Meta:
         model = Tag
@@ -31,20 +136,16 @@ class TagSerializer(serializers.ModelSerializer):
         instance.url = validated_data.get('url', instance.url)
         instance.url = validated_data.get('logo', instance.logo)
 
-        # Add activity-tag relationships if specified
+        # Update activity-tag relationships if specified (only rows that change are written)
         if 'activities' in validated_data:
-            # Remove any existing relationships
-            instance.activities.clear()
-            # Add new relationships
-            activities = validated_data.get('activities')
-            for activityID in activities:
-                instance.activities.add(get_object_or_404(Activity, pk=activityID))
+            activities = get_objects_in_bulk({'activities': (Activity, validated_data.get('activities'))})
+            update_many_to_many(instance.activities, activities['activities'])
 
         instance.save()
         return instance
 
 
-class ResourceSerializer(serializers.ModelSerializer):
+class ResourceSerializer(RecordDependenciesMixin, serializers.ModelSerializer):
     activities = serializers.PrimaryKeyRelatedField(many=True, read_only=True)
 
     class Meta:
@@ -71,20 +172,16 @@ class ResourceSerializer(serializers.ModelSerializer):
         instance.name = validated_data.get('name', instance.name)
         instance.url = validated_data.get('url', instance.url)
 
-        # Add activity-resource relationships if specified
+        # Update activity-resource relationships if specified (only rows that change are written)
         if 'activities' in validated_data:
-            # Remove any existing relationships
-            instance.activities.clear()
-            # Add new relationships
-            activities = validated_data.get('activities')
-            for activityID in activities:
-                instance.activities.add(get_object_or_404(Activity, pk=activityID))
+            activities = get_objects_in_bulk({'activities': (Activity, validated_data.get('activities'))})
+            update_many_to_many(instance.activities, activities['activities'])
 
         instance.save()
         return instance
 
 
-class MaterialSerializer(serializers.ModelSerializer):
+class MaterialSerializer(RecordDependenciesMixin, serializers.ModelSerializer):
     activities = serializers.PrimaryKeyRelatedField(many=True, read_only=True)
 
     class Meta:
@@ -111,20 +208,16 @@ class MaterialSerializer(serializers.ModelSerializer):
         instance.name = validated_data.get('name', instance.name)
         instance.url = validated_data.get('url', instance.url)
 
-        # Add activity-material relationships if specified
+        # Update activity-material relationships if specified (only rows that change are written)
         if 'activities' in validated_data:
-            # Remove any existing relationships
-            instance.activities.clear()
-            # Add new relationships
-            activities = validated_data.get('activities')
-            for activityID in activities:
-                instance.activities.add(get_object_or_404(Activity, pk=activityID))
+            activities = get_objects_in_bulk({'activities': (Activity, validated_data.get('activities'))})
+            update_many_to_many(instance.activities, activities['activities'])
 
         instance.save()
         return instance
 
 
-class StepSerializer(serializers.ModelSerializer):
+class StepSerializer(RecordDependenciesMixin, serializers.ModelSerializer):
     activity = serializers.PrimaryKeyRelatedField(read_only=True)
     step_activity = serializers.PrimaryKeyRelatedField(read_only=True)
 
@@ -133,7 +226,7 @@ class StepSerializer(serializers.ModelSerializer):
         fields = ('text', 'activity', 'number', 'step_activity')
 
 
-class ActivitySerializer(serializers.HyperlinkedModelSerializer):
+class ActivitySerializer(RecordDependenciesMixin, DynamicFieldsMixin, serializers.HyperlinkedModelSerializer):
     tags = TagSerializer(many=True, required=False)
     materials = MaterialSerializer(many=True, required=False)
     resources = ResourceSerializer(many=True, required=False)
@@ -156,35 +249,53 @@ class ActivitySerializer(serializers.HyperlinkedModelSerializer):
                   'steps'
                  )
 
+    shallow_fields = {
+        'tags': serializers.PrimaryKeyRelatedField(many=True, read_only=True),
+        'materials': serializers.PrimaryKeyRelatedField(many=True, read_only=True),
+        'resources': serializers.PrimaryKeyRelatedField(many=True, read_only=True),
+        'steps': serializers.PrimaryKeyRelatedField(many=True, read_only=True),
+    }
+
+    # Related objects read while serializing an activity (including `get_curricula` and `get_relationships`)
+    field_prefetches = {
+        'tags': ('tags',),
+        'materials': ('materials', 'materials__activities'),
+        'resources': ('resources', 'resources__activities'),
+        'steps': ('steps',),
+        'get_curricula': ('curriculum_relationships',),
+        'get_relationships': ('relationships_to',),
+    }
+
     def to_representation(self, instance):
         ret = super(ActivitySerializer, self).to_representation(instance)
-        ret['category'] = instance.get_category_display()
+        if 'category' in ret:
+            ret['category'] = instance.get_category_display()
         return ret
 
     # Custom function to associate objects with activities
+    # Expects tags, resources, materials and the curricula / activities of the rels
+    # that were already looked up (see ActivityViewSet.create)
     def create(self, validated_data):
         # Get lists of objects to be associated with the new activity
-        tag_IDs = validated_data.pop('tag_IDs')
-        resource_IDs = validated_data.pop('resource_IDs')
-        material_IDs = validated_data.pop('material_IDs')
+        tags = validated_data.pop('tags')
+        resources = validated_data.pop('resources')
+        materials = validated_data.pop('materials')
         curriculum_rels = validated_data.pop('curriculum_rels')
+        curricula = validated_data.pop('curricula', None)
         activity_rels = validated_data.pop('activity_rels')
+        related_activities = validated_data.pop('related_activities', None)
 
-        activity = Activity.objects.create(**validated_data)
+        with transaction.atomic():
+            activity = Activity.objects.create(**validated_data)
 
-        # Add foreign key relationships
-        for tagID in tag_IDs:
-            activity.tags.add(get_object_or_404(Tag, pk=tagID))
-        for resourceID in resource_IDs:
-            activity.resources.add(get_object_or_404(Resource, pk=resourceID))
-        for materialID in material_IDs:
-            activity.materials.add(get_object_or_404(Material, pk=materialID))
-        # save new activity
-        activity.save()
+            # Add many-to-many relationships (one INSERT per relationship type)
+            activity.tags.add(*tags)
+            activity.resources.add(*resources)
+            activity.materials.add(*materials)
 
-        # create relationships that have through models
-        create_activity_curriculum_relationships(activity, curriculum_rels)
-        create_activity_activity_relationships(activity, activity_rels)
+            # create relationships that have through models
+            add_activity_to_curricula(activity, curriculum_rels, related=curricula)
+            create_activity_activity_relationships(activity, activity_rels, related=related_activities)
 
         return activity
 
@@ -198,45 +309,49 @@ class ActivitySerializer(serializers.HyperlinkedModelSerializer):
         instance.video_url = validated_data.get('video_url', instance.video_url)
         instance.image = validated_data.get('image', instance.image)
 
-        # Update any relationships if specified
+        # Look up any related objects passed in before writing anything
+        lookups = {}
         if 'tag_IDs' in validated_data:
-            instance.tags.clear()
-            tag_IDs = validated_data.get('tag_IDs')
-            for tagID in tag_IDs:
-                instance.tags.add(get_object_or_404(Tag, pk=tagID))
+            lookups['tag_IDs'] = (Tag, validated_data.get('tag_IDs'))
         if 'material_IDs' in validated_data:
-            instance.materials.clear()
-            material_IDs = validated_data.get('material_IDs')
-            for materialID in material_IDs:
-                instance.materials.add(get_object_or_404(Material, pk=materialID))
+            lookups['material_IDs'] = (Material, validated_data.get('material_IDs'))
         if 'resource_IDs' in validated_data:
-            instance.resources.clear()
-            resource_IDs = validated_data.get('resource_IDs')
-            for resourceID in resource_IDs:
-                instance.resources.add(get_object_or_404(Resource, pk=resourceID))
-        if 'activity_rels' in validated_data:
-            instance.relationships_to.all().delete()
-            create_activity_activity_relationships(instance, validated_data.get('activity_rels'))
-        if 'curriculum_rels' in validated_data:
-            instance.curriculum_relationships.all().delete()
-            create_activity_curriculum_relationships(instance, validated_data.get('curriculum_rels'))
-
-        instance.save()
+            lookups['resource_IDs'] = (Resource, validated_data.get('resource_IDs'))
+        related = get_objects_in_bulk(lookups)
+
+        with transaction.atomic():
+            # Update any relationships if specified (only rows that change are written)
+            if 'tag_IDs' in related:
+                update_many_to_many(instance.tags, related['tag_IDs'])
+            if 'material_IDs' in related:
+                update_many_to_many(instance.materials, related['material_IDs'])
+            if 'resource_IDs' in related:
+                update_many_to_many(instance.resources, related['resource_IDs'])
+            if 'activity_rels' in validated_data:
+                update_activity_activity_relationships(instance, validated_data.get('activity_rels'))
+            if 'curriculum_rels' in validated_data:
+                update_activity_curriculum_relationships(instance, validated_data.get('curriculum_rels'))
+
+            instance.save()
         return instance
 
 
 class CurriculumActivityRelationshipSerializer(serializers.ModelSerializer):
     activity = ActivitySerializer()
     curriculum = serializers.PrimaryKeyRelatedField(queryset=Curriculum.objects.all())
+    # Position in the curriculum (stored numbers may have gaps)
+    number = serializers.ReadOnlyField(source='get_position')
 
     class Meta:
         model = CurriculumActivityRelationship
-        fields = ('id', 'activity', 'number')
+        fields = ('id', 'curriculum', 'activity', 'number')
 
 
-class CurriculumSerializer(serializers.HyperlinkedModelSerializer):
+class CurriculumSerializer(RecordDependenciesMixin, DynamicFieldsMixin, serializers.HyperlinkedModelSerializer):
 
-    activities = ActivitySerializer(read_only=True, many=True)
+    activities = ActivitySerializer(source='get_ordered_activities', read_only=True, many=True)
+    # Language and Technology tags inherited from the activities
+    tags = TagSerializer(many=True, read_only=True)
 
     class Meta:
         model = Curriculum
@@ -246,9 +361,36 @@ class CurriculumSerializer(serializers.HyperlinkedModelSerializer):
                   'lower_grade',
                   'upper_grade',
                   'tagline',
+                  'tags',
                   'activities'
                  )
 
+    shallow_fields = {
+        'tags': serializers.PrimaryKeyRelatedField(many=True, read_only=True),
+        'activities': serializers.ReadOnlyField(source='get_activities'),
+    }
+
+    field_prefetches = {
+        'tags': ('tags',),
+    }
+
+    def get_prefetch_fields(self):
+        lookups = super(CurriculumSerializer, self).get_prefetch_fields()
+
+        # Activities are loaded through the ordering relationships (already sorted by `number`)
+        if 'activities' in self.shallow:
+            lookups.append('activity_relationships')
+        elif 'activities' in self.fields:
+            # together with everything ActivitySerializer reads from them
+            lookups.append(
+                Prefetch('activity_relationships', queryset=CurriculumActivityRelationship.objects.select_related('activity'))
+            )
+            lookups.extend(
+                'activity_relationships__activity__' + field
+                for field in self.fields['activities'].child.get_prefetch_fields()
+            )
+        return lookups
+
     def to_representation(self, instance):
         ret = super(CurriculumSerializer, self).to_representation(instance)
 
@@ -257,9 +399,9 @@ class CurriculumSerializer(serializers.HyperlinkedModelSerializer):
         # ret['upper_grade'] = instance.get_upper_grade_display()
 
         # Make grade 0 display as K
-        if instance.lower_grade == 0:
+        if instance.lower_grade == 0 and 'lower_grade' in ret:
             ret['lower_grade'] = "K"
-        if instance.upper_grade == 0:
+        if instance.upper_grade == 0 and 'upper_grade' in ret:
             ret['upper_grade'] = "K"
 
         return ret
@@ -272,11 +414,16 @@ class CurriculumSerializer(serializers.HyperlinkedModelSerializer):
         else:
             activity_rels = False
 
-        curriculum = Curriculum.objects.create(**validated_data)
+        with transaction.atomic():
+            curriculum = Curriculum.objects.create(**validated_data)
 
-        if activity_rels:
-            # Add curriculum-activity relationships
-            create_curriculum_activity_relationships(curriculum, activity_rels)
+            if activity_rels:
+                # Add curriculum-activity relationships, spaced out in the order of their numbers
+                gap = CurriculumActivityRelationship.NUMBER_GAP
+                create_curriculum_activity_relationships([
+                    {"activityID": rel["activityID"], "number": gap * (i + 1)}
+                    for i, rel in enumerate(sort_curriculum_activity_rels(activity_rels, curriculum))
+                ], curriculum=curriculum)
 
         return curriculum
 
@@ -289,65 +436,522 @@ class CurriculumSerializer(serializers.HyperlinkedModelSerializer):
         instance.lower_grade = validated_data.get('lower_grade', instance.lower_grade)
         instance.upper_grade = validated_data.get('upper_grade', instance.upper_grade)
 
-        # Update any relationships if specified
-        if 'activity_rels' in validated_data:
-            instance.activity_relationships.all().delete()
-            create_curriculum_activity_relationships(instance, validated_data.get('activity_rels'))
+        with transaction.atomic():
+            # Update any relationships if specified (only rows that change are written)
+            if 'activity_rels' in validated_data:
+                update_curriculum_activity_relationships(instance, validated_data.get('activity_rels'))
 
-        instance.save()
+            instance.save()
         return instance
 
 """ Helper Functions """
 
-
-def create_activity_activity_relationships(activity, activity_rels):
-    for rel in activity_rels:
-        activity2 = get_object_or_404(Activity, pk=rel["activityID"])
+# Relationship types that are stored in both directions (and the type of the symmetrical row)
+SYMMETRIC_REL_TYPES = {
+    "SUB": "SUP",
+    "SUP": "SUB",
+}
+
+
+def split_names(value):
+    """
+    Split a comma separated query parameter into a list of names
+    """
+    return [name.strip() for name in value.split(',') if name.strip()]
+
+
+def find_objects_in_bulk(lookups):
+    """
+    Look up lists of IDs with one query per model.
+    `lookups` maps a field name to a (model, list of IDs) pair.
+    Returns two dicts keyed by field name: the objects found (in the order requested)
+    and the IDs that do not exist (only for fields with missing IDs).
+    """
+    objects = {}
+    missing = {}
+    for field_name, (model, IDs) in lookups.items():
+        IDs = [int(ID) for ID in IDs]
+        found = model.objects.in_bulk(IDs) if IDs else {}
+        missing_IDs = [ID for ID in IDs if ID not in found]
+        if missing_IDs:
+            missing[field_name] = missing_IDs
+        objects[field_name] = [found[ID] for ID in IDs if ID in found]
+    return objects, missing
+
+
+def get_objects_in_bulk(lookups):
+    """
+    Same as find_objects_in_bulk, but only returns the objects found.
+    Raises ObjectsNotFound listing every missing ID if any of them do not exist.
+    """
+    objects, missing = find_objects_in_bulk(lookups)
+    if missing:
+        raise ObjectsNotFound(missing)
+    return objects
+
+
+def update_many_to_many(manager, objects):
+    """
+    Make a many-to-many relationship hold exactly `objects`.
+    Only the relationships that were removed or added are written.
+    """
+    current_IDs = set(manager.values_list('pk', flat=True))
+    new_IDs = set(obj.pk for obj in objects)
+
+    removed_IDs = current_IDs - new_IDs
+    if removed_IDs:
+        manager.remove(*removed_IDs)
+    added = [obj for obj in objects if obj.pk not in current_IDs]
+    if added:
+        manager.add(*added)
+
+
+def diff_relationships(relationships, key, value, wanted):
+    """
+    Compare existing through-model rows with the wanted state.
+    `key` and `value` name the attributes compared on each row (e.g. 'activity_id' and 'number')
+    and `wanted` maps each wanted key to its value.
+    Returns the IDs of the rows that must be deleted and the set of keys that need a new row.
+    """
+    stale_IDs = []
+    kept_keys = set()
+    for relationship in relationships:
+        relationship_key = getattr(relationship, key)
+        if relationship_key in wanted and wanted[relationship_key] == getattr(relationship, value):
+            kept_keys.add(relationship_key)
+        else:
+            stale_IDs.append(relationship.id)
+    return stale_IDs, set(wanted) - kept_keys
+
+
+def update_activity_activity_relationships(activity, activity_rels):
+    wanted = dict((int(rel["activityID"]), rel["type"]) for rel in activity_rels)
+    stale_IDs, new_keys = diff_relationships(activity.relationships_to.all(), 'from_activity_id', 'rel_type', wanted)
+
+    if stale_IDs:
+        stale = ActivityRelationship.objects.filter(id__in=stale_IDs)
+        # Remove the symmetrical rows of removed sub / super activity relationships too
+        stale_symmetric_IDs = [rel.from_activity_id for rel in stale if rel.rel_type in SYMMETRIC_REL_TYPES]
+        with batch_closure_updates():
+            if stale_symmetric_IDs:
+                ActivityRelationship.objects.filter(
+                    from_activity=activity
+                    , to_activity_id__in=stale_symmetric_IDs
+                    , rel_type__in=list(SYMMETRIC_REL_TYPES)
+                ).delete()
+            stale.delete()
+
+    create_activity_activity_relationships(
+        activity
+        , [rel for rel in activity_rels if int(rel["activityID"]) in new_keys]
+    )
+
+
+def update_curriculum_activity_relationships(curriculum, activity_rels):
+    """
+    Make `curriculum` hold the activities of the rels, in the order of their "number" (a position as shown by reads).
+    The rows of the activities that stay in the same order relative to each other are kept as they are,
+    so sending back the positions just read writes nothing and moving one activity writes one row.
+    """
+    order = [int(rel["activityID"]) for rel in sort_curriculum_activity_rels(activity_rels, curriculum)]
+    rows = curriculum.activity_relationships.order_by('number').values_list('id', 'activity_id', 'number')
+    stale_IDs = [row_ID for row_ID, activity_ID, number in rows if activity_ID not in order]
+    current = dict((activity_ID, (row_ID, number)) for row_ID, activity_ID, number in rows if activity_ID in order)
+
+    numbers = get_curriculum_numbers(order, current)
+    moved = [(current[activity_ID][0], numbers[activity_ID]) for activity_ID in order
+             if activity_ID in current and current[activity_ID][1] != numbers[activity_ID]]
+
+    # Delete before renumbering and inserting so numbers do not clash on (curriculum, number)
+    if stale_IDs:
+        CurriculumActivityRelationship.objects.filter(id__in=stale_IDs).delete()
+    if moved:
+        renumber_curriculum_activities([row_ID for row_ID, number in moved], [number for row_ID, number in moved])
+        curricula_changed.send(sender=CurriculumActivityRelationship, curriculum_IDs=[curriculum.id])
+    create_curriculum_activity_relationships(
+        [{"activityID": activity_ID, "number": numbers[activity_ID]} for activity_ID in order if activity_ID not in current]
+        , curriculum=curriculum
+    )
+
+
+def update_activity_curriculum_relationships(activity, curriculum_rels):
+    """
+    Put `activity` in the curricula of the rels, at the position given by their "number" (as shown by reads).
+    Only rows that are added, moved or removed are written.
+    """
+    wanted = dict((int(rel["curriculumID"]), int(rel["number"])) for rel in curriculum_rels)
+    relationships = list(activity.curriculum_relationships.all())
+    stale_IDs = [relationship.id for relationship in relationships if relationship.curriculum_id not in wanted]
+    if stale_IDs:
+        CurriculumActivityRelationship.objects.filter(id__in=stale_IDs).delete()
+
+    kept = [relationship for relationship in relationships if relationship.curriculum_id in wanted]
+    if kept:
+        # Positions of the activity and sizes of its curricula
+        positions = {}
+        sizes = defaultdict(int)
+        rows = CurriculumActivityRelationship.objects.filter(
+            curriculum__in=[relationship.curriculum_id for relationship in kept]
+        ).order_by('number').values_list('curriculum_id', 'activity_id')
+        for curriculum_ID, activity_ID in rows:
+            sizes[curriculum_ID] += 1
+            if activity_ID == activity.id:
+                positions[curriculum_ID] = sizes[curriculum_ID]
+        for relationship in kept:
+            position = min(max(wanted[relationship.curriculum_id], 1), sizes[relationship.curriculum_id])
+            if position != positions[relationship.curriculum_id]:
+                move_curriculum_activity(relationship.curriculum, activity.id, position)
+
+    add_activity_to_curricula(activity, [
+        rel for rel in curriculum_rels
+        if int(rel["curriculumID"]) not in set(relationship.curriculum_id for relationship in kept)
+    ])
+
+
+def create_activity_activity_relationships(activity, activity_rels, related=None):
+    """
+    Create the relationships between `activity` and other activities with a single INSERT.
+    `related` holds the activities of the rels, in order, if they were already looked up.
+    Sub / super activity relationships also get their symmetrical row.
+    Rows that already exist or appear twice are skipped (unique_together on from / to activity).
+    Raises ValidationError if a relationship would make an activity its own sub-activity or extension.
+    """
+    if not activity_rels:
+        return
+
+    # Look up all related activities in one query
+    if related is None:
+        related = get_objects_in_bulk({'activity_rels': (Activity, [rel["activityID"] for rel in activity_rels])})['activity_rels']
+
+    relationships = []
+    for rel, activity2 in zip(activity_rels, related):
         rel_type = rel["type"]
-
-        relationship = ActivityRelationship(
+        relationships.append(ActivityRelationship(
             from_activity=activity2
             , to_activity=activity
             , rel_type=rel_type
-        )
-        relationship.save()
-
+        ))
         # Need to make symmetrical relationship for sub / super activities
-        if rel_type == "SUP":
-            symmetric_relationship = ActivityRelationship(
-                from_activity=activity
-                , to_activity=activity2
-                , rel_type="SUB"
-            )
-            symmetric_relationship.save()
-        if rel_type == "SUB":
-            symmetric_relationship = ActivityRelationship(
+        if rel_type in SYMMETRIC_REL_TYPES:
+            relationships.append(ActivityRelationship(
                 from_activity=activity
                 , to_activity=activity2
-                , rel_type="SUP"
-            )
-            symmetric_relationship.save()
+                , rel_type=SYMMETRIC_REL_TYPES[rel_type]
+            ))
+
+    existing = set(ActivityRelationship.objects.filter(
+        Q(to_activity=activity, from_activity__in=related)
+        | Q(from_activity=activity, to_activity__in=related)
+    ).values_list('from_activity_id', 'to_activity_id'))
+    new_relationships = []
+    for relationship in relationships:
+        key = (relationship.from_activity_id, relationship.to_activity_id)
+        if key not in existing:
+            existing.add(key)
+            new_relationships.append(relationship)
+
+    with transaction.atomic():
+        ActivityRelationship.objects.bulk_create(new_relationships)
+        activities_changed.send(
+            sender=ActivityRelationship
+            , activity_IDs=set(relationship.to_activity_id for relationship in new_relationships)
+        )
+        try:
+            add_closure_edges(new_relationships)
+        except CycleError as e:
+            raise serializers.ValidationError({'activity_rels': [
+                "Relating activities {} and {} would create a cycle.".format(e.ancestor_ID, e.descendant_ID)
+            ]})
+
+
+def create_curriculum_activity_relationships(rels, curriculum=None, activity=None, related=None, field_name=None):
+    """
+    Create the rows ordering activities within curricula with a single INSERT.
+    Pass either the `curriculum` with rels like {"activityID": 1, "number": 1024}
+    or the `activity` with rels like {"curriculumID": 1, "number": 1024}, where "number" is the stored sort key.
+    `related` holds the activities / curricula of the rels, in order, if they were already looked up.
+    Raises ObjectsNotFound if a referenced activity / curriculum does not exist
+    and ValidationError if an activity or number is already used in a curriculum
+    (both reported under `field_name`, by default the field of the rels).
+    """
+    if curriculum is not None:
+        default_field_name, model, key = 'activity_rels', Activity, "activityID"
+    else:
+        default_field_name, model, key = 'curriculum_rels', Curriculum, "curriculumID"
+    field_name = field_name or default_field_name
+    if not rels:
+        return
+
+    # Look up the other side of every relationship in one query
+    if related is None:
+        related = get_objects_in_bulk({field_name: (model, [rel[key] for rel in rels])})[field_name]
+    relationships = [
+        CurriculumActivityRelationship(
+            curriculum=curriculum if curriculum is not None else obj
+            , activity=activity if activity is not None else obj
+            , number=int(rel["number"])
+        )
+        for rel, obj in zip(rels, related)
+    ]
+
+    check_curriculum_activity_relationships(relationships, field_name)
+    curriculum_IDs = set(relationship.curriculum_id for relationship in relationships)
+    with transaction.atomic():
+        CurriculumActivityRelationship.objects.bulk_create(relationships)
+        # bulk_create() sends no post_save signals
+        update_curriculum_tags(curriculum_IDs)
+        curricula_changed.send(sender=CurriculumActivityRelationship, curriculum_IDs=curriculum_IDs)
+        activities_changed.send(
+            sender=CurriculumActivityRelationship
+            , activity_IDs=set(relationship.activity_id for relationship in relationships)
+        )
 
 
-# TODO: Harmonize these two functions
-def create_curriculum_activity_relationships(curriculum, activity_rels):
-    for rel in activity_rels:
-        activity = get_object_or_404(Activity, pk=rel["activityID"])
-        relationship = CurriculumActivityRelationship.objects.create(
-            curriculum=curriculum,
-            activity=activity,
-            number=rel["number"]
-        )
-        relationship.save()
+def add_activity_to_curricula(activity, curriculum_rels, related=None):
+    """
+    Add `activity` to curricula at the positions given by the "number" of rels like {"curriculumID": 1, "number": 2}
+    (1 is first; positions after the end add it last).
+    `related` holds the curricula of the rels, in order, if they were already looked up.
+    """
+    if not curriculum_rels:
+        return
+    if related is None:
+        related = get_objects_in_bulk({'curriculum_rels': (Curriculum, [rel["curriculumID"] for rel in curriculum_rels])})['curriculum_rels']
+
+    sizes = dict(CurriculumActivityRelationship.objects.filter(
+        curriculum__in=related
+    ).order_by().values_list('curriculum').annotate(Count('id')))
+    rels = []
+    for rel, curriculum in zip(curriculum_rels, related):
+        position = min(max(int(rel["number"]), 1), sizes.get(curriculum.id, 0) + 1)
+        rels.append({"curriculumID": curriculum.id, "number": get_free_number(curriculum, position)})
+    create_curriculum_activity_relationships(rels, activity=activity, related=related)
+
+
+def sort_curriculum_activity_rels(activity_rels, curriculum):
+    """
+    Return the rels of a whole curriculum in the order of their "number" (only their order counts).
+    Raises ValidationError if two rels have the same number or activity.
+    """
+    rels = sorted(activity_rels, key=lambda rel: int(rel["number"]))
+    for rel, next_rel in zip(rels, rels[1:]):
+        if int(rel["number"]) == int(next_rel["number"]):
+            raise serializers.ValidationError({'activity_rels': [
+                "Number {} is already used in curriculum {}.".format(rel["number"], curriculum.id)
+            ]})
+    activity_IDs = set()
+    for rel in rels:
+        if int(rel["activityID"]) in activity_IDs:
+            raise serializers.ValidationError({'activity_rels': [
+                "Activity {} is already in curriculum {}.".format(rel["activityID"], curriculum.id)
+            ]})
+        activity_IDs.add(int(rel["activityID"]))
+    return rels
+
+
+def get_curriculum_numbers(order, current):
+    """
+    Return {activity id: number} putting the activities of a curriculum in `order`, given the
+    {activity id: (row id, number)} of the ones it already holds.
+    The longest run of rows already in order keeps its numbers, and the others get numbers between them,
+    unless there is no room left, when every activity is spaced out again.
+    """
+    gap = CurriculumActivityRelationship.NUMBER_GAP
+    present = [activity_ID for activity_ID in order if activity_ID in current]
+    kept = set(present[i] for i in get_longest_increasing_run([current[activity_ID][1] for activity_ID in present]))
+
+    numbers = {}
+    run = []
+    before = None
+    for activity_ID in order + [None]:
+        if activity_ID is not None and activity_ID not in kept:
+            run.append(activity_ID)
+            continue
+        after = current[activity_ID][1] if activity_ID is not None else None
+        if before is None and after is None:
+            run_numbers = [gap * (i + 1) for i in range(len(run))]
+        elif before is None:
+            run_numbers = [after - gap * (len(run) - i) for i in range(len(run))]
+        elif after is None:
+            run_numbers = [before + gap * (i + 1) for i in range(len(run))]
+        elif after - before > len(run):
+            run_numbers = [before + (after - before) * (i + 1) // (len(run) + 1) for i in range(len(run))]
+        else:
+            # No room between the neighbours
+            return dict((activity_ID, gap * (i + 1)) for i, activity_ID in enumerate(order))
+        numbers.update(zip(run, run_numbers))
+        if activity_ID is not None:
+            numbers[activity_ID] = after
+        run = []
+        before = after
+    return numbers
+
+
+def get_longest_increasing_run(values):
+    """
+    Return the indexes of a longest increasing subsequence of `values`, in order
+    """
+    # tails[k]: index of the smallest value ending an increasing subsequence of length k + 1
+    tails = []
+    tail_values = []
+    previous = [None] * len(values)
+    for i, value in enumerate(values):
+        k = bisect.bisect_left(tail_values, value)
+        previous[i] = tails[k - 1] if k else None
+        if k == len(tails):
+            tails.append(i)
+            tail_values.append(value)
+        else:
+            tails[k] = i
+            tail_values[k] = value
+    indexes = []
+    i = tails[-1] if tails else None
+    while i is not None:
+        indexes.append(i)
+        i = previous[i]
+    return indexes[::-1]
+
+
+def move_curriculum_activity(curriculum, activity_ID, position):
+    """
+    Move an activity of `curriculum` to `position` (1 is first), which usually writes a single row.
+    Raises ValidationError if the activity is not in the curriculum or the position is out of range.
+    """
+    relationship = get_curriculum_activity_relationship(curriculum, activity_ID)
+    number = get_free_number(curriculum, position, exclude=relationship)
+    if number != relationship.number:
+        CurriculumActivityRelationship.objects.filter(id=relationship.id).update(number=number)
+    curricula_changed.send(sender=CurriculumActivityRelationship, curriculum_IDs=[curriculum.id])
+
+
+def remove_curriculum_activity(curriculum, activity_ID):
+    """
+    Remove an activity from `curriculum` by deleting its row (the numbers of the others are kept).
+    Raises ValidationError if the activity is not in the curriculum.
+    """
+    get_curriculum_activity_relationship(curriculum, activity_ID).delete()
+
+
+def get_curriculum_activity_relationship(curriculum, activity_ID):
+    try:
+        return curriculum.activity_relationships.get(activity=activity_ID)
+    except CurriculumActivityRelationship.DoesNotExist:
+        raise serializers.ValidationError({'activityID': [
+            "Activity {} is not in curriculum {}.".format(activity_ID, curriculum.id)
+        ]})
+
+
+def insert_curriculum_activity(curriculum, activity_ID, position=None):
+    """
+    Add an activity to `curriculum` at `position` (1 is first), or at the end if no position is given,
+    with a single INSERT in the common case.
+    Raises ObjectsNotFound if the activity does not exist and ValidationError if it is already
+    in the curriculum or the position is out of range.
+    """
+    if position is None:
+        last = curriculum.activity_relationships.order_by('-number').values_list('number', flat=True)[:1]
+        number = last[0] + CurriculumActivityRelationship.NUMBER_GAP if last else CurriculumActivityRelationship.NUMBER_GAP
+    else:
+        number = get_free_number(curriculum, position)
+    create_curriculum_activity_relationships(
+        [{"activityID": activity_ID, "number": number}]
+        , curriculum=curriculum
+        , field_name='activityID'
+    )
+
+
+def get_free_number(curriculum, position, exclude=None):
+    """
+    Return a number placing an activity at `position` (1 is first) of `curriculum`, between the numbers
+    of its new neighbours (not counting the relationship `exclude`, which is being moved).
+    When the neighbours' numbers leave no room, the curriculum is renumbered first
+    (a moved row straight into its new place).
+    Raises ValidationError if the position is out of range.
+    """
+    others = curriculum.activity_relationships.order_by('number')
+    if exclude is not None:
+        others = others.exclude(id=exclude.id)
+
+    # Numbers of the activities that will come right before and after
+    neighbours = list(others.values_list('number', flat=True)[max(position - 2, 0):position])
+    if position < 1 or (position > 1 and not neighbours):
+        raise serializers.ValidationError({'position': ["Invalid position."]})
+    before = neighbours.pop(0) if position > 1 else None
+    after = neighbours[0] if neighbours else None
+
+    gap = CurriculumActivityRelationship.NUMBER_GAP
+    if before is None and after is None:
+        return gap
+    elif before is None:
+        return after - gap
+    elif after is None:
+        return before + gap
+    elif after - before >= 2:
+        return (before + after) // 2
+
+    # No room between the neighbours: space the numbers out again
+    relationship_IDs = list(others.values_list('id', flat=True))
+    if exclude is not None:
+        # The moved row is renumbered into its new place too
+        relationship_IDs.insert(position - 1, exclude.id)
+        renumber_curriculum_activities(relationship_IDs)
+        exclude.number = position * gap
+        return exclude.number
+    renumber_curriculum_activities(relationship_IDs)
+    return (position - 1) * gap + gap // 2
+
+
+def renumber_curriculum_activities(relationship_IDs, numbers=None):
+    """
+    Give rows of a curriculum the given numbers (by default NUMBER_GAP, 2 * NUMBER_GAP... in the given order),
+    with two UPDATE statements (through negative numbers no row of the curriculum uses, to respect unique_together)
+    """
+    table = connection.ops.quote_name(CurriculumActivityRelationship._meta.db_table)
+    lowest = CurriculumActivityRelationship.objects.filter(
+        curriculum__in=CurriculumActivityRelationship.objects.filter(id__in=relationship_IDs).values('curriculum')
+    ).aggregate(lowest=Min('number'))['lowest']
+    final = numbers or [CurriculumActivityRelationship.NUMBER_GAP * (i + 1) for i in range(len(relationship_IDs))]
+    lowest = min([lowest, 0] + final)
+    temporary = [lowest - len(relationship_IDs) - 1 + i for i in range(len(relationship_IDs))]
+    with transaction.atomic():
+        cursor = connection.cursor()
+        for values in (temporary, final):
+            cursor.execute(
+                "UPDATE {} SET number = CASE id {} END WHERE id IN ({})".format(
+                    table
+                    , " ".join(["WHEN %s THEN %s"] * len(relationship_IDs))
+                    , ", ".join(["%s"] * len(relationship_IDs))
+                )
+                , [value for pair in zip(relationship_IDs, values) for value in pair] + relationship_IDs
+            )
 
 
-# TODO: Harmonize these two functions
-def create_activity_curriculum_relationships(activity, curriculum_rels):
-    for rel in curriculum_rels:
-        curr = get_object_or_404(Curriculum, pk=rel["curriculumID"])
-        relationship = CurriculumActivityRelationship.objects.create(
-            curriculum=curr
-            , activity=activity
-            , number=rel["number"]
-        )
-        relationship.save()
+def check_curriculum_activity_relationships(relationships, field_name):
+    """
+    Enforce unique_together on new CurriculumActivityRelationship rows before they are bulk inserted:
+    each activity and each number may only appear once per curriculum.
+    Raises ValidationError (reported under `field_name`) on the first clash.
+    """
+    taken_numbers = set()
+    taken_activities = set()
+    existing = CurriculumActivityRelationship.objects.filter(
+        curriculum_id__in=set(rel.curriculum_id for rel in relationships)
+    ).filter(
+        Q(number__in=set(rel.number for rel in relationships))
+        | Q(activity_id__in=set(rel.activity_id for rel in relationships))
+    ).values_list('curriculum_id', 'activity_id', 'number')
+    for curriculum_ID, activity_ID, number in existing:
+        taken_numbers.add((curriculum_ID, number))
+        taken_activities.add((curriculum_ID, activity_ID))
+
+    for rel in relationships:
+        if (rel.curriculum_id, rel.number) in taken_numbers:
+            raise serializers.ValidationError({field_name: [
+                "Number {} is already used in curriculum {}.".format(rel.number, rel.curriculum_id)
+            ]})
+        if (rel.curriculum_id, rel.activity_id) in taken_activities:
+            raise serializers.ValidationError({field_name: [
+                "Activity {} is already in curriculum {}.".format(rel.activity_id, rel.curriculum_id)
+            ]})
+        taken_numbers.add((rel.curriculum_id, rel.number))
+        taken_activities.add((rel.curriculum_id, rel.activity_id))
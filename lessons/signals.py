@@ -0,0 +1,9 @@
+from django.dispatch import Signal
+
+# Sent after curriculum rows are written without model signals (bulk_create(), QuerySet.update() or raw SQL)
+# with the ids of the curricula whose activities or tags changed
+curricula_changed = Signal(providing_args=['curriculum_IDs'])
+
+# Sent after activity rows are written without model signals with the ids of the activities
+# whose relationships to other activities or curricula changed
+activities_changed = Signal(providing_args=['activity_IDs'])
@@ -0,0 +1,84 @@
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from django.core.cache import cache
+
+
+class SingleFlight(object):
+    """
+    Coalesce the computations of the same value, e.g. a response missing from the cache:
+
+        with flights.lead(key) as leading:
+            if not leading:
+                # Another caller just computed it: look in the cache again
+            ...compute and cache the value...
+
+    Only one thread of the process leads a key at a time; the others wait for it to finish.
+    With `cache_lock`, the leader also takes a lock in the cache (which must be shared between processes)
+    so the leaders of other processes wait too. Waiting for the cache lock stops after `timeout` seconds,
+    in case the leader died, and the waiting caller leads instead. Callers waiting for a leader of their own process
+    wait twice as long, as it may first have waited that long for the cache lock before computing.
+    """
+    poll_interval = 0.05
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # key -> Event set when its leader finishes
+        self.flights = {}
+
+    @contextmanager
+    def lead(self, key, timeout=30, cache_lock=False):
+        with self.lock:
+            event = self.flights.get(key)
+            if event is None:
+                event = self.flights[key] = threading.Event()
+                leading = True
+            else:
+                leading = False
+
+        if not leading:
+            event.wait(2 * timeout)
+            yield not event.is_set()
+            return
+
+        try:
+            if cache_lock:
+                with self.cache_lock(key, timeout) as locked:
+                    yield locked
+            else:
+                yield True
+        finally:
+            with self.lock:
+                del self.flights[key]
+            event.set()
+
+    @contextmanager
+    def cache_lock(self, key, timeout):
+        """
+        Take the lock of `key` in the cache, or wait for the process holding it to release it.
+        Yields whether the lock was taken (or waiting timed out).
+        """
+        lock_key = 'lessons:lock:' + key
+        token = uuid.uuid4().hex
+        deadline = time.time() + timeout
+        # The lock expires by itself if its holder dies
+        while not cache.add(lock_key, token, timeout):
+            if time.time() >= deadline:
+                yield True
+                return
+            time.sleep(self.poll_interval)
+            if cache.get(lock_key) is None:
+                # Released by its holder
+                yield False
+                return
+
+        try:
+            yield True
+        finally:
+            if cache.get(lock_key) == token:
+                cache.delete(lock_key)
+
+
+response_flights = SingleFlight()
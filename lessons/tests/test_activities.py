@@ -1,11 +1,13 @@
 import copy
 
 from django.core.urlresolvers import reverse
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 
 from rest_framework import status
 from rest_framework.test import APITestCase
 
-from lessons.models import Activity, Curriculum, Material, Resource, Tag
+from lessons.models import Activity, ActivityRelationship, Curriculum, CurriculumActivityRelationship, Material, Resource, Step, Tag
 from lessons.serializers import MaterialSerializer, ResourceSerializer, TagSerializer
 
 # for image mocking
@@ -215,6 +217,110 @@ class ActivityTests(APITestCase):
         # Convert ordered dict objects into unordered dicts for comparison
         self.assertEqual(response.data, {'detail': 'Not found'})
 
+    def test_get_all_activities_query_count(self):
+        """
+        Listing activities should cost the same number of queries no matter how many activities exist
+        """
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        baseline = len(queries)
+
+        # Add activities with every kind of nested object
+        activity1 = Activity.objects.get(name='TestActivity1')
+        for i in range(10):
+            activity = Activity.objects.create(
+                name='QueryCountActivity' + str(i)
+                , description="This is a query count test activity."
+            )
+            activity.tags.add(self.tag1, self.tag2)
+            activity.materials.add(self.material1)
+            activity.resources.add(self.resource2)
+            Step.objects.create(text='Step', activity=activity, number=1)
+            CurriculumActivityRelationship.objects.create(
+                curriculum=self.curriculum1
+                , activity=activity
+                , number=i + 1
+            )
+            ActivityRelationship.objects.create(
+                from_activity=activity1
+                , to_activity=activity
+                , rel_type='EXT'
+            )
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data), 13)
+        self.assertEqual(len(queries), baseline)
+
+        # Nested data should still be read correctly from the prefetched objects
+        self.assertEqual(response.data[12]['get_curricula'], [self.curriculum1.id])
+        self.assertEqual(response.data[12]['get_relationships'], [(activity1.id, 'extension')])
+        self.assertEqual(len(response.data[12]['tags']), 2)
+        self.assertEqual(len(response.data[12]['steps']), 1)
+
+    def test_get_activities_sparse_fields(self):
+        """
+        Should be able to list only some fields of activities, without querying the others
+        """
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url + '?fields=id,name')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(len(response.data), 3)
+        self.assertEqual(set(response.data[0]), set(['id', 'name']))
+
+        activity1 = Activity.objects.get(name='TestActivity1')
+        response = self.client.get(self.url + str(activity1.id) + '/?fields=name,category')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, {'name': 'TestActivity1', 'category': activity1.get_category_display()})
+
+    def test_get_activities_expand(self):
+        """
+        Nested collections that are not expanded should be listed as IDs
+        """
+        activity1 = Activity.objects.get(name='TestActivity1')
+        activity1.tags.add(self.tag1)
+        activity1.materials.add(self.material1)
+
+        response = self.client.get(self.url + str(activity1.id) + '/?expand=tags')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['materials'], [material.id for material in activity1.materials.all()])
+        self.assertEqual(response.data['tags'][0]['name'], self.tag1.name)
+
+        # Shallow collections should not prefetch what their full form reads
+        with CaptureQueriesContext(connection) as queries:
+            full = self.client.get(self.url)
+        with CaptureQueriesContext(connection) as shallow_queries:
+            shallow = self.client.get(self.url + '?expand=')
+        self.assertEqual([activity['id'] for activity in shallow.data], [activity['id'] for activity in full.data])
+        self.assertEqual(len(shallow_queries), len(queries) - 2)
+
+    def test_filter_activities(self):
+        """
+        Should be able to list only activities with a given tag, category or curriculum
+        """
+        activity1 = Activity.objects.get(name='TestActivity1')
+        activity2 = Activity.objects.get(name='TestActivity2')
+        activity1.tags.add(self.tag1, self.tag2, Tag.objects.create(name='FilterTag', category='Technology'))
+        activity2.tags.add(self.tag2)
+        activity2.category = 'Online'
+        activity2.save()
+        CurriculumActivityRelationship.objects.create(curriculum=self.curriculum2, activity=activity1, number=1)
+
+        def get_activity_IDs(query):
+            response = self.client.get(self.url + query)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            return [activity['id'] for activity in response.data]
+
+        self.assertEqual(get_activity_IDs('?tag=' + str(self.tag1.id)), [activity1.id])
+        self.assertEqual(get_activity_IDs('?tag_name=TestTag2'), [activity1.id, activity2.id])
+        self.assertEqual(get_activity_IDs('?tag_category=Technology&category=Online'), [activity2.id])
+        # Activities with several matching tags should be listed once
+        self.assertEqual(get_activity_IDs('?tag_category=Technology'), [activity1.id, activity2.id])
+        self.assertEqual(get_activity_IDs('?curriculum=' + str(self.curriculum2.id)), [activity1.id])
+
     """ ACTIVITY POST REQUESTS """
     def test_create_activity(self):
         """
@@ -422,6 +528,61 @@ class ActivityTests(APITestCase):
 
         self.assertEqual(response8.data, activity8)
 
+    def test_create_activity_query_count(self):
+        """
+        Creating an activity should look up related objects in bulk
+        The number of queries should not grow with the number of related objects
+        """
+        def create_activity(name, count):
+            activity = {
+                'name': name
+                , 'description': 'This is a query count test activity.'
+                , 'tag_IDs': [self.tag1.id, self.tag2.id][:count]
+                , 'category': ''
+                , 'teaching_notes': ''
+                , 'video_url': ''
+                , 'curriculum_rels': []
+                , 'activity_rels': []
+                , 'material_IDs': [self.material1.id, self.material2.id][:count]
+                , 'resource_IDs': [self.resource1.id, self.resource2.id][:count]
+            }
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.post(self.url, activity)
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            self.assertEqual(len(response.data['tags']), count)
+            return len(queries)
+
+        self.assertEqual(create_activity('QueryCount1', 1), create_activity('QueryCount2', 2))
+
+    def test_create_activity_looks_up_once(self):
+        """
+        Creating an activity should look up its curricula and related activities once, in bulk
+        """
+        related = Activity.objects.create(name='LookUpOnceRelated')
+        activity = {
+            'name': 'LookUpOnce'
+            , 'description': 'This is a look up test activity.'
+            , 'tag_IDs': [self.tag1.id]
+            , 'category': ''
+            , 'teaching_notes': ''
+            , 'video_url': ''
+            , 'curriculum_rels': [{'curriculumID': self.curriculum1.id, 'number': 1}]
+            , 'activity_rels': [{'activityID': related.id, 'type': 'EXT'}]
+            , 'material_IDs': []
+            , 'resource_IDs': []
+        }
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(self.url, activity)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['get_curricula'], [self.curriculum1.id])
+
+        lookups = [
+            query['sql'] for query in queries
+            if 'FROM "lessons_curriculum" WHERE "lessons_curriculum"."id" IN' in query['sql']
+            or 'FROM "lessons_activity" WHERE "lessons_activity"."id" IN' in query['sql']
+        ]
+        self.assertEqual(len(lookups), 2)
+
     def test_create_activity_activity_relationships(self):
         # Setup:
         # Activity 4 is an extension of Activity 5
@@ -553,6 +714,33 @@ class ActivityTests(APITestCase):
         self.assertEqual(response5.data, activity5)
         self.assertEqual(response6.data, activity6)
 
+    def test_activity_activity_relationships_bulk(self):
+        """
+        Relationships and their symmetrical rows should be inserted with a single query
+        Repeated relationships should be skipped
+        """
+        activity = Activity.objects.create(name='BulkRelationshipActivity')
+        others = list(Activity.objects.filter(name__startswith='TestActivity').order_by('id'))
+        activity_rels = [{'activityID': other.id, 'type': 'SUP'} for other in others]
+        # Same relationship twice
+        activity_rels.append({'activityID': others[0].id, 'type': 'SUP'})
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.patch(self.url + str(activity.id) + "/", {'activity_rels': activity_rels}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        inserts = [query['sql'] for query in queries if 'INSERT INTO "lessons_activityrelationship"' in query['sql']]
+        self.assertEqual(len(inserts), 1)
+        self.assertEqual(
+            sorted(response.data['get_relationships'])
+            , sorted((other.id, 'super-activity') for other in others)
+        )
+        # Symmetrical sub-activity rows
+        self.assertEqual(
+            sorted(ActivityRelationship.objects.filter(from_activity=activity).values_list('to_activity_id', 'rel_type'))
+            , sorted((other.id, 'SUB') for other in others)
+        )
+
     def test_create_activity_missing_fields(self):
         """
         Should NOT be able to create a new activity object with required fields missing
@@ -618,7 +806,7 @@ class ActivityTests(APITestCase):
 
         response = self.client.post(self.url, activity)
         self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
-        self.assertEqual(response.data, {'detail': 'Not found'})
+        self.assertEqual(response.data, {'detail': 'Not found', 'tag_IDs': [100]})
 
         # Category invalid
         activity = {
@@ -661,7 +849,8 @@ class ActivityTests(APITestCase):
 
     def test_create_activity_invalid_objects(self):
         """
-        Should be able to create a new activity object if non-required objects are invalid
+        Should be able to create a new activity object if related curricula or activities are invalid
+        Should NOT create an activity if materials or resources are invalid
         """
 
         # Material DNE
@@ -679,7 +868,7 @@ class ActivityTests(APITestCase):
         }
         response = self.client.post(self.url, activity)
         self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
-        self.assertEqual(response.data, {'detail': 'Not found'})
+        self.assertEqual(response.data, {'detail': 'Not found', 'material_IDs': [100]})
 
         # Resource DNE
         activity = {
@@ -697,7 +886,7 @@ class ActivityTests(APITestCase):
 
         response = self.client.post(self.url, activity)
         self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
-        self.assertEqual(response.data, {'detail': 'Not found'})
+        self.assertEqual(response.data, {'detail': 'Not found', 'resource_IDs': [100]})
 
         # Curriculum DNE
         activity = {
@@ -720,7 +909,7 @@ class ActivityTests(APITestCase):
 
         response = self.client.post(self.url, activity)
         self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
-        self.assertEqual(response.data, {'detail': 'Not found'})
+        self.assertEqual(response.data, {'detail': 'Not found', 'curriculum_rels': [100]})
 
         # Activity DNE
         activity = {
@@ -743,7 +932,7 @@ class ActivityTests(APITestCase):
 
         response = self.client.post(self.url, activity)
         self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
-        self.assertEqual(response.data, {'detail': 'Not found'})
+        self.assertEqual(response.data, {'detail': 'Not found', 'activity_rels': [100]})
 
         # All DNE
         activity = {
@@ -771,12 +960,21 @@ class ActivityTests(APITestCase):
 
         response = self.client.post(self.url, activity)
         self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
-        self.assertEqual(response.data, {'detail': 'Not found'})
+        self.assertEqual(
+            response.data
+            , {
+                'detail': 'Not found'
+                , 'material_IDs': [100]
+                , 'resource_IDs': [100]
+                , 'curriculum_rels': [100]
+                , 'activity_rels': [100]
+            }
+        )
 
-        # Verify 5 new objects added to DB
+        # Verify 2 new objects added to DB (invalid materials or resources create nothing)
         response = self.client.get(self.url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 8)
+        self.assertEqual(len(response.data), 5)
 
     """ ACTIVITY PATCH REQUESTS """
     def test_update_activity(self):
@@ -895,6 +1093,38 @@ class ActivityTests(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(response.data, activity1)
 
+    def test_update_activity_all_relationships_query_count(self):
+        """
+        Updating every kind of relationship in one PATCH request should update the activity only once
+        """
+        activity1 = Activity.objects.get(name='TestActivity1')
+        activity = Activity.objects.create(
+            name='QueryCountActivity'
+            , description="This is a query count test activity."
+        )
+        data = {
+            'name': 'UpdatedQueryCountActivity'
+            , 'tag_IDs': [self.tag1.id, self.tag2.id]
+            , 'material_IDs': [self.material1.id, self.material2.id]
+            , 'resource_IDs': [self.resource1.id]
+            , 'activity_rels': [{'activityID': activity1.id, 'type': 'EXT'}]
+            , 'curriculum_rels': [{'curriculumID': self.curriculum1.id, 'number': 1}]
+        }
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.patch(self.url + str(activity.id) + "/", data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        updates = [query['sql'] for query in queries if 'UPDATE "lessons_activity" SET' in query['sql']]
+        self.assertEqual(len(updates), 1)
+
+        self.assertEqual(response.data['name'], 'UpdatedQueryCountActivity')
+        self.assertEqual([tag['id'] for tag in response.data['tags']], [self.tag1.id, self.tag2.id])
+        self.assertEqual(len(response.data['materials']), 2)
+        self.assertEqual(len(response.data['resources']), 1)
+        self.assertEqual(response.data['get_relationships'], [(activity1.id, 'extension')])
+        self.assertEqual(response.data['get_curricula'], [self.curriculum1.id])
+
     def test_update_activity_invalid_data(self):
         """
         Should NOT be able to update activity with PATCH request using invalid data
@@ -909,7 +1139,7 @@ class ActivityTests(APITestCase):
         # Tag DNE
         response = self.client.patch(self.url + "1/", {'tag_IDs': [100]}, format='json')
         self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
-        self.assertEqual(response.data, {'detail': "Not found"})
+        self.assertEqual(response.data, {'detail': "Not found", 'tag_IDs': [100]})
         response = self.client.get(self.url + "1/")
         self.assertEqual(response.data, self.activity1)
 
@@ -939,7 +1169,7 @@ class ActivityTests(APITestCase):
             , format='json'
         )
         self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
-        self.assertEqual(response.data, {'detail': "Not found"})
+        self.assertEqual(response.data, {'detail': "Not found", 'curriculum_rels': [100]})
         response = self.client.get(self.url + "1/")
         self.assertEqual(response.data, self.activity1)
 
@@ -955,7 +1185,7 @@ class ActivityTests(APITestCase):
             , format='json'
         )
         self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
-        self.assertEqual(response.data, {'detail': "Not found"})
+        self.assertEqual(response.data, {'detail': "Not found", 'activity_rels': [100]})
         response = self.client.get(self.url + "1/")
         self.assertEqual(response.data, self.activity1)
 
@@ -980,21 +1210,19 @@ class ActivityTests(APITestCase):
         """
 
         # Material DNE
-        response = self.client.patch(self.url + "1/", {'material_IDs': [100]}, format='json')
+        response = self.client.patch(self.url + "1/", {'material_IDs': [self.material1.id, 100]}, format='json')
         self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
-        self.assertEqual(response.data, {'detail': "Not found"})
+        self.assertEqual(response.data, {'detail': "Not found", 'material_IDs': [100]})
         response = self.client.get(self.url + "1/")
-        # Failed request removes old materials and does not add the invalid new one
-        self.activity1["materials"] = []
+        # Failed request leaves old materials in place
         self.assertEqual(response.data, self.activity1)
 
         # Resource DNE
         response = self.client.patch(self.url + "1/", {'resource_IDs': [100]}, format='json')
         self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
-        self.assertEqual(response.data, {'detail': "Not found"})
+        self.assertEqual(response.data, {'detail': "Not found", 'resource_IDs': [100]})
         response = self.client.get(self.url + "1/")
-        # Failed request removes old materials and does not add the invalid new one
-        self.activity1["resources"] = []
+        # Failed request leaves old resources in place
         self.assertEqual(response.data, self.activity1)
 
     def test_update_activity_that_DNE(self):
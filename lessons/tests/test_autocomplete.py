@@ -0,0 +1,123 @@
+from django.core.urlresolvers import reverse
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from lessons.models import Activity, Tag
+from lessons.autocomplete import AutocompleteIndex, autocomplete_index
+
+
+class AutocompleteTests(APITestCase):
+
+    """ AUTOCOMPLETE TEST SETUP / TEARDOWN """
+
+    @classmethod
+    def setUpClass(cls):
+        """
+        Fake objects to be used across all tests in this class
+        """
+        # Endpoint URL for all tests
+        cls.url = reverse('lessons:autocomplete')
+
+        cls.python = Tag.objects.create(name='Python', category='Language')
+        cls.pygame = Tag.objects.create(name='Pygame', category='Technology')
+        cls.minutes = Tag.objects.create(name='30 minutes', category='Length')
+        cls.intro = Activity.objects.create(name='Intro to Python')
+        cls.loops = Activity.objects.create(name='Python Loops')
+
+    @classmethod
+    def tearDownClass(cls):
+        """
+        Delete objects
+        """
+        Activity.objects.all().delete()
+        Tag.objects.all().delete()
+
+    def setUp(self):
+        autocomplete_index.rebuild()
+
+    def tearDown(self):
+        autocomplete_index.clear()
+
+    def complete(self, query):
+        response = self.client.get(self.url + query)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [(result['type'], result['id']) for result in response.data]
+
+    """ AUTOCOMPLETE GET REQUESTS """
+    def test_autocomplete_prefix(self):
+        """
+        Should list names starting with the query first, then names with a word starting with it,
+        only querying the database for changes
+        """
+        with CaptureQueriesContext(connection) as queries:
+            results = self.complete('?q=py')
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(results, [
+            ('tag', self.pygame.id)
+            , ('tag', self.python.id)
+            , ('activity', self.loops.id)
+            , ('activity', self.intro.id)
+        ])
+
+        response = self.client.get(self.url + '?q=PYTHON%20lo')
+        self.assertEqual(response.data, [{'id': self.loops.id, 'name': 'Python Loops', 'type': 'activity'}])
+
+        self.assertEqual(self.complete('?q=py&type=activity&limit=1'), [('activity', self.loops.id)])
+        self.assertEqual(self.complete('?q=min'), [('tag', self.minutes.id)])
+        self.assertEqual(self.complete('?q='), [])
+
+        response = self.client.get(self.url + '?q=py&type=DNE')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data, {'detail': 'Invalid type.'})
+
+    def test_autocomplete_typos(self):
+        """
+        Should list names within the typo budget when there are not enough exact completions
+        """
+        self.assertEqual(self.complete('?q=pythn&type=tag'), [('tag', self.python.id)])
+        self.assertEqual(self.complete('?q=intro%20to%20pyhton'), [('activity', self.intro.id)])
+        # Short queries allow no typos
+        self.assertEqual(self.complete('?q=pyh'), [])
+        # Typos at the start of a word
+        self.assertEqual(self.complete('?q=lpops'), [('activity', self.loops.id)])
+
+    def test_autocomplete_updates(self):
+        """
+        Completions should follow new, renamed and deleted names
+        """
+        tag = Tag.objects.create(name='JavaScript', category='Language')
+        self.assertEqual(self.complete('?q=java'), [('tag', tag.id)])
+
+        tag.name = 'ECMAScript'
+        tag.save()
+        self.assertEqual(self.complete('?q=java'), [])
+        self.assertEqual(self.complete('?q=ecma'), [('tag', tag.id)])
+
+        self.intro.delete()
+        self.assertEqual(self.complete('?q=intro'), [])
+
+    def test_autocomplete_top_entries(self):
+        """
+        The best entries of a trie node should stay right as names are added, renamed and removed
+        """
+        index = AutocompleteIndex()
+        for number in range(150):
+            index.add(('tag', number), 'Go {:03}'.format(number))
+        node = index.root.children['g']
+
+        def expected(kind=None):
+            keys = [key for key in index.names if kind is None or key[0] == kind]
+            return sorted(keys, key=index.full_rank('g'))[:index.max_limit]
+
+        self.assertEqual(index.get_top(node, 'g', None), expected())
+        self.assertEqual(index.get_top(node, 'g', 'tag'), expected('tag'))
+        for number in range(0, 150, 3):
+            index.update(('tag', number), None)
+            index.update(('tag', number + 1), 'Going {}'.format(number))
+            index.update(('activity', number), 'G{}'.format(number))
+            self.assertEqual(index.get_top(node, 'g', None), expected())
+            self.assertEqual(index.get_top(node, 'g', 'tag'), expected('tag'))
+            self.assertEqual(index.get_top(node, 'g', 'activity'), expected('activity'))
@@ -0,0 +1,189 @@
+from django.core.urlresolvers import reverse
+from django.utils.http import urlquote
+
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from lessons.changes import record_changes
+from lessons.filters import TagQueryFilter
+from lessons.models import Activity, Tag
+from lessons.bitmaps import IDs_to_bits, bits_to_IDs, tag_bitmap_index
+
+
+class TagQueryTests(APITestCase):
+
+    """ TAG QUERY TEST SETUP / TEARDOWN """
+
+    @classmethod
+    def setUpClass(cls):
+        """
+        Fake objects to be used across all tests in this class
+        """
+        # Endpoint URLs for all tests
+        cls.url = reverse('lessons:activity-list')
+        cls.facets_url = reverse('lessons:activity-facets')
+
+        cls.python = Tag.objects.create(name='Python', category='Language')
+        cls.beginner = Tag.objects.create(name='Beginner', category='Difficulty')
+        cls.minutes = Tag.objects.create(name='30 minutes', category='Length')
+
+        cls.activity1 = Activity.objects.create(name='TagQueryActivity1', category='Online')
+        cls.activity1.tags.add(cls.python, cls.beginner)
+        cls.activity2 = Activity.objects.create(name='TagQueryActivity2', category='Offline')
+        cls.activity2.tags.add(cls.python, cls.minutes)
+        cls.activity3 = Activity.objects.create(name='TagQueryActivity3', category='Online')
+        cls.activity3.tags.add(cls.python, cls.minutes)
+        cls.activity4 = Activity.objects.create(name='TagQueryActivity4')
+        cls.activity4.tags.add(cls.beginner)
+
+    @classmethod
+    def tearDownClass(cls):
+        """
+        Delete objects
+        """
+        Activity.objects.all().delete()
+        Tag.objects.all().delete()
+
+    def setUp(self):
+        tag_bitmap_index.rebuild()
+
+    def tearDown(self):
+        tag_bitmap_index.clear()
+
+    def get_activity_IDs(self, tag_query):
+        response = self.client.get(self.url + '?tag_query=' + urlquote(tag_query))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [activity['id'] for activity in response.data]
+
+    """ TAG QUERY GET REQUESTS """
+    def test_tag_query(self):
+        """
+        Should be able to list activities matching a boolean tag query
+        """
+        self.assertEqual(
+            self.get_activity_IDs('python AND (beginner OR "30 minutes") AND NOT offline')
+            , [self.activity1.id, self.activity3.id]
+        )
+        self.assertEqual(self.get_activity_IDs('beginner or Python'), [
+            self.activity1.id
+            , self.activity2.id
+            , self.activity3.id
+            , self.activity4.id
+        ])
+        # Words next to each other are combined with AND
+        self.assertEqual(self.get_activity_IDs('python "30 minutes" online'), [self.activity3.id])
+        self.assertEqual(self.get_activity_IDs('NOT python'), [self.activity4.id])
+        self.assertEqual(self.get_activity_IDs('discussion'), [])
+
+    def test_tag_query_errors(self):
+        """
+        Should NOT be able to run a tag query that cannot be parsed or names an unknown tag
+        """
+        for tag_query, detail in [
+            ('python AND', 'Unexpected end of query.')
+            , ('(python OR beginner', 'Missing ")".')
+            , ('python)', 'Unexpected ")".')
+            , ('"30 minutes', 'Unmatched quote.')
+            , ('DNE', 'Unknown tag: "DNE".')
+        ]:
+            response = self.client.get(self.url + '?tag_query=' + urlquote(tag_query))
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertEqual(response.data, {'detail': detail})
+
+    def test_tag_query_updates(self):
+        """
+        Tag queries should follow changes to activities and their tags
+        """
+        self.activity4.tags.add(self.python)
+        self.assertEqual(self.get_activity_IDs('python beginner'), [self.activity1.id, self.activity4.id])
+
+        self.python.activities.remove(self.activity1)
+        self.assertEqual(self.get_activity_IDs('python beginner'), [self.activity4.id])
+
+        self.activity2.category = 'Online'
+        self.activity2.save()
+        self.assertEqual(self.get_activity_IDs('offline'), [])
+
+        self.minutes.name = 'Half hour'
+        self.minutes.save()
+        self.assertEqual(self.get_activity_IDs('"half hour"'), [self.activity2.id, self.activity3.id])
+
+        self.activity3.delete()
+        self.assertEqual(self.get_activity_IDs('"half hour"'), [self.activity2.id])
+
+        self.activity2.tags.clear()
+        self.assertEqual(self.get_activity_IDs('"half hour"'), [])
+
+    def test_tag_query_changes(self):
+        """
+        Tag queries should follow changes recorded by other processes
+        """
+        Activity.tags.through.objects.create(activity=self.activity4, tag=self.minutes)
+        record_changes('activity', [self.activity4.id])
+        self.assertEqual(self.get_activity_IDs('"30 minutes" beginner'), [self.activity4.id])
+
+    def test_tag_query_many_matches(self):
+        """
+        Should match activities with subqueries when there are too many to list by id
+        """
+        max_IDs = TagQueryFilter.max_IDs
+        TagQueryFilter.max_IDs = 0
+        try:
+            self.assertEqual(
+                self.get_activity_IDs('python AND (beginner OR "30 minutes") AND NOT offline')
+                , [self.activity1.id, self.activity3.id]
+            )
+            self.assertEqual(self.get_activity_IDs('NOT python'), [self.activity4.id])
+            self.assertEqual(self.get_activity_IDs('discussion'), [])
+        finally:
+            TagQueryFilter.max_IDs = max_IDs
+
+    def test_bits(self):
+        """
+        Should convert between ids and bitmaps
+        """
+        for IDs in ([], [0], [1, 7, 8], [3, 64, 65, 1000, 50001]):
+            self.assertEqual(bits_to_IDs(IDs_to_bits(IDs)), IDs)
+        self.assertEqual(IDs_to_bits([0, 3]), 9)
+        self.assertEqual(bits_to_IDs(IDs_to_bits(range(50000))), list(range(50000)))
+
+    """ FACET GET REQUESTS """
+    def test_facets(self):
+        """
+        Should be able to count the tags of each category among all or filtered activities
+        """
+        response = self.client.get(self.facets_url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['count'], 4)
+        self.assertEqual(list(response.data['facets']), [category for category, display in Tag.CATEGORIES])
+        self.assertEqual(response.data['facets']['Language'], [{'id': self.python.id, 'name': 'Python', 'count': 3}])
+        self.assertEqual(response.data['facets']['Difficulty'], [{'id': self.beginner.id, 'name': 'Beginner', 'count': 2}])
+        self.assertEqual(response.data['facets']['Concept'], [])
+
+        # Counts should follow the filters of the activity list
+        response = self.client.get(self.facets_url + '?tag_query=' + urlquote('NOT offline'))
+        self.assertEqual(response.data['count'], 3)
+        self.assertEqual(response.data['facets']['Language'], [{'id': self.python.id, 'name': 'Python', 'count': 2}])
+        self.assertEqual(response.data['facets']['Length'], [{'id': self.minutes.id, 'name': '30 minutes', 'count': 1}])
+
+        response = self.client.get(self.facets_url + '?category=Online&tag_query=beginner')
+        self.assertEqual(response.data['count'], 1)
+        self.assertEqual(response.data['facets']['Language'], [{'id': self.python.id, 'name': 'Python', 'count': 1}])
+
+        # Counts should follow changes to tags
+        self.activity4.tags.add(self.python)
+        response = self.client.get(self.facets_url)
+        self.assertEqual(response.data['facets']['Language'], [{'id': self.python.id, 'name': 'Python', 'count': 4}])
+
+        response = self.client.get(self.facets_url + '?tag_query=DNE')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_facets_changes(self):
+        """
+        Facet counts should follow changes recorded by other processes
+        """
+        Activity.tags.through.objects.filter(activity=self.activity1, tag=self.python).delete()
+        record_changes('activity', [self.activity1.id])
+        response = self.client.get(self.facets_url + '?tag_query=online')
+        self.assertEqual(response.data['count'], 2)
+        self.assertEqual(response.data['facets']['Language'], [{'id': self.python.id, 'name': 'Python', 'count': 1}])
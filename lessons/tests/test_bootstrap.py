@@ -0,0 +1,159 @@
+import json
+
+from django.core.cache import cache
+from django.core.signals import request_finished
+from django.core.urlresolvers import reverse
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, override_settings
+
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from lessons.bootstrap import BOOTSTRAP_CACHE_KEY
+from lessons.models import Activity, Curriculum, CurriculumActivityRelationship, Tag
+
+
+class BootstrapTests(APITestCase):
+
+    """ BOOTSTRAP TEST SETUP / TEARDOWN """
+
+    @classmethod
+    def setUpClass(cls):
+        """
+        Fake objects to be used across all tests in this class
+        """
+        # Endpoint URL for all tests
+        cls.url = reverse('lessons:bootstrap')
+
+        cls.python = Tag.objects.create(name='Python', category='Language')
+        cls.beginner = Tag.objects.create(name='Beginner', category='Difficulty')
+        cls.loops = Activity.objects.create(name='BootstrapLoops', category='Online')
+        cls.loops.tags.add(cls.python, cls.beginner)
+        cls.intro = Activity.objects.create(name='BootstrapIntro', teaching_notes='Start here.')
+        cls.curriculum = Curriculum.objects.create(name='BootstrapCurriculum', lower_grade=0, upper_grade=3)
+        # Added in reverse order so ids and numbers disagree
+        CurriculumActivityRelationship.objects.create(curriculum=cls.curriculum, activity=cls.intro, number=1)
+        CurriculumActivityRelationship.objects.create(curriculum=cls.curriculum, activity=cls.loops, number=2)
+
+    @classmethod
+    def tearDownClass(cls):
+        """
+        Delete objects
+        """
+        Curriculum.objects.all().delete()
+        Activity.objects.all().delete()
+        Tag.objects.all().delete()
+
+    def setUp(self):
+        # Objects changed by other tests are rolled back without signals
+        cache.delete(BOOTSTRAP_CACHE_KEY)
+
+    def tearDown(self):
+        cache.delete(BOOTSTRAP_CACHE_KEY)
+
+    def get_preloaded(self):
+        response = self.client.get(reverse('home'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return json.loads(response.context['bootstrap_json'])
+
+    """ BOOTSTRAP GET REQUESTS """
+    def test_get_bootstrap(self):
+        """
+        Should be able to get curricula, tags and activities in one normalized response with a fixed number of queries
+        """
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(queries), 6)
+        self.assertEqual(list(response.data), ['curricula', 'activities', 'tags'])
+
+        curriculum = response.data['curricula'][self.curriculum.id]
+        self.assertEqual(curriculum['name'], 'BootstrapCurriculum')
+        self.assertEqual(curriculum['lower_grade'], 'K')
+        # Activities in curriculum order and inherited tags, by id
+        self.assertEqual(curriculum['activities'], [self.intro.id, self.loops.id])
+        self.assertEqual(curriculum['tags'], [self.python.id])
+
+        self.assertEqual(sorted(response.data['activities']), [self.loops.id, self.intro.id])
+        self.assertEqual(response.data['activities'][self.intro.id], {
+            'id': self.intro.id
+            , 'name': 'BootstrapIntro'
+            , 'category': None
+            , 'video_url': ''
+            , 'tags': []
+        })
+        self.assertEqual(sorted(response.data['activities'][self.loops.id]['tags']), [self.python.id, self.beginner.id])
+
+        self.assertEqual(sorted(response.data['tags']), [self.python.id, self.beginner.id])
+        self.assertEqual(response.data['tags'][self.python.id]['name'], 'Python')
+
+        # Options meant for the list endpoints do not change the response
+        self.assertEqual(self.client.get(self.url + '?fields=id&expand=tags').data, response.data)
+
+    """ HOME PAGE GET REQUESTS """
+    @override_settings(LESSONS_PRELOAD_BOOTSTRAP=True, LESSONS_BOOTSTRAP_CACHE_TIMEOUT=300)
+    def test_home_preloads_bootstrap(self):
+        """
+        The home page should embed the bootstrap data, cached until it changes
+        """
+        preloaded = self.get_preloaded()
+        self.assertEqual(preloaded['curricula'][str(self.curriculum.id)]['activities'], [self.intro.id, self.loops.id])
+
+        with CaptureQueriesContext(connection) as queries:
+            self.get_preloaded()
+        self.assertEqual(len(queries), 0)
+
+        # Text that could end the <script> element is escaped
+        self.intro.name = '</script><script>alert(1)</script>'
+        self.intro.save()
+        response = self.client.get(reverse('home'))
+        self.assertNotIn('</script><script>alert', response.content)
+        self.assertEqual(self.get_preloaded()['activities'][str(self.intro.id)]['name'], self.intro.name)
+
+        # Moving an activity writes no model signals but still clears the snapshot
+        self.client.post(
+            reverse('lessons:curriculum-move', args=[self.curriculum.id])
+            , {'activityID': self.loops.id, 'position': 1}
+            , format='json'
+        )
+        self.assertEqual(self.get_preloaded()['curricula'][str(self.curriculum.id)]['activities'], [self.loops.id, self.intro.id])
+
+    @override_settings(LESSONS_PRELOAD_BOOTSTRAP=True, LESSONS_BOOTSTRAP_CACHE_TIMEOUT=300)
+    def test_snapshot_cleared_after_commit(self):
+        """
+        A snapshot cached by a concurrent request while a write is uncommitted should be cleared again afterwards
+        """
+        self.get_preloaded()
+        # Tests run in a transaction, like a write still being committed
+        self.intro.name = 'BootstrapIntroRenamed'
+        self.intro.save()
+        self.assertIsNone(cache.get(BOOTSTRAP_CACHE_KEY))
+
+        # Another process caches the rows it still sees
+        cache.set(BOOTSTRAP_CACHE_KEY, '{"stale": true}')
+        request_finished.send(sender=self.__class__)
+        self.assertIsNone(cache.get(BOOTSTRAP_CACHE_KEY))
+        self.assertEqual(self.get_preloaded()['activities'][str(self.intro.id)]['name'], 'BootstrapIntroRenamed')
+        self.intro.name = 'BootstrapIntro'
+
+    @override_settings(LESSONS_PRELOAD_BOOTSTRAP=True)
+    def test_snapshot_not_cached_per_process(self):
+        """
+        The snapshot should not be cached by default with a cache other processes do not share,
+        whose copies a write would not clear
+        """
+        self.get_preloaded()
+        self.assertIsNone(cache.get(BOOTSTRAP_CACHE_KEY))
+        with CaptureQueriesContext(connection) as queries:
+            self.get_preloaded()
+        self.assertTrue(len(queries) > 0)
+
+    @override_settings(LESSONS_PRELOAD_BOOTSTRAP=False)
+    def test_home_without_preload(self):
+        """
+        The home page should not embed any data when preloading is turned off
+        """
+        response = self.client.get(reverse('home'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn('bootstrap_json', response.context)
+        self.assertNotIn('lessonsBootstrap', response.content)
@@ -0,0 +1,435 @@
+import threading
+import time
+import warnings
+
+import mock
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.urlresolvers import reverse
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext, override_settings
+
+from rest_framework import status
+from rest_framework.test import APITransactionTestCase
+
+from lessons import dependencies
+from lessons.models import Activity, Curriculum, CurriculumActivityRelationship, Material, Step, Tag
+from lessons.serializers import CurriculumSerializer
+from lessons.singleflight import SingleFlight, response_flights
+
+
+# Responses are never cached inside a transaction, so these tests commit their writes
+# (the local memory cache of the tests only caches them when a timeout is set)
+@override_settings(LESSONS_RESPONSE_CACHE_TIMEOUT=600)
+class ResponseCacheTests(APITransactionTestCase):
+
+    """ RESPONSE CACHE TEST SETUP """
+
+    def setUp(self):
+        """
+        Fake objects to be used in each test (the tables are emptied after every test)
+        """
+        cache.clear()
+        self.python = Tag.objects.create(name='Python', category='Language')
+        self.laptop = Material.objects.create(name='Laptop')
+        self.loops = Activity.objects.create(name='CacheLoops')
+        self.loops.tags.add(self.python)
+        self.loops.materials.add(self.laptop)
+        self.intro = Activity.objects.create(name='CacheIntro')
+        self.unrelated = Activity.objects.create(name='CacheUnrelated')
+        self.curriculum = Curriculum.objects.create(name='CacheCurriculum', lower_grade=1, upper_grade=3)
+        self.other_curriculum = Curriculum.objects.create(name='CacheOtherCurriculum', lower_grade=1, upper_grade=3)
+        CurriculumActivityRelationship.objects.create(curriculum=self.curriculum, activity=self.loops, number=1)
+        CurriculumActivityRelationship.objects.create(curriculum=self.other_curriculum, activity=self.intro, number=1)
+
+    def tearDown(self):
+        cache.clear()
+
+    def get(self, url, queries_expected=None):
+        """
+        GET `url` and return the response data, checking the number of queries if given
+        """
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        if queries_expected is not None:
+            self.assertEqual(len(queries), queries_expected)
+        return response.data
+
+    def activity_url(self, activity):
+        return reverse('lessons:activity-detail', args=[activity.id])
+
+    def curriculum_url(self, curriculum):
+        return reverse('lessons:curriculum-detail', args=[curriculum.id])
+
+    """ RESPONSE CACHE GET REQUESTS """
+    def test_cached_retrieve(self):
+        """
+        Should answer a repeated activity or curriculum request from the cache without queries
+        """
+        for url in (self.activity_url(self.loops), self.curriculum_url(self.curriculum)):
+            data = self.get(url)
+            self.assertEqual(self.get(url, queries_expected=0), data)
+
+    def test_cached_list(self):
+        """
+        Should cache lists per URL, including the query parameters
+        """
+        url = reverse('lessons:activity-list')
+        self.assertEqual(len(self.get(url)), 3)
+        self.assertEqual(len(self.get(url, queries_expected=0)), 3)
+        # Another filter is another response
+        self.assertEqual(len(self.get(url + '?curriculum={}'.format(self.curriculum.id))), 1)
+        self.assertEqual(len(self.get(url, queries_expected=0)), 3)
+
+    def test_unknown_filter_not_cached(self):
+        """
+        Should not cache lists using query parameters whose tables the cache does not follow
+        """
+        url = reverse('lessons:activity-list') + '?search=loops'
+        self.get(url)
+        with CaptureQueriesContext(connection) as queries:
+            self.get(url)
+        self.assertTrue(len(queries) > 0)
+        # Choosing the fields to output is fine
+        url = reverse('lessons:activity-list') + '?fields=id,name'
+        self.get(url)
+        self.get(url, queries_expected=0)
+
+    def test_not_found_not_cached(self):
+        """
+        Should not cache error responses
+        """
+        url = reverse('lessons:activity-detail', args=[self.unrelated.id + 100])
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertTrue(len(queries) > 0)
+
+    @override_settings(LESSONS_RESPONSE_CACHE_TIMEOUT=0)
+    def test_cache_disabled(self):
+        """
+        Should not cache responses when the timeout is 0
+        """
+        url = self.activity_url(self.loops)
+        self.get(url)
+        with CaptureQueriesContext(connection) as queries:
+            self.get(url)
+        self.assertTrue(len(queries) > 0)
+
+    def test_default_timeout(self):
+        """
+        Should only cache by default with a cache shared between processes
+        """
+        with self.settings():
+            del settings.LESSONS_RESPONSE_CACHE_TIMEOUT
+            self.assertEqual(dependencies.get_timeout('LESSONS_RESPONSE_CACHE_TIMEOUT'), 0)
+            with self.settings(CACHES={'default': {
+                'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache'
+                , 'LOCATION': '/tmp/lessons-test-cache'
+            }}):
+                self.assertEqual(dependencies.get_timeout('LESSONS_RESPONSE_CACHE_TIMEOUT'), 600)
+
+    """ RESPONSE CACHE DEPENDENCIES """
+    def test_record_dependencies(self):
+        """
+        Should record every row embedded in a payload, however deeply nested
+        """
+        with dependencies.recording() as row_keys:
+            CurriculumSerializer(self.curriculum).data
+        self.assertEqual(row_keys, set([
+            dependencies.row_key(Curriculum, self.curriculum.id)
+            , dependencies.row_key(Activity, self.loops.id)
+            , dependencies.row_key(Tag, self.python.id)
+            , dependencies.row_key(Material, self.laptop.id)
+        ]))
+
+    def test_bump_outdates_dependents(self):
+        """
+        Should only outdate the versions that include a changed row
+        """
+        tag_versions = dependencies.get_versions([dependencies.row_key(Tag, self.python.id)])
+        activity_versions = dependencies.get_versions([dependencies.row_key(Activity, self.intro.id)])
+        dependencies.bump(Tag, [self.python.id])
+        self.assertFalse(dependencies.is_current(tag_versions))
+        self.assertTrue(dependencies.is_current(activity_versions))
+
+    """ RESPONSE CACHE INVALIDATION """
+    def test_tag_renamed(self):
+        """
+        Should replace the cached activities and curricula showing a tag when it is renamed, and keep the others
+        """
+        for url in (self.activity_url(self.loops), self.curriculum_url(self.curriculum)
+                    , self.activity_url(self.unrelated), self.curriculum_url(self.other_curriculum)):
+            self.get(url)
+
+        self.python.name = 'Python 3'
+        self.python.save()
+
+        self.assertEqual(self.get(self.activity_url(self.loops))['tags'][0]['name'], 'Python 3')
+        self.assertEqual(self.get(self.curriculum_url(self.curriculum))['activities'][0]['tags'][0]['name'], 'Python 3')
+        self.get(self.activity_url(self.unrelated), queries_expected=0)
+        self.get(self.curriculum_url(self.other_curriculum), queries_expected=0)
+
+    def test_tag_renamed_filtered_lists(self):
+        """
+        Should replace the cached lists filtered on tag columns when a tag starts or stops matching
+        """
+        activities_url = reverse('lessons:activity-list')
+        curricula_url = reverse('lessons:curriculum-list')
+        filtered_urls = (
+            activities_url + '?tag_name=Python%203'
+            , activities_url + '?tag_category=Technology'
+            , curricula_url + '?tag_name=Python%203'
+        )
+        for url in filtered_urls:
+            self.assertEqual(self.get(url), [])
+        tag_query_url = activities_url + '?tag_query=Python'
+        self.assertEqual(len(self.get(tag_query_url)), 1)
+
+        self.python.name = 'Python 3'
+        self.python.category = 'Technology'
+        self.python.save()
+
+        for url in filtered_urls:
+            self.assertEqual(len(self.get(url)), 1)
+        # No tag is called Python anymore
+        self.assertEqual(self.client.get(tag_query_url).status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_material_added(self):
+        """
+        Should replace the cached activities that show a material when another activity gets it
+        """
+        self.get(self.activity_url(self.loops))
+        self.intro.materials.add(self.laptop)
+        material = self.get(self.activity_url(self.loops))['materials'][0]
+        self.assertEqual(sorted(material['activities']), [self.loops.id, self.intro.id])
+
+    def test_activity_deleted(self):
+        """
+        Should replace the cached activities whose materials listed a deleted activity
+        """
+        self.intro.materials.add(self.laptop)
+        self.get(self.activity_url(self.loops))
+        Activity.objects.filter(id=self.intro.id).delete()
+        self.assertEqual(self.get(self.activity_url(self.loops))['materials'][0]['activities'], [self.loops.id])
+
+    def test_activity_tags_cleared(self):
+        """
+        Should replace the cached activities and curricula of a tag when its activities are cleared
+        """
+        self.get(self.activity_url(self.loops))
+        self.get(self.curriculum_url(self.curriculum))
+        self.python.activities.clear()
+        self.assertEqual(self.get(self.activity_url(self.loops))['tags'], [])
+        self.assertEqual(self.get(self.curriculum_url(self.curriculum))['activities'][0]['tags'], [])
+
+    def test_tag_deleted(self):
+        """
+        Should replace the cached activities showing a tag when it is deleted
+        """
+        self.get(self.activity_url(self.loops))
+        self.python.delete()
+        self.assertEqual(self.get(self.activity_url(self.loops))['tags'], [])
+
+    def test_step_added(self):
+        """
+        Should replace the cached activity and curricula when a step is added
+        """
+        self.get(self.activity_url(self.loops))
+        self.get(self.curriculum_url(self.curriculum))
+        Step.objects.create(activity=self.loops, number=1, text='Write a loop.')
+        self.assertEqual(len(self.get(self.activity_url(self.loops))['steps']), 1)
+        self.assertEqual(len(self.get(self.curriculum_url(self.curriculum))['activities'][0]['steps']), 1)
+
+    def test_activity_renamed(self):
+        """
+        Should replace the cached activity, its curricula and the lists when an activity is renamed
+        """
+        activities_url, curricula_url = reverse('lessons:activity-list'), reverse('lessons:curriculum-list')
+        for url in (self.activity_url(self.loops), self.curriculum_url(self.curriculum), activities_url, curricula_url
+                    , self.activity_url(self.intro), self.curriculum_url(self.other_curriculum)):
+            self.get(url)
+
+        self.loops.name = 'CacheWhileLoops'
+        self.loops.save()
+
+        self.assertEqual(self.get(self.activity_url(self.loops))['name'], 'CacheWhileLoops')
+        self.assertEqual(self.get(self.curriculum_url(self.curriculum))['activities'][0]['name'], 'CacheWhileLoops')
+        self.assertIn('CacheWhileLoops', [activity['name'] for activity in self.get(activities_url)])
+        self.assertIn('CacheWhileLoops', [
+            activity['name'] for curriculum in self.get(curricula_url) for activity in curriculum['activities']
+        ])
+        self.get(self.curriculum_url(self.other_curriculum), queries_expected=0)
+        self.get(self.activity_url(self.intro), queries_expected=0)
+
+    def test_activity_appended(self):
+        """
+        Should replace the cached curriculum and activity when an activity is added to a curriculum through the API
+        """
+        self.get(self.activity_url(self.unrelated))
+        self.get(self.curriculum_url(self.curriculum))
+        self.get(self.curriculum_url(self.other_curriculum))
+
+        url = reverse('lessons:curriculum-append', args=[self.curriculum.id])
+        response = self.client.post(url, {'activityID': self.unrelated.id})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        self.assertEqual(self.get(self.activity_url(self.unrelated))['get_curricula'], [self.curriculum.id])
+        self.assertEqual(len(self.get(self.curriculum_url(self.curriculum))['activities']), 2)
+        self.get(self.curriculum_url(self.other_curriculum), queries_expected=0)
+
+    def test_activity_moved(self):
+        """
+        Should replace the cached curriculum when its activities are reordered
+        """
+        CurriculumActivityRelationship.objects.create(curriculum=self.curriculum, activity=self.intro, number=2)
+        self.assertEqual(
+            [activity['id'] for activity in self.get(self.curriculum_url(self.curriculum))['activities']]
+            , [self.loops.id, self.intro.id]
+        )
+
+        url = reverse('lessons:curriculum-move', args=[self.curriculum.id])
+        response = self.client.post(url, {'activityID': self.intro.id, 'position': 1})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        self.assertEqual(
+            [activity['id'] for activity in self.get(self.curriculum_url(self.curriculum))['activities']]
+            , [self.intro.id, self.loops.id]
+        )
+
+    def test_write_while_computing(self):
+        """
+        Should not cache a response when a row it shows is written while it is computed
+        """
+        url = self.activity_url(self.loops)
+        get_versions = dependencies.get_versions
+
+        def write_then_get_versions(row_keys):
+            # The rename commits after the activity was serialized but before its version is read
+            Activity.objects.filter(id=self.loops.id).update(name='CacheLoopsRenamed')
+            dependencies.bump(Activity, [self.loops.id])
+            return get_versions(row_keys)
+
+        with mock.patch.object(dependencies, 'get_versions', write_then_get_versions):
+            self.assertEqual(self.get(url)['name'], 'CacheLoops')
+        self.assertEqual(self.get(url)['name'], 'CacheLoopsRenamed')
+
+    def test_bump_after_commit(self):
+        """
+        Should outdate the versions read by a concurrent request before the write committed
+        """
+        key = dependencies.row_key(Activity, self.loops.id)
+        with transaction.atomic():
+            self.loops.name = 'CacheLoopsRenamed'
+            self.loops.save()
+            # Another request still sees the old row and caches it with the version it reads now
+            versions = dependencies.get_versions([key])
+            self.assertTrue(dependencies.is_current(versions))
+        self.assertFalse(dependencies.is_current(versions))
+
+    def test_cached_long_list(self):
+        """
+        Should cache lists that show more rows than the default size of the local memory cache
+        """
+        Activity.objects.bulk_create([Activity(name='CacheListed' + str(i)) for i in range(400)])
+        url = reverse('lessons:activity-list')
+        self.assertEqual(len(self.get(url)), 403)
+        self.assertEqual(len(self.get(url, queries_expected=0)), 403)
+
+    """ RESPONSE CACHE SINGLE FLIGHT """
+    def test_single_flight(self):
+        """
+        Should let one of several concurrent callers compute a key while the others wait for it
+        """
+        flights = SingleFlight()
+        leaders, waited = [], []
+
+        def request():
+            with flights.lead('key', timeout=5) as leading:
+                if leading:
+                    time.sleep(0.2)
+                    leaders.append(True)
+                else:
+                    # The leader finished before the others carried on
+                    waited.append(len(leaders))
+
+        threads = [threading.Thread(target=request) for i in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(leaders, [True])
+        self.assertEqual(waited, [1, 1, 1, 1])
+
+    def test_single_flight_cache_lock(self):
+        """
+        Should wait for another process holding the cache lock of a key to release it
+        """
+        flights = SingleFlight()
+        cache.add('lessons:lock:key', 'other process', 5)
+        threading.Timer(0.2, cache.delete, ['lessons:lock:key']).start()
+        with flights.lead('key', timeout=5, cache_lock=True) as leading:
+            self.assertFalse(leading)
+
+        # Nobody holds it now
+        with flights.lead('key', timeout=5, cache_lock=True) as leading:
+            self.assertTrue(leading)
+            self.assertIsNotNone(cache.get('lessons:lock:key'))
+        self.assertIsNone(cache.get('lessons:lock:key'))
+
+    def test_single_flight_cache_lock_timeout(self):
+        """
+        Should compute a key itself when the process holding its lock does not finish in time
+        """
+        cache.add('lessons:lock:key', 'dead process', 5)
+        with SingleFlight().lead('key', timeout=0.2, cache_lock=True) as leading:
+            self.assertTrue(leading)
+        # The lock of the other process is left to expire
+        self.assertEqual(cache.get('lessons:lock:key'), 'dead process')
+
+    @override_settings(LESSONS_RESPONSE_CACHE_LOCK=True)
+    def test_cached_with_cache_lock(self):
+        """
+        Should cache responses and release the cache lock when requests lock across processes
+        """
+        url = self.curriculum_url(self.curriculum)
+        with mock.patch.object(dependencies, 'is_cache_shared', return_value=True), \
+                mock.patch.object(response_flights, 'cache_lock', wraps=response_flights.cache_lock) as cache_lock:
+            data = self.get(url)
+            self.assertEqual(self.get(url, queries_expected=0), data)
+        self.assertEqual(cache_lock.call_count, 1)
+        self.assertEqual([key for key in cache._cache if 'lessons:lock:' in key], [])
+
+    @override_settings(LESSONS_RESPONSE_CACHE_LOCK=True)
+    def test_cache_lock_not_shared(self):
+        """
+        Should warn and not lock across processes when the cache is not shared between them
+        """
+        with warnings.catch_warnings(record=True) as caught, \
+                mock.patch.object(response_flights, 'cache_lock') as cache_lock:
+            warnings.simplefilter('always')
+            self.get(self.curriculum_url(self.curriculum))
+        self.assertFalse(cache_lock.called)
+        self.assertIn('LESSONS_RESPONSE_CACHE_LOCK', str(caught[0].message))
+
+    def test_single_flight_slow_leader(self):
+        """
+        Should keep waiting for a leader of the same process that takes longer than the lock timeout
+        """
+        flights = SingleFlight()
+        waited = []
+
+        def follow():
+            with flights.lead('key', timeout=0.2) as leading:
+                waited.append(leading)
+
+        with flights.lead('key', timeout=0.2) as leading:
+            follower = threading.Thread(target=follow)
+            follower.start()
+            # e.g. waited for the cache lock, then computed
+            time.sleep(0.3)
+        follower.join()
+        self.assertEqual(waited, [False])
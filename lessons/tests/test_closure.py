@@ -0,0 +1,184 @@
+from StringIO import StringIO
+
+from django.core.management import call_command
+from django.core.urlresolvers import reverse
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from lessons.models import Activity, ActivityClosure, ActivityRelationship
+
+
+class ActivityClosureTests(APITestCase):
+
+    """ ACTIVITY CLOSURE TEST SETUP / TEARDOWN """
+
+    @classmethod
+    def setUpClass(cls):
+        """
+        Fake objects to be used across all tests in this class
+        """
+        # Endpoint URL for all tests
+        cls.url = reverse('lessons:activity-list')
+
+        cls.course = Activity.objects.create(name='ClosureCourse')
+        cls.unit = Activity.objects.create(name='ClosureUnit')
+        cls.lesson = Activity.objects.create(name='ClosureLesson')
+        cls.extension = Activity.objects.create(name='ClosureExtension')
+
+    @classmethod
+    def tearDownClass(cls):
+        """
+        Delete objects
+        """
+        Activity.objects.all().delete()
+
+    def relate(self, activity, activity_rels):
+        response = self.client.patch(
+            self.url + str(activity.id) + "/"
+            , {'activity_rels': [{'activityID': other.id, 'type': rel_type} for other, rel_type in activity_rels]}
+            , format='json'
+        )
+        return response
+
+    def get_closure(self, activity, route, query=''):
+        response = self.client.get(reverse('lessons:activity-' + route, args=[activity.id]) + query)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [(result['id'], result['depth']) for result in response.data]
+
+    """ ACTIVITY CLOSURE GET REQUESTS """
+    def test_get_descendants(self):
+        """
+        Should be able to list all nested sub-activities and extensions of an activity with one query
+        """
+        # lesson is a sub-activity of unit, which is a sub-activity of course, and extension extends lesson
+        self.assertEqual(self.relate(self.unit, [(self.course, 'SUP')]).status_code, status.HTTP_200_OK)
+        self.assertEqual(self.relate(self.lesson, [(self.unit, 'SUP')]).status_code, status.HTTP_200_OK)
+        self.assertEqual(self.relate(self.lesson, [(self.unit, 'SUP'), (self.extension, 'EXT')]).status_code, status.HTTP_200_OK)
+
+        with CaptureQueriesContext(connection) as queries:
+            descendants = self.get_closure(self.course, 'descendants')
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(descendants, [(self.unit.id, 1), (self.lesson.id, 2)])
+        self.assertEqual(self.get_closure(self.lesson, 'ancestors'), [(self.unit.id, 1), (self.course.id, 2)])
+        self.assertEqual(self.get_closure(self.lesson, 'descendants', '?type=EXT'), [(self.extension.id, 1)])
+        self.assertEqual(self.get_closure(self.extension, 'ancestors'), [])
+
+        # A shortcut makes the lesson a direct sub-activity of the course
+        self.assertEqual(self.relate(self.course, [(self.unit, 'SUB'), (self.lesson, 'SUB')]).status_code, status.HTTP_200_OK)
+        self.assertEqual(self.get_closure(self.course, 'descendants'), [(self.unit.id, 1), (self.lesson.id, 1)])
+
+        response = self.client.get(reverse('lessons:activity-descendants', args=[self.course.id]) + '?type=DNE')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get(reverse('lessons:activity-descendants', args=[0]))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_reject_cycles(self):
+        """
+        Should NOT be able to make an activity its own sub-activity
+        """
+        self.relate(self.unit, [(self.course, 'SUP')])
+        self.relate(self.lesson, [(self.unit, 'SUP')])
+
+        # course as a sub-activity of lesson
+        response = self.relate(self.lesson, [(self.unit, 'SUP'), (self.course, 'SUB')])
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('activity_rels', response.data)
+        self.assertFalse(ActivityRelationship.objects.filter(from_activity=self.course, to_activity=self.lesson).exists())
+        self.assertEqual(self.get_closure(self.course, 'ancestors'), [])
+
+        response = self.relate(self.course, [(self.course, 'EXT')])
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_remove_relationships(self):
+        """
+        The closure should follow removed relationships and deleted activities
+        """
+        self.relate(self.unit, [(self.course, 'SUP')])
+        self.relate(self.lesson, [(self.unit, 'SUP'), (self.course, 'SUP')])
+
+        # The lesson is still below the course without the unit
+        self.assertEqual(self.relate(self.lesson, [(self.course, 'SUP')]).status_code, status.HTTP_200_OK)
+        self.assertEqual(self.get_closure(self.course, 'descendants'), [(self.unit.id, 1), (self.lesson.id, 1)])
+        self.assertEqual(self.get_closure(self.unit, 'descendants'), [])
+
+        self.relate(self.lesson, [(self.unit, 'SUP')])
+        self.assertEqual(self.get_closure(self.course, 'descendants'), [(self.unit.id, 1), (self.lesson.id, 2)])
+
+        Activity.objects.filter(id=self.unit.id).delete()
+        self.assertEqual(self.get_closure(self.course, 'descendants'), [])
+        self.assertEqual(self.get_closure(self.lesson, 'ancestors'), [])
+
+    def test_closure_matches_relationships(self):
+        """
+        The closure should stay equal to the paths of the relationships as they are added and removed,
+        without reading the whole relationship table
+        """
+        activities = [self.course, self.unit, self.lesson, self.extension] + [
+            Activity.objects.create(name='ClosureActivity{}'.format(number)) for number in range(4)
+        ]
+        # Sub-activities of each activity (only to later activities, so there are no cycles), with shortcuts
+        changes = [
+            (0, [1, 2, 4]), (1, [2, 3]), (2, [5, 6]), (4, [5]), (5, [7]), (3, [7]),
+            (1, [3]), (0, [1, 4]), (2, [6]), (5, []), (0, [2]), (4, [5, 6, 7]), (1, []), (2, [5, 6, 7]),
+        ]
+        for parent, children in changes:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.relate(
+                    activities[parent]
+                    , [(activities[child], 'SUB') for child in children]
+                    + [(activity, 'SUP') for activity in activities if self.is_sub(activities[parent], activity)]
+                )
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            for query in queries:
+                if 'FROM "lessons_activityrelationship"' in query['sql']:
+                    self.assertIn('WHERE', query['sql'])
+
+            self.assertClosureMatches()
+
+        Activity.objects.filter(id=activities[2].id).delete()
+        self.assertClosureMatches()
+
+    def test_rebuild_closure_command(self):
+        """
+        Rebuilding the closure from scratch should give the rows kept up to date incrementally
+        """
+        self.relate(self.unit, [(self.course, 'SUB')])
+        self.relate(self.lesson, [(self.unit, 'SUB')])
+        self.relate(self.extension, [(self.lesson, 'EXT'), (self.course, 'EXT')])
+        columns = ('ancestor', 'descendant', 'rel_type', 'depth')
+        incremental = set(ActivityClosure.objects.values_list(*columns))
+        self.assertEqual(set(row[2] for row in incremental), set(['SUB', 'EXT']))
+
+        # e.g. after relationships were written without signals
+        ActivityClosure.objects.all().delete()
+        output = StringIO()
+        call_command('rebuild_activity_closure', stdout=output)
+        self.assertEqual(set(ActivityClosure.objects.values_list(*columns)), incremental)
+        self.assertIn('Stored {} closure rows.'.format(len(incremental)), output.getvalue())
+
+    def is_sub(self, activity, parent):
+        return ActivityRelationship.objects.filter(from_activity=activity, to_activity=parent, rel_type='SUB').exists()
+
+    def assertClosureMatches(self):
+        # Shortest paths of the sub-activity relationships
+        expected = set()
+        for ancestor_ID in Activity.objects.values_list('id', flat=True):
+            depths = {ancestor_ID: 0}
+            queue = [ancestor_ID]
+            while queue:
+                activity_ID = queue.pop(0)
+                for child_ID in ActivityRelationship.objects.filter(
+                    to_activity=activity_ID
+                    , rel_type='SUB'
+                ).values_list('from_activity', flat=True):
+                    if child_ID not in depths:
+                        depths[child_ID] = depths[activity_ID] + 1
+                        queue.append(child_ID)
+            expected |= set((ancestor_ID, ID, depth) for ID, depth in depths.items() if ID != ancestor_ID)
+        self.assertEqual(
+            set(ActivityClosure.objects.filter(rel_type='SUB').values_list('ancestor', 'descendant', 'depth'))
+            , expected
+        )
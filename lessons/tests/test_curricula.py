@@ -1,9 +1,11 @@
 from django.core.urlresolvers import reverse
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 
 from rest_framework import status
 from rest_framework.test import APITestCase
 
-from lessons.models import Activity, Curriculum
+from lessons.models import Activity, Curriculum, CurriculumActivityRelationship, Tag
 from lessons.serializers import ActivitySerializer, CurriculumSerializer
 
 
@@ -107,6 +109,147 @@ class CurriculumTests(APITestCase):
         # Convert ordered dict objects into unordered dicts for comparison
         self.assertEqual(response.data, {'detail': 'Not found'})
 
+    def test_get_all_curricula_query_count(self):
+        """
+        Listing curricula with nested activities should cost a fixed number of queries
+        Activities should be listed in curriculum order
+        """
+        tag = Tag.objects.create(name='QueryCountTag', category='Language')
+        self.activity1.tags.add(tag)
+
+        # Add curricula containing several tagged activities (in reverse order)
+        def add_curricula(count):
+            for i in range(count):
+                curriculum = Curriculum.objects.create(
+                    name='QueryCountCurriculum' + str(Curriculum.objects.count())
+                    , description='This is a query count test curriculum.'
+                    , lower_grade=1
+                    , upper_grade=3
+                )
+                for number, activity in enumerate([self.activity3, self.activity2, self.activity1], start=1):
+                    CurriculumActivityRelationship.objects.create(
+                        curriculum=curriculum
+                        , activity=activity
+                        , number=number
+                    )
+
+        add_curricula(1)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        baseline = len(queries)
+
+        add_curricula(5)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data), 8)
+        self.assertEqual(len(queries), baseline)
+
+        activity_IDs = [activity['id'] for activity in response.data[7]['activities']]
+        self.assertEqual(activity_IDs, [self.activity3.id, self.activity2.id, self.activity1.id])
+        self.assertEqual(response.data[7]['activities'][2]['tags'][0]['name'], 'QueryCountTag')
+
+    def test_get_curricula_sparse_fields(self):
+        """
+        Should be able to list curricula with activity IDs or only some activity fields
+        """
+        curriculum = Curriculum.objects.create(
+            name='SparseCurriculum'
+            , description='This is a sparse fieldset test curriculum.'
+            , lower_grade=0
+            , upper_grade=3
+        )
+        for number, activity in enumerate([self.activity2, self.activity1], start=1):
+            CurriculumActivityRelationship.objects.create(
+                curriculum=curriculum
+                , activity=activity
+                , number=number
+            )
+        url = self.url + str(curriculum.id) + '/'
+
+        response = self.client.get(url + '?fields=id,lower_grade,activities&expand=')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, {
+            'id': curriculum.id
+            , 'lower_grade': 'K'
+            , 'activities': [self.activity2.id, self.activity1.id]
+        })
+
+        response = self.client.get(url + '?fields=activities&expand=activities,activities.tags')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        activity = response.data['activities'][1]
+        self.assertEqual(activity['id'], self.activity1.id)
+        self.assertEqual([tag['id'] for tag in activity['tags']], [tag.id for tag in self.activity1.tags.all()])
+        self.assertEqual(activity['materials'], [material.id for material in self.activity1.materials.all()])
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url + '?fields=id,name')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(queries), 1)
+
+    def test_curriculum_inherits_tags(self):
+        """
+        Curricula should list the Language and Technology tags of their activities as they change
+        """
+        language = Tag.objects.create(name='InheritLanguage', category='Language')
+        technology = Tag.objects.create(name='InheritTechnology', category='Technology')
+        concept = Tag.objects.create(name='InheritConcept', category='Concept')
+        self.activity1.tags.add(language, concept)
+        self.activity2.tags.add(language, technology)
+
+        def get_tag_IDs():
+            response = self.client.get(self.url + str(self.curriculum1.id) + '/?fields=tags&expand=')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            return sorted(response.data['tags'])
+
+        # Adding activities to the curriculum (bulk insert)
+        response = self.client.patch(self.url + str(self.curriculum1.id) + '/', {
+            'activity_rels': [
+                {'activityID': self.activity1.id, 'number': 1}
+                , {'activityID': self.activity2.id, 'number': 2}
+            ]
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(sorted(tag['id'] for tag in response.data['tags']), [language.id, technology.id])
+
+        # Removing a tag from an activity
+        self.activity2.tags.remove(technology)
+        self.assertEqual(get_tag_IDs(), [language.id])
+
+        # Changing the category of a tag
+        concept.category = 'Technology'
+        concept.save()
+        self.assertEqual(get_tag_IDs(), [language.id, concept.id])
+
+        # Removing an activity from the curriculum
+        CurriculumActivityRelationship.objects.get(curriculum=self.curriculum1, activity=self.activity1).delete()
+        self.assertEqual(get_tag_IDs(), [language.id])
+
+        # Clearing the activities of a tag
+        language.activities.clear()
+        self.assertEqual(get_tag_IDs(), [])
+
+    def test_filter_curricula(self):
+        """
+        Should be able to list only curricula for a given grade or inherited tag
+        """
+        tag = Tag.objects.create(name='FilterLanguage', category='Language')
+        self.activity1.tags.add(tag)
+        CurriculumActivityRelationship.objects.create(curriculum=self.curriculum2, activity=self.activity1, number=1)
+
+        def get_curriculum_IDs(query):
+            response = self.client.get(self.url + query)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            return [curriculum['id'] for curriculum in response.data]
+
+        self.assertEqual(get_curriculum_IDs('?grade=1'), [self.curriculum1.id])
+        self.assertEqual(get_curriculum_IDs('?grade=3'), [self.curriculum1.id, self.curriculum2.id])
+        self.assertEqual(get_curriculum_IDs('?grade=5'), [])
+        self.assertEqual(get_curriculum_IDs('?lower_grade=2'), [self.curriculum2.id])
+        self.assertEqual(get_curriculum_IDs('?tag=' + str(tag.id)), [self.curriculum2.id])
+        self.assertEqual(get_curriculum_IDs('?tag_name=FilterLanguage&grade=1'), [])
+
     """ CURRICULUM POST REQUESTS """
     def test_create_curriculum(self):
         """
@@ -340,7 +483,7 @@ class CurriculumTests(APITestCase):
         }
         response3 = self.client.post(self.url, curriculum3)
         self.assertEqual(response3.status_code, status.HTTP_404_NOT_FOUND)
-        self.assertEqual(response3.data, {'detail': 'Not found'})
+        self.assertEqual(response3.data, {'detail': 'Not found', 'activity_rels': [100]})
 
         # One of several DNE
         curriculum4 = {
@@ -361,7 +504,51 @@ class CurriculumTests(APITestCase):
         }
         response4 = self.client.post(self.url, curriculum4)
         self.assertEqual(response4.status_code, status.HTTP_404_NOT_FOUND)
-        self.assertEqual(response4.data, {'detail': 'Not found'})
+        self.assertEqual(response4.data, {'detail': 'Not found', 'activity_rels': [100]})
+
+    def test_create_curriculum_activities_bulk(self):
+        """
+        Activity ordering rows for a new curriculum should be inserted with a single query
+        Should NOT be able to use the same number twice within a curriculum
+        """
+        curriculum3 = {
+            'name': 'TestCurriculum3'
+            , 'description': 'This curriculum has several activities.'
+            , 'lower_grade': 1
+            , 'upper_grade': 3
+            , 'activity_rels': [
+                {'activityID': self.activity1.id, 'number': 1}
+                , {'activityID': self.activity2.id, 'number': 2}
+                , {'activityID': self.activity3.id, 'number': 3}
+            ]
+        }
+        with CaptureQueriesContext(connection) as queries:
+            response3 = self.client.post(self.url, curriculum3)
+        self.assertEqual(response3.status_code, status.HTTP_201_CREATED)
+        inserts = [
+            query['sql'] for query in queries
+            if 'INSERT INTO "lessons_curriculumactivityrelationship"' in query['sql']
+        ]
+        self.assertEqual(len(inserts), 1)
+        activity_IDs = [activity['id'] for activity in response3.data['activities']]
+        self.assertEqual(activity_IDs, [self.activity1.id, self.activity2.id, self.activity3.id])
+
+        # Duplicate number
+        curriculum4 = {
+            'name': 'TestCurriculum4'
+            , 'description': 'This curriculum uses a number twice.'
+            , 'lower_grade': 1
+            , 'upper_grade': 3
+            , 'activity_rels': [
+                {'activityID': self.activity1.id, 'number': 1}
+                , {'activityID': self.activity2.id, 'number': 1}
+            ]
+        }
+        response4 = self.client.post(self.url, curriculum4)
+        self.assertEqual(response4.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(list(response4.data), ['activity_rels'])
+        self.assertTrue(response4.data['activity_rels'][0].startswith('Number 1 is already used'))
+        self.assertFalse(Curriculum.objects.filter(name='TestCurriculum4').exists())
 
     """ CURRICULUM PATCH REQUESTS """
     def test_update_curriculum(self):
@@ -559,6 +746,44 @@ class CurriculumTests(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(response.data, curriculum3)
 
+    def test_update_curriculum_activities_writes_only_changes(self):
+        """
+        Re-sending a curriculum's full activity list with one new activity should only insert one row
+        """
+        for number, activity in enumerate([self.activity1, self.activity2], start=1):
+            CurriculumActivityRelationship.objects.create(
+                curriculum=self.curriculum1
+                , activity=activity
+                , number=number
+            )
+        original_IDs = list(self.curriculum1.activity_relationships.values_list('id', flat=True))
+
+        activity_rels = [
+            {'activityID': self.activity1.id, 'number': 1}
+            , {'activityID': self.activity2.id, 'number': 2}
+            , {'activityID': self.activity3.id, 'number': 3}
+        ]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.patch(
+                self.url + str(self.curriculum1.id) + "/"
+                , {'activity_rels': activity_rels}
+            )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        activity_IDs = [activity['id'] for activity in response.data['activities']]
+        self.assertEqual(activity_IDs, [self.activity1.id, self.activity2.id, self.activity3.id])
+
+        # Existing rows are untouched
+        writes = [
+            query['sql'] for query in queries
+            if 'INSERT INTO "lessons_curriculumactivityrelationship"' in query['sql']
+            or 'DELETE FROM "lessons_curriculumactivityrelationship"' in query['sql']
+        ]
+        self.assertEqual(len(writes), 1)
+        self.assertEqual(
+            list(self.curriculum1.activity_relationships.values_list('id', flat=True))[:2]
+            , original_IDs
+        )
+
     def test_add_invalid_activity_curriculum(self):
         """
         Should NOT be able to add invalid activity to an existing curriculum
@@ -332,7 +332,7 @@ class MaterialTests(APITestCase):
 
         self.assertEqual(response1.data, {'name': ['This field may not be blank.']})
         self.assertEqual(response2.data, {'url': ['This field may not be blank.']})
-        self.assertEqual(response3.data, {'detail': 'Not found'})
+        self.assertEqual(response3.data, {'detail': 'Not found', 'activities': [100]})
         self.assertEqual(response4.data, {'name': ['This field must be unique.']})
 
     def test_update_material_that_DNE(self):
@@ -0,0 +1,122 @@
+from django.core.urlresolvers import reverse
+from django.test.utils import override_settings
+
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from lessons.models import Activity, Curriculum, CurriculumActivityRelationship
+from lessons.pagination import encode_cursor
+
+
+class PaginationTests(APITestCase):
+
+    """ PAGINATION TEST SETUP / TEARDOWN """
+
+    @classmethod
+    def setUpClass(cls):
+        """
+        Fake objects to be used across all tests in this class
+        """
+        cls.activities = [
+            Activity.objects.create(name='PaginationActivity' + str(i))
+            for i in range(5)
+        ]
+        cls.curricula = [
+            Curriculum.objects.create(
+                name='PaginationCurriculum' + str(i)
+                , description='This is a pagination test curriculum.'
+                , lower_grade=1
+                , upper_grade=3
+            )
+            for i in range(2)
+        ]
+        # Add activities in reverse order so ids and numbers disagree
+        for curriculum in cls.curricula:
+            for number, activity in enumerate(reversed(cls.activities[:3]), start=1):
+                CurriculumActivityRelationship.objects.create(
+                    curriculum=curriculum
+                    , activity=activity
+                    , number=number
+                )
+
+    @classmethod
+    def tearDownClass(cls):
+        """
+        Delete objects
+        """
+        Activity.objects.all().delete()
+        Curriculum.objects.all().delete()
+
+    def get_all_pages(self, url):
+        """
+        Follow `next` links until the last page, returning every page
+        """
+        pages = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            pages.append(response.data['results'])
+            url = response.data['next']
+        return pages
+
+    """ PAGINATION GET REQUESTS """
+    def test_unpaginated_list(self):
+        """
+        Lists should not be paginated unless requested
+        """
+        response = self.client.get(reverse('lessons:activity-list'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data), 5)
+
+    def test_paginate_activities(self):
+        """
+        Should be able to walk through activities page by page in id order
+        """
+        pages = self.get_all_pages(reverse('lessons:activity-list') + '?page_size=2')
+
+        self.assertEqual([len(page) for page in pages], [2, 2, 1])
+        activity_IDs = [activity['id'] for page in pages for activity in page]
+        self.assertEqual(activity_IDs, [activity.id for activity in self.activities])
+
+    @override_settings(LESSONS_PAGE_SIZE=2, LESSONS_MAX_PAGE_SIZE=3)
+    def test_page_size_settings(self):
+        """
+        Should read the default and maximum page sizes from the settings on each request
+        """
+        response = self.client.get(reverse('lessons:activity-list') + '?cursor=' + encode_cursor([0]))
+        self.assertEqual(len(response.data['results']), 2)
+        response = self.client.get(reverse('lessons:activity-list') + '?page_size=5')
+        self.assertEqual(len(response.data['results']), 3)
+
+    def test_paginate_curriculum_activity_relationships(self):
+        """
+        Should page through curriculum activities in (curriculum, number) order
+        """
+        pages = self.get_all_pages(reverse('lessons:curriculumactivityrelationship-list') + '?page_size=2')
+
+        self.assertEqual([len(page) for page in pages], [2, 2, 2])
+        activity_IDs = [rel['activity']['id'] for page in pages for rel in page]
+        expected = [activity.id for activity in reversed(self.activities[:3])] * 2
+        self.assertEqual(activity_IDs, expected)
+
+    def test_invalid_cursor(self):
+        """
+        Should NOT be able to paginate with an invalid cursor or page size
+        """
+        response = self.client.get(reverse('lessons:activity-list') + '?cursor=DNE')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data, {'detail': 'Invalid cursor.'})
+
+        response = self.client.get(reverse('lessons:activity-list') + '?page_size=0')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data, {'detail': 'Invalid page size.'})
+
+        # Well-formed cursors with values of the wrong type
+        for values in (['abc'], [['abc']], [1, 2]):
+            response = self.client.get(reverse('lessons:activity-list') + '?cursor=' + encode_cursor(values))
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertEqual(response.data, {'detail': 'Invalid cursor.'})
+        response = self.client.get(
+            reverse('lessons:curriculumactivityrelationship-list') + '?cursor=' + encode_cursor([1, 'abc'])
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
@@ -0,0 +1,120 @@
+from django.core.cache import cache
+from django.core.urlresolvers import reverse
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, override_settings
+
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from lessons.models import Activity, Step
+
+
+# The local memory cache of the tests only caches plans when a timeout is set
+@override_settings(LESSONS_PLAN_CACHE_TIMEOUT=600)
+class LessonPlanTests(APITestCase):
+
+    """ LESSON PLAN TEST SETUP / TEARDOWN """
+
+    @classmethod
+    def setUpClass(cls):
+        """
+        Fake objects to be used across all tests in this class
+        """
+        cls.lesson = Activity.objects.create(name='PlanLesson')
+        cls.game = Activity.objects.create(name='PlanGame')
+        cls.warmup = Activity.objects.create(name='PlanWarmup')
+
+        # The game is played twice in the lesson and starts with the warmup
+        Step.objects.create(text='Introduction', activity=cls.lesson, number=1)
+        Step.objects.create(text='First round', activity=cls.lesson, number=2, step_activity=cls.game)
+        Step.objects.create(text='Second round', activity=cls.lesson, number=3, step_activity=cls.game)
+        Step.objects.create(text='Rules', activity=cls.game, number=2)
+        Step.objects.create(text='Warm up', activity=cls.game, number=1, step_activity=cls.warmup)
+        Step.objects.create(text='Stretch', activity=cls.warmup, number=1)
+
+        # Endpoint URL for all tests
+        cls.url = reverse('lessons:activity-plan', args=[cls.lesson.id])
+
+    @classmethod
+    def tearDownClass(cls):
+        """
+        Delete objects
+        """
+        Step.objects.all().delete()
+        Activity.objects.all().delete()
+
+    def setUp(self):
+        # Objects changed by other tests are rolled back without signals
+        cache.clear()
+
+    def tearDown(self):
+        cache.clear()
+
+    def get_plan(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [(step['number'], step['depth'], step['text']) for step in response.data]
+
+    """ LESSON PLAN GET REQUESTS """
+    def test_get_plan(self):
+        """
+        Should be able to get the steps of an activity with nested steps expanded, one query per level
+        """
+        with CaptureQueriesContext(connection) as queries:
+            plan = self.get_plan()
+        self.assertEqual(len(queries), 3)
+        self.assertEqual(plan, [
+            ('1', 0, 'Introduction')
+            , ('2', 0, 'First round')
+            , ('2.1', 1, 'Warm up')
+            , ('2.1.1', 2, 'Stretch')
+            , ('2.2', 1, 'Rules')
+            , ('3', 0, 'Second round')
+            , ('3.1', 1, 'Warm up')
+            , ('3.1.1', 2, 'Stretch')
+            , ('3.2', 1, 'Rules')
+        ])
+
+        # Compiled plans are cached
+        with CaptureQueriesContext(connection) as queries:
+            self.get_plan()
+        self.assertEqual(len(queries), 0)
+
+        response = self.client.get(reverse('lessons:activity-plan', args=[self.warmup.id + 100]))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        response = self.client.get(reverse('lessons:activity-plan', args=['abc']))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+        # Plans of missing activities are not cached
+        activity = Activity.objects.create(id=self.warmup.id + 100, name='PlanNew')
+        response = self.client.get(reverse('lessons:activity-plan', args=[activity.id]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, [])
+
+    def test_plan_updates(self):
+        """
+        Plans should follow changes to any step they include
+        """
+        self.get_plan()
+        step = Step.objects.create(text='Cool down', activity=self.warmup, number=2)
+        self.assertIn(('2.1.2', 2, 'Cool down'), self.get_plan())
+
+        step.delete()
+        self.assertNotIn(('2.1.2', 2, 'Cool down'), self.get_plan())
+
+        Step.objects.filter(text='Second round').get().delete()
+        self.assertEqual(len(self.get_plan()), 5)
+
+        self.warmup.name = 'PlanStretches'
+        self.warmup.save()
+        response = self.client.get(self.url)
+        self.assertEqual(response.data[1]['step_activity_name'], 'PlanGame')
+        self.assertEqual(response.data[2]['step_activity_name'], 'PlanStretches')
+
+    def test_plan_cycle(self):
+        """
+        Should NOT be able to get the plan of an activity whose steps lead back to it
+        """
+        Step.objects.create(text='Back to the lesson', activity=self.warmup, number=2, step_activity=self.lesson)
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
@@ -0,0 +1,244 @@
+from django.core.urlresolvers import reverse
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from lessons.models import Activity, Curriculum, CurriculumActivityRelationship, Tag
+
+
+class CurriculumReorderTests(APITestCase):
+
+    """ CURRICULUM REORDER TEST SETUP / TEARDOWN """
+
+    @classmethod
+    def setUpClass(cls):
+        """
+        Fake objects to be used across all tests in this class
+        """
+        cls.curriculum = Curriculum.objects.create(name='ReorderCurriculum', lower_grade=1, upper_grade=3)
+        cls.activities = [Activity.objects.create(name='ReorderActivity' + str(i)) for i in range(1, 5)]
+        cls.tag = Tag.objects.create(name='ReorderTag', category='Language')
+        cls.activities[3].tags.add(cls.tag)
+
+        # Endpoint URL for all tests
+        cls.url = reverse('lessons:curriculum-move', args=[cls.curriculum.id])
+
+    @classmethod
+    def tearDownClass(cls):
+        """
+        Delete objects
+        """
+        Curriculum.objects.all().delete()
+        Activity.objects.all().delete()
+        Tag.objects.all().delete()
+
+    def setUp(self):
+        for number, activity in enumerate(self.activities[:3], start=1):
+            CurriculumActivityRelationship.objects.create(curriculum=self.curriculum, activity=activity, number=number)
+
+    def move(self, activity, position):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(self.url, {'activityID': activity.id, 'position': position}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, {'activityID': activity.id, 'number': position})
+        return [query['sql'] for query in queries if 'UPDATE "lessons_curriculumactivityrelationship"' in query['sql']]
+
+    def post(self, route, data):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('lessons:curriculum-' + route, args=[self.curriculum.id]), data, format='json')
+        writes = [
+            query['sql'] for query in queries
+            if 'lessons_curriculumactivityrelationship' in query['sql'].split(' WHERE ')[0]
+            and any(command in query['sql'] for command in ('INSERT', 'UPDATE', 'DELETE'))
+        ]
+        return response, writes
+
+    def get_order(self):
+        return list(self.curriculum.activity_relationships.values_list('activity_id', flat=True))
+
+    """ CURRICULUM REORDER POST REQUESTS """
+    def test_move_activity(self):
+        """
+        Should be able to move an activity within a curriculum, usually by updating one row
+        """
+        first, second, third = self.activities[:3]
+
+        self.assertEqual(len(self.move(third, 1)), 1)
+        self.assertEqual(self.get_order(), [third.id, first.id, second.id])
+
+        self.assertEqual(len(self.move(third, 3)), 1)
+        self.assertEqual(self.get_order(), [first.id, second.id, third.id])
+
+        # No room between 1 and 2, so the curriculum is renumbered in bulk
+        self.assertEqual(len(self.move(third, 2)), 2)
+        self.assertEqual(self.get_order(), [first.id, third.id, second.id])
+        self.assertEqual(len(self.move(second, 2)), 1)
+        self.assertEqual(self.get_order(), [first.id, second.id, third.id])
+
+        # Positions are still shown as 1..n
+        response = self.client.get(reverse('lessons:curriculumactivityrelationship-list'))
+        self.assertEqual(
+            [(rel['activity']['id'], rel['number']) for rel in response.data if rel['curriculum'] == self.curriculum.id]
+            , [(first.id, 1), (second.id, 2), (third.id, 3)]
+        )
+        relationship = CurriculumActivityRelationship.objects.get(activity=third)
+        response = self.client.get(reverse('lessons:curriculumactivityrelationship-detail', args=[relationship.id]))
+        self.assertEqual(response.data['number'], 3)
+
+    def test_move_activity_invalid_data(self):
+        """
+        Should NOT be able to move an activity that is not in the curriculum or to a position out of range
+        """
+        for data, field_name in [
+            ({'activityID': self.activities[3].id, 'position': 1}, 'activityID')
+            , ({'activityID': self.activities[0].id, 'position': 4}, 'position')
+            , ({'activityID': self.activities[0].id, 'position': 0}, 'position')
+            , ({'activityID': self.activities[0].id, 'position': 'first'}, 'position')
+            , ({'activityID': self.activities[0].id}, 'position')
+        ]:
+            response = self.client.post(self.url, data, format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertIn(field_name, response.data)
+        self.assertEqual(self.get_order(), [activity.id for activity in self.activities[:3]])
+
+        response = self.client.post(reverse('lessons:curriculum-move', args=[0]), {'activityID': 1, 'position': 1}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_append_activity(self):
+        """
+        Should be able to add an activity at the end of a curriculum with one INSERT
+        """
+        response, writes = self.post('append', {'activityID': self.activities[3].id})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(writes), 1)
+        self.assertEqual(response.data['activityID'], self.activities[3].id)
+        self.assertEqual(response.data['number'], 4)
+        self.assertEqual([tag['id'] for tag in response.data['tags']], [self.tag.id])
+        self.assertEqual(self.get_order(), [activity.id for activity in self.activities])
+
+        # Already in the curriculum
+        response, writes = self.post('append', {'activityID': self.activities[3].id})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('activityID', response.data)
+        response, writes = self.post('append', {'activityID': 0})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_insert_activity(self):
+        """
+        Should be able to add an activity at a position of a curriculum
+        """
+        first, second, third, fourth = self.activities
+
+        # No room between 1 and 2, so the curriculum is renumbered in bulk before inserting
+        response, writes = self.post('insert', {'activityID': fourth.id, 'position': 2})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['number'], 2)
+        self.assertEqual(len(writes), 3)
+        self.assertEqual(self.get_order(), [first.id, fourth.id, second.id, third.id])
+
+        response, writes = self.post('remove', {'activityID': fourth.id})
+        response, writes = self.post('insert', {'activityID': fourth.id, 'position': 3})
+        self.assertEqual(len(writes), 1)
+        self.assertEqual(self.get_order(), [first.id, second.id, fourth.id, third.id])
+
+        response, writes = self.post('insert', {'activityID': fourth.id, 'position': 1})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_remove_activity(self):
+        """
+        Should be able to take an activity out of a curriculum with one DELETE
+        """
+        response, writes = self.post('remove', {'activityID': self.activities[1].id})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(writes), 1)
+        self.assertEqual(response.data, {'activityID': self.activities[1].id, 'number': None, 'tags': []})
+        self.assertEqual(self.get_order(), [self.activities[0].id, self.activities[2].id])
+
+        response, writes = self.post('remove', {'activityID': self.activities[1].id})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(len(writes), 0)
+
+    """ CURRICULUM REORDER PATCH REQUESTS """
+    def test_update_curriculum_positions(self):
+        """
+        Should treat the numbers of a curriculum's activity_rels as positions, only writing the rows that moved
+        """
+        first, second, third, fourth = self.activities
+        url = reverse('lessons:curriculum-detail', args=[self.curriculum.id])
+
+        def patch(order):
+            rels = [{'activityID': activity.id, 'number': number} for number, activity in enumerate(order, start=1)]
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.patch(url, {'activity_rels': rels}, format='json')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(self.get_order(), [activity.id for activity in order])
+            return [
+                query['sql'] for query in queries
+                if 'lessons_curriculumactivityrelationship' in query['sql'].split(' WHERE ')[0]
+                and any(command in query['sql'] for command in ('INSERT', 'UPDATE', 'DELETE'))
+            ]
+
+        # Sending back the positions just read writes nothing
+        self.assertEqual(patch([first, second, third]), [])
+
+        # Moving one activity updates its row only (through a temporary number)
+        writes = patch([third, first, second])
+        self.assertEqual(len(writes), 2)
+        self.assertTrue(all('UPDATE' in query for query in writes))
+
+        # Adding one activity inserts its row only
+        self.assertEqual(len(patch([third, fourth, first, second])), 1)
+        self.assertEqual(len(patch([third, first, second])), 1)
+
+        response = self.client.get(reverse('lessons:curriculumactivityrelationship-list'))
+        self.assertEqual(
+            [(rel['activity']['id'], rel['number']) for rel in response.data if rel['curriculum'] == self.curriculum.id]
+            , [(third.id, 1), (first.id, 2), (second.id, 3)]
+        )
+
+    def test_update_activity_positions(self):
+        """
+        Should treat the numbers of an activity's curriculum_rels as positions, a position past the end adding it last
+        """
+        first, second, third, fourth = self.activities
+        url = reverse('lessons:activity-detail', args=[fourth.id])
+
+        # Added last, as the activity modal does with len(activities) + 1
+        response = self.client.patch(url, {'curriculum_rels': [{'curriculumID': self.curriculum.id, 'number': 4}]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.get_order(), [first.id, second.id, third.id, fourth.id])
+
+        # Moved, or left alone when the position does not change
+        response = self.client.patch(url, {'curriculum_rels': [{'curriculumID': self.curriculum.id, 'number': 1}]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.get_order(), [fourth.id, first.id, second.id, third.id])
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.patch(url, {'curriculum_rels': [{'curriculumID': self.curriculum.id, 'number': 1}]}, format='json')
+        self.assertFalse([query for query in queries if query['sql'].startswith('UPDATE "lessons_curriculumactivityrelationship"')])
+
+        # Positions past the end move it last
+        response = self.client.patch(url, {'curriculum_rels': [{'curriculumID': self.curriculum.id, 'number': 10}]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.get_order(), [first.id, second.id, third.id, fourth.id])
+
+    def test_create_activity_position(self):
+        """
+        Should add a new activity at the position given by the number of its curriculum_rels
+        """
+        response = self.client.post(reverse('lessons:activity-list'), {
+            'name': 'ReorderActivity5'
+            , 'description': 'Added last.'
+            , 'tag_IDs': [self.tag.id]
+            , 'category': ''
+            , 'teaching_notes': ''
+            , 'video_url': ''
+            , 'curriculum_rels': [{'curriculumID': self.curriculum.id, 'number': 4}]
+            , 'activity_rels': []
+            , 'material_IDs': []
+            , 'resource_IDs': []
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.get_order(), [activity.id for activity in self.activities[:3]] + [response.data['id']])
+        Activity.objects.filter(id=response.data['id']).delete()
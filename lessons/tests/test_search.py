@@ -0,0 +1,172 @@
+from django.core.urlresolvers import reverse
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from lessons.changes import record_changes
+from lessons.models import Activity, IndexChange, Tag, Material
+from lessons.search import search_index
+
+
+class SearchTests(APITestCase):
+
+    """ SEARCH TEST SETUP / TEARDOWN """
+
+    @classmethod
+    def setUpClass(cls):
+        """
+        Fake objects to be used across all tests in this class
+        """
+        # Endpoint URL for all tests
+        cls.url = reverse('lessons:search')
+
+        cls.tag = Tag.objects.create(name='Python', category='Language')
+        cls.loops = Activity.objects.create(
+            name='Loops'
+            , description="Repeat things with for and while loops."
+            , teaching_notes="Students often forget to update the loop variable."
+        )
+        cls.loops.tags.add(cls.tag)
+        cls.functions = Activity.objects.create(
+            name='Functions'
+            , description="Write functions that call other functions, even inside loops."
+        )
+        cls.games = Activity.objects.create(
+            name='Games'
+            , description="Play a <b>game</b> without computers."
+        )
+
+    @classmethod
+    def tearDownClass(cls):
+        """
+        Delete objects
+        """
+        Activity.objects.all().delete()
+        Tag.objects.all().delete()
+
+    def setUp(self):
+        search_index.rebuild()
+
+    def tearDown(self):
+        search_index.clear()
+
+    def search(self, query):
+        response = self.client.get(self.url + query)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    """ SEARCH GET REQUESTS """
+    def test_search_ranking(self):
+        """
+        Should list matching activities best match first, only querying the database for changes
+        """
+        with CaptureQueriesContext(connection) as queries:
+            data = self.search('?q=loops')
+        self.assertEqual(len(queries), 1)
+
+        self.assertEqual(data['count'], 2)
+        self.assertEqual([hit['id'] for hit in data['results']], [self.loops.id, self.functions.id])
+        self.assertEqual(data['results'][0]['name'], 'Loops')
+        self.assertEqual(data['results'][0]['highlights']['name'], '<em>Loops</em>')
+        self.assertEqual(
+            data['results'][1]['highlights']['description']
+            , 'Write functions that call other functions, even inside <em>loops</em>.'
+        )
+
+        # Words in tag names should match too
+        data = self.search('?q=python')
+        self.assertEqual([hit['id'] for hit in data['results']], [self.loops.id])
+        self.assertEqual(data['results'][0]['highlights'], {'tags': '<em>Python</em>'})
+
+        # Highlighted text should be escaped
+        data = self.search('?q=game')
+        self.assertEqual(data['results'][0]['highlights']['description'], 'Play a &lt;b&gt;<em>game</em>&lt;/b&gt; without computers.')
+
+        self.assertEqual(self.search('?q=')['count'], 0)
+        self.assertEqual(self.search('?q=DNE')['count'], 0)
+
+    def test_search_pages(self):
+        """
+        Should be able to page through search hits
+        """
+        data = self.search('?q=loops&page_size=1')
+        self.assertEqual(data['count'], 2)
+        self.assertEqual([hit['id'] for hit in data['results']], [self.loops.id])
+
+        response = self.client.get(data['next'])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([hit['id'] for hit in response.data['results']], [self.functions.id])
+        self.assertEqual(response.data['next'], None)
+
+        response = self.client.get(self.url + '?q=loops&page=0')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data, {'detail': 'Invalid page.'})
+
+    def test_search_index_updates(self):
+        """
+        Search hits should follow changes to activities and their tags and materials
+        """
+        activity = Activity.objects.create(name='Recursion', description="Functions that call themselves.")
+        self.assertEqual([hit['id'] for hit in self.search('?q=recursion')['results']], [activity.id])
+
+        activity.name = 'Self Reference'
+        activity.save()
+        self.assertEqual(self.search('?q=recursion')['count'], 0)
+
+        material = Material.objects.create(name='Recursion Worksheet', url='http://www.recursion.com')
+        activity.materials.add(material)
+        self.assertEqual([hit['id'] for hit in self.search('?q=worksheet')['results']], [activity.id])
+
+        material.name = 'Handout'
+        material.save()
+        self.assertEqual(self.search('?q=worksheet')['count'], 0)
+        self.assertEqual(self.search('?q=handout')['count'], 1)
+
+        material.delete()
+        self.assertEqual(self.search('?q=handout')['count'], 0)
+
+        self.tag.activities.clear()
+        self.assertEqual(self.search('?q=python')['count'], 0)
+
+        activity.delete()
+        self.assertEqual(self.search('?q=reference')['count'], 0)
+
+    def test_search_index_changes(self):
+        """
+        Search hits should show changes recorded by other processes and never show rolled back changes
+        """
+        # Another process renames an activity
+        Activity.objects.filter(id=self.games.id).update(name='Unplugged')
+        record_changes('activity', [self.games.id])
+        self.assertEqual([hit['id'] for hit in self.search('?q=unplugged')['results']], [self.games.id])
+
+        try:
+            with transaction.atomic():
+                activity = Activity.objects.create(name='Phantom')
+                self.assertEqual([hit['id'] for hit in self.search('?q=phantom')['results']], [activity.id])
+                raise ValueError
+        except ValueError:
+            pass
+
+        # The id of the rolled back change may be reused by the next one
+        Activity.objects.create(name='Sorting')
+        self.assertEqual(self.search('?q=phantom')['count'], 0)
+        self.assertEqual(self.search('?q=sorting')['count'], 1)
+
+    def test_search_index_late_commit(self):
+        """
+        Search hits should show changes committed after changes with higher ids
+        """
+        self.search('?q=games')
+        latest_ID = IndexChange.objects.order_by('-id').values_list('id', flat=True).first() or 0
+
+        # A writer that took its change id first commits after another writer
+        Activity.objects.filter(id=self.games.id).update(name='Unplugged')
+        Activity.objects.filter(id=self.functions.id).update(name='Blocks')
+        IndexChange.objects.create(id=latest_ID + 2, token='second', kind='activity', object_id=self.functions.id)
+        self.assertEqual(self.search('?q=blocks')['count'], 1)
+        self.assertEqual(self.search('?q=unplugged')['count'], 0)
+        IndexChange.objects.create(id=latest_ID + 1, token='first', kind='activity', object_id=self.games.id)
+        self.assertEqual([hit['id'] for hit in self.search('?q=unplugged')['results']], [self.games.id])
@@ -17,6 +17,9 @@ router.register(r'/curriculumactivityrelationships', views.CurriculumActivityRel
 # API URLs determined automatically by the rest framework router
 # Include URLs for the browsable API
 urlpatterns = [
+    url(r'^/search/$', views.SearchView.as_view(), name='search'),
+    url(r'^/autocomplete/$', views.AutocompleteView.as_view(), name='autocomplete'),
+    url(r'^/bootstrap/$', views.BootstrapView.as_view(), name='bootstrap'),
     url(r'^', include(router.urls)),
     url(r'^api-auth/', include('rest_framework.urls', namespace='rest_framework'))
 ]
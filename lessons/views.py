@@ -1,5 +1,11 @@
-from django.core.exceptions import ObjectDoesNotExist
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models.query import prefetch_related_objects
+from django.http import Http404
 from django.shortcuts import get_object_or_404
+from django.views.generic import TemplateView
 
 from lessons.models import Curriculum
 from lessons.models import Activity
@@ -8,6 +14,7 @@ from lessons.models import Material
 from lessons.models import Resource
 from lessons.models import CurriculumActivityRelationship
 from lessons.models import Step
+from lessons.models import ActivityClosure
 
 from lessons.serializers import TagSerializer
 from lessons.serializers import MaterialSerializer
@@ -16,12 +23,30 @@ from lessons.serializers import ResourceSerializer
 from lessons.serializers import CurriculumSerializer
 from lessons.serializers import CurriculumActivityRelationshipSerializer
 from lessons.serializers import StepSerializer
-
-from rest_framework import viewsets, status
+from lessons.serializers import find_objects_in_bulk
+from lessons.serializers import insert_curriculum_activity
+from lessons.serializers import move_curriculum_activity
+from lessons.serializers import remove_curriculum_activity
+from lessons.filters import ActivityFilter
+from lessons.filters import TagQueryFilter
+from lessons.filters import CurriculumFilter
+from lessons.pagination import KeysetPaginationMixin
+from lessons.search import search_index
+from lessons.bitmaps import IDs_to_bits, TagQueryError, count_bits, tag_bitmap_index
+from lessons.autocomplete import autocomplete_index
+from lessons.plans import StepCycleError, lesson_plans
+from lessons.bootstrap import get_bootstrap_data, get_bootstrap_json
+from lessons.caching import ACTIVITY, CURRICULUM, ResponseCacheMixin
+
+from rest_framework import filters, viewsets, status
+from rest_framework.decorators import detail_route, list_route
+from rest_framework.exceptions import ParseError
 from rest_framework.response import Response
+from rest_framework.templatetags.rest_framework import replace_query_param
+from rest_framework.views import APIView
 
 
-class TagViewSet(viewsets.ModelViewSet):
+class TagViewSet(KeysetPaginationMixin, viewsets.ModelViewSet):
     """
     This viewset automatically provides `list` and `detail` actions.
     """
@@ -76,7 +101,7 @@ class TagViewSet(viewsets.ModelViewSet):
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
-class MaterialViewSet(viewsets.ModelViewSet):
+class MaterialViewSet(KeysetPaginationMixin, viewsets.ModelViewSet):
     """
     This viewset automatically provides `list` and `detail` actions.
     """
@@ -112,7 +137,7 @@ class MaterialViewSet(viewsets.ModelViewSet):
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
-class ResourceViewSet(viewsets.ModelViewSet):
+class ResourceViewSet(KeysetPaginationMixin, viewsets.ModelViewSet):
     """
     This viewset automatically provides `list` and `detail` actions.
     """
@@ -149,7 +174,7 @@ class ResourceViewSet(viewsets.ModelViewSet):
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
-class StepViewSet(viewsets.ModelViewSet):
+class StepViewSet(KeysetPaginationMixin, viewsets.ModelViewSet):
     """
     This viewset automatically provides `list` and `detail` actions.
     """
@@ -157,12 +182,21 @@ class StepViewSet(viewsets.ModelViewSet):
     serializer_class = StepSerializer
 
 
-class ActivityViewSet(viewsets.ModelViewSet):
+class ActivityViewSet(ResponseCacheMixin, KeysetPaginationMixin, viewsets.ModelViewSet):
     """
     This viewset automatically provides `list` and `detail` actions.
     """
+    cache_kind = ACTIVITY
+    cache_filter_params = ('tag', 'category', 'curriculum')
+    cache_filter_models = {'tag_name': Tag, 'tag_category': Tag, 'tag_query': Tag}
     queryset = Activity.objects.all()
     serializer_class = ActivitySerializer
+    filter_backends = (filters.DjangoFilterBackend, TagQueryFilter)
+    filter_class = ActivityFilter
+
+    # Only prefetch what the requested fields will read (see DynamicFieldsMixin)
+    def get_queryset(self):
+        return self.queryset.prefetch_related(*self.get_serializer().get_prefetch_fields())
 
     # Custom function to associate activities with resources, materials, tags, curricula, and other activities
     def create(self, request):
@@ -172,54 +206,43 @@ class ActivityViewSet(viewsets.ModelViewSet):
             # If no tag_IDs, return 400_BAD_REQUEST
             if (("tag_IDs" not in request.data) or (len(request.data["tag_IDs"]) == 0)):
                 return Response({'tag_IDs': ['This field may not be blank.']}, status=status.HTTP_400_BAD_REQUEST)
-            # If any tag_ID is invalid, return 404_NOT_FOUND
-            for tagID in request.data["tag_IDs"]:
-                try:
-                    Tag.objects.get(pk=tagID)
-                except ObjectDoesNotExist:
-                    return Response({'detail': 'Not found'}, status=status.HTTP_404_NOT_FOUND)
-
-            # Look for errors with any curricula and activities passed in
-            rel_errors = 0
-            curriculum_rels = []
-            activity_rels = []
-            material_IDs = []
-            resource_IDs = []
-
-            if "material_IDs" in request.data:
-                material_IDs = request.data["material_IDs"]
-            if "resource_IDs" in request.data:
-                resource_IDs = request.data["resource_IDs"]
-
-            if "curriculum_rels" in request.data:
-                curricula = request.data["curriculum_rels"]
-                for rel in curricula:
-                    try:
-                        Curriculum.objects.get(pk=rel["curriculumID"])
-                        curriculum_rels.append(rel)
-                    except ObjectDoesNotExist:
-                        rel_errors += 1
 
-            if "activity_rels" in request.data:
-                activities = request.data["activity_rels"]
-                for rel in activities:
-                    try:
-                        Activity.objects.get(pk=rel["activityID"])
-                        activity_rels.append(rel)
-                    except ObjectDoesNotExist:
-                        rel_errors += 1
+            curriculum_rels = request.data.get("curriculum_rels", [])
+            activity_rels = request.data.get("activity_rels", [])
+
+            # Look up every object referenced by the request (one query per model)
+            found, missing = find_objects_in_bulk({
+                'tag_IDs': (Tag, request.data["tag_IDs"]),
+                'material_IDs': (Material, request.data.get("material_IDs", [])),
+                'resource_IDs': (Resource, request.data.get("resource_IDs", [])),
+                'curriculum_rels': (Curriculum, [rel["curriculumID"] for rel in curriculum_rels]),
+                'activity_rels': (Activity, [rel["activityID"] for rel in activity_rels]),
+            })
+            missing_response = dict(missing, detail='Not found')
+
+            # If any tag, material or resource is invalid, return 404_NOT_FOUND without creating the activity
+            if set(missing) & set(['tag_IDs', 'material_IDs', 'resource_IDs']):
+                return Response(missing_response, status=status.HTTP_404_NOT_FOUND)
+
+            # Invalid curricula and activities are left out, but the activity is still created
+            curriculum_rels = [rel for rel in curriculum_rels if int(rel["curriculumID"]) not in missing.get('curriculum_rels', [])]
+            activity_rels = [rel for rel in activity_rels if int(rel["activityID"]) not in missing.get('activity_rels', [])]
+
             # Save new activity instance and pass in lists of objects to be associated with the activity
             serializer.save(
-                tag_IDs=request.data["tag_IDs"]
+                tags=found['tag_IDs']
                 , curriculum_rels=curriculum_rels
-                , material_IDs=material_IDs
-                , resource_IDs=resource_IDs
+                , curricula=found['curriculum_rels']
+                , materials=found['material_IDs']
+                , resources=found['resource_IDs']
                 , activity_rels=activity_rels
+                , related_activities=found['activity_rels']
             )
 
-            if (rel_errors > 0):
-                return Response({'detail': 'Not found'}, status=status.HTTP_404_NOT_FOUND)
+            if missing:
+                return Response(missing_response, status=status.HTTP_404_NOT_FOUND)
             else:
+                prefetch_related_objects([serializer.instance], serializer.get_prefetch_fields())
                 return Response(serializer.data, status=status.HTTP_201_CREATED)
         else:
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
@@ -232,35 +255,124 @@ class ActivityViewSet(viewsets.ModelViewSet):
         serializer = ActivitySerializer(activity, request.data, partial=True)
 
         if serializer.is_valid():
-            # Get and save new objects if necessary
-            if 'tag_IDs' in request.data:
-                tag_IDs = request.data["tag_IDs"]
-                serializer.save(tag_IDs=tag_IDs)
-            if 'material_IDs' in request.data:
-                material_IDs = request.data["material_IDs"]
-                serializer.save(material_IDs=material_IDs)
-            if 'resource_IDs' in request.data:
-                resource_IDs = request.data["resource_IDs"]
-                serializer.save(resource_IDs=resource_IDs)
-            if 'activity_rels' in request.data:
-                activity_rels = request.data["activity_rels"]
-                serializer.save(activity_rels=activity_rels)
-            if 'curriculum_rels' in request.data:
-                curriculum_rels = request.data["curriculum_rels"]
-                serializer.save(curriculum_rels=curriculum_rels)
-            else:
-                serializer.save()
+            # Get any new objects and save them together with the activity in a single pass
+            relationships = dict(
+                (key, request.data[key])
+                for key in ('tag_IDs', 'material_IDs', 'resource_IDs', 'activity_rels', 'curriculum_rels')
+                if key in request.data
+            )
+            serializer.save(**relationships)
+            prefetch_related_objects([serializer.instance], serializer.get_prefetch_fields())
             return Response(serializer.data, status=status.HTTP_200_OK)
         else:
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+    @list_route()
+    def facets(self, request):
+        """
+        Tag counts by category for the activities matching the same filters as the activity list:
+        {"count": <number of activities>, "facets": {"Language": [{"id": 1, "name": "Python", "count": 412}, ...], ...}}
+        """
+        params = request.query_params
+        if any(name in params for name in ActivityFilter.base_filters):
+            # Other filters run on the database once to find the matching activities
+            activity_IDs = self.filter_queryset(Activity.objects.all()).values_list('id', flat=True)
+            bits = IDs_to_bits(activity_IDs)
+        else:
+            bits = None
 
-class CurriculumViewSet(viewsets.ModelViewSet):
+        # Count on the same (current) version of the index the tag query ran on
+        with tag_bitmap_index.lock:
+            if bits is None and TagQueryFilter.query_param in params:
+                try:
+                    bits = tag_bitmap_index.query_bits(params[TagQueryFilter.query_param])
+                except TagQueryError as e:
+                    raise ParseError(e.args[0])
+            counts = tag_bitmap_index.count_tags(bits)
+            tag_info = tag_bitmap_index.tag_info
+            total = count_bits(tag_bitmap_index.activities if bits is None else bits)
+
+            facets = OrderedDict((category, []) for category, display in Tag.CATEGORIES)
+            for tag_ID, count in counts.items():
+                name, category = tag_info[tag_ID]
+                facets.setdefault(category, []).append(OrderedDict([('id', tag_ID), ('name', name), ('count', count)]))
+        for tags in facets.values():
+            tags.sort(key=lambda tag: (-tag['count'], tag['name']))
+
+        return Response(OrderedDict([
+            ('count', total),
+            ('facets', facets),
+        ]))
+
+    def get_closure(self, request, pk, related, other):
+        """
+        List the activities `related` to activity `pk` in the closure table, nearest first, with one indexed query.
+        ?type=SUB (default) follows sub-activities and ?type=EXT follows extensions.
+        """
+        rel_type = request.query_params.get('type', 'SUB')
+        if rel_type not in dict(ActivityClosure.REL_TYPES):
+            raise ParseError('Invalid type.')
+        rows = ActivityClosure.objects.filter(
+            rel_type=rel_type
+            , **{other + '_id': pk}
+        ).order_by('depth', related).values_list(related, related + '__name', 'depth')
+        if not rows:
+            # Only look the activity up to tell "none" from "not found"
+            get_object_or_404(Activity, pk=pk)
+        return Response([
+            OrderedDict([('id', activity_ID), ('name', name), ('depth', depth)])
+            for activity_ID, name, depth in rows
+        ])
+
+    @detail_route()
+    def descendants(self, request, pk=None):
+        """
+        All sub-activities (or extensions) of an activity, however deeply nested:
+        [{"id": 2, "name": "Loops", "depth": 1}, ...]
+        """
+        return self.get_closure(request, pk, 'descendant', 'ancestor')
+
+    @detail_route()
+    def ancestors(self, request, pk=None):
+        """
+        All activities an activity is nested in (or extends), nearest first
+        """
+        return self.get_closure(request, pk, 'ancestor', 'descendant')
+
+    @detail_route()
+    def plan(self, request, pk=None):
+        """
+        The steps of an activity with the steps of its step activities expanded in place, in order:
+        [{"id": 3, "number": "2.1", "depth": 1, "text": "...", "activity": 5, "step_activity": null, ...}, ...]
+        """
+        try:
+            activity_ID = int(pk)
+        except ValueError:
+            raise Http404
+        try:
+            plan = lesson_plans.get(activity_ID)
+        except StepCycleError as e:
+            return Response({'detail': e.args[0]}, status=status.HTTP_409_CONFLICT)
+        if plan is None:
+            raise Http404
+        return Response(plan)
+
+
+class CurriculumViewSet(ResponseCacheMixin, KeysetPaginationMixin, viewsets.ModelViewSet):
     """
     This viewset automatically provides `list` and `detail` actions.
     """
+    cache_kind = CURRICULUM
+    cache_filter_params = ('grade', 'lower_grade', 'upper_grade', 'tag')
+    cache_filter_models = {'tag_name': Tag}
     queryset = Curriculum.objects.all()
     serializer_class = CurriculumSerializer
+    filter_backends = (filters.DjangoFilterBackend,)
+    filter_class = CurriculumFilter
+
+    # Only prefetch what the requested fields will read (see DynamicFieldsMixin)
+    def get_queryset(self):
+        return self.queryset.prefetch_related(*self.get_serializer().get_prefetch_fields())
 
     def create(self, request):
         serializer = CurriculumSerializer(data=request.data)
@@ -297,10 +409,205 @@ class CurriculumViewSet(viewsets.ModelViewSet):
         else:
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+    @detail_route(methods=['post'])
+    def move(self, request, pk=None):
+        """
+        Move one activity within the curriculum, e.g. to the top: {"activityID": 3, "position": 1}
+        Usually only the moved row is written (see move_curriculum_activity).
+        Returns {"activityID": 3, "number": 1}
+        """
+        curriculum = get_object_or_404(Curriculum, pk=pk)
+        values, errors = get_integers(request.data, ('activityID', 'position'))
+        if errors:
+            return Response(errors, status=status.HTTP_400_BAD_REQUEST)
+
+        with transaction.atomic():
+            move_curriculum_activity(curriculum, values['activityID'], values['position'])
+        return Response(OrderedDict([
+            ('activityID', values['activityID']),
+            ('number', values['position']),
+        ]))
+
+    @detail_route(methods=['post'])
+    def append(self, request, pk=None):
+        """
+        Add one activity at the end of the curriculum: {"activityID": 3}
+        Only the new row is written. Returns the change instead of the whole curriculum:
+        {"activityID": 3, "number": <its position>, "tags": [<the curriculum's tags>]}
+        """
+        curriculum = get_object_or_404(Curriculum, pk=pk)
+        values, errors = get_integers(request.data, ('activityID',))
+        if errors:
+            return Response(errors, status=status.HTTP_400_BAD_REQUEST)
+
+        with transaction.atomic():
+            insert_curriculum_activity(curriculum, values['activityID'])
+        return self.get_delta(curriculum, values['activityID'], curriculum.activity_relationships.count())
+
+    @detail_route(methods=['post'])
+    def insert(self, request, pk=None):
+        """
+        Add one activity at a position of the curriculum: {"activityID": 3, "position": 1}
+        Usually only the new row is written. Returns the same change as `append`.
+        """
+        curriculum = get_object_or_404(Curriculum, pk=pk)
+        values, errors = get_integers(request.data, ('activityID', 'position'))
+        if errors:
+            return Response(errors, status=status.HTTP_400_BAD_REQUEST)
+
+        with transaction.atomic():
+            insert_curriculum_activity(curriculum, values['activityID'], values['position'])
+        return self.get_delta(curriculum, values['activityID'], values['position'])
+
+    @detail_route(methods=['post'])
+    def remove(self, request, pk=None):
+        """
+        Take one activity out of the curriculum: {"activityID": 3}
+        Only its row is deleted. Returns {"activityID": 3, "number": null, "tags": [<the curriculum's tags>]}
+        """
+        curriculum = get_object_or_404(Curriculum, pk=pk)
+        values, errors = get_integers(request.data, ('activityID',))
+        if errors:
+            return Response(errors, status=status.HTTP_400_BAD_REQUEST)
+
+        with transaction.atomic():
+            remove_curriculum_activity(curriculum, values['activityID'])
+        return self.get_delta(curriculum, values['activityID'], None)
+
+    def get_delta(self, curriculum, activity_ID, number):
+        # Tags are included since curricula inherit them from their activities
+        tags = TagSerializer(curriculum.tags.all(), many=True, context=self.get_serializer_context())
+        return Response(OrderedDict([
+            ('activityID', activity_ID),
+            ('number', number),
+            ('tags', tags.data),
+        ]))
 
-class CurriculumActivityRelationshipViewSet(viewsets.ModelViewSet):
+
+def get_integers(data, names):
+    """
+    Read the named integers from request data.
+    Returns the values and the errors (in the same form as serializer errors) by name.
+    """
+    values = {}
+    errors = {}
+    for name in names:
+        try:
+            values[name] = int(data[name])
+        except KeyError:
+            errors[name] = ['This field is required.']
+        except (TypeError, ValueError):
+            errors[name] = ['A valid integer is required.']
+    return values, errors
+
+
+class CurriculumActivityRelationshipViewSet(KeysetPaginationMixin, viewsets.ModelViewSet):
     """
     This viewset automatically provides `list` and `detail` actions.
     """
-    queryset = CurriculumActivityRelationship.objects.all()
+    # Paginate in curriculum order (backed by the unique (curriculum, number) index)
+    keyset_fields = ('curriculum', 'number')
+    queryset = CurriculumActivityRelationship.objects.select_related('activity')
     serializer_class = CurriculumActivityRelationshipSerializer
+
+    def get_queryset(self):
+        activity_fields = self.get_serializer().fields['activity'].get_prefetch_fields()
+        # Select each row's position in its curriculum instead of counting it per row
+        table = CurriculumActivityRelationship._meta.db_table
+        position = (
+            "SELECT COUNT(*) FROM {0} AS previous WHERE previous.curriculum_id = {0}.curriculum_id"
+            " AND previous.number <= {0}.number"
+        ).format(table)
+        return self.queryset.extra(select={'position': position}).prefetch_related(
+            *['activity__' + field for field in activity_fields]
+        )
+
+
+class SearchView(APIView):
+    """
+    Full-text search over activities, best match first: /api/search/?q=loops&page=2
+    Returns {"count": <number of hits>, "next": "<url of the next page or null>", "results": [...]}
+    """
+    page_query_param = 'page'
+    page_size_query_param = 'page_size'
+    page_size = 20
+    max_page_size = None
+
+    def get(self, request):
+        query = request.query_params.get('q', '')
+        try:
+            page = int(request.query_params.get(self.page_query_param, 1))
+            page_size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except ValueError:
+            raise ParseError('Invalid page.')
+        if page < 1 or page_size < 1:
+            raise ParseError('Invalid page.')
+        page_size = min(page_size, self.max_page_size or getattr(settings, 'LESSONS_MAX_PAGE_SIZE', 1000))
+        start = (page - 1) * page_size
+
+        with search_index.lock:
+            hits = search_index.search(query)
+            results = [
+                search_index.get_hit(activity_ID, score, query)
+                for score, activity_ID in hits[start:start + page_size]
+            ]
+
+        next_url = None
+        if start + page_size < len(hits):
+            next_url = replace_query_param(request.build_absolute_uri(), self.page_query_param, page + 1)
+        return Response(OrderedDict([
+            ('count', len(hits)),
+            ('next', next_url),
+            ('results', results),
+        ]))
+
+
+class AutocompleteView(APIView):
+    """
+    Complete tag and activity names as they are typed: /api/autocomplete/?q=pyt&type=tag&limit=10
+    Returns names starting with the query first, then names within a typo or two of it.
+    """
+    types = ('tag', 'activity')
+    limit = 10
+
+    def get(self, request):
+        query = request.query_params.get('q', '')
+        kind = request.query_params.get('type') or None
+        if kind is not None and kind not in self.types:
+            raise ParseError('Invalid type.')
+        try:
+            limit = int(request.query_params.get('limit', self.limit))
+        except ValueError:
+            raise ParseError('Invalid limit.')
+        if limit < 1:
+            raise ParseError('Invalid limit.')
+
+        results = [
+            OrderedDict([('id', obj_ID), ('name', name), ('type', kind)])
+            for kind, obj_ID, name in autocomplete_index.complete(query, kind, limit)
+        ]
+        return Response(results)
+
+
+class BootstrapView(APIView):
+    """
+    Curricula, tags and an index of activities for the app shell in one normalized response,
+    each object once and keyed by id (see get_bootstrap_data)
+    """
+
+    def get(self, request):
+        return Response(get_bootstrap_data(request))
+
+
+class HomeView(TemplateView):
+    """
+    The app shell. With the LESSONS_PRELOAD_BOOTSTRAP setting the bootstrap data is embedded
+    in the page, so the first paint does not wait for an API request.
+    """
+    template_name = 'lessons/curriculum-list-basic.html'
+
+    def get_context_data(self, **kwargs):
+        context = super(HomeView, self).get_context_data(**kwargs)
+        if getattr(settings, 'LESSONS_PRELOAD_BOOTSTRAP', False):
+            context['bootstrap_json'] = get_bootstrap_json()
+        return context
@@ -76,6 +76,46 @@ REST_FRAMEWORK = {
     'TEST_REQUEST_DEFAULT_FORMAT': 'json'
 }
 
+# Keyset pagination of API lists (only used when a request passes ?page_size= or ?cursor=)
+LESSONS_PAGE_SIZE = 100
+LESSONS_MAX_PAGE_SIZE = 1000
+
+# Embed the bootstrap data (curricula, tags and the activity index) in the home page,
+# cached for at most this many seconds (it is also cleared whenever they change).
+# Off by default: the home page then renders without touching the database and the app loads /api/bootstrap/
+# Left unset, the timeout is 300 seconds with a cache shared between processes and 0 with the local memory cache
+LESSONS_PRELOAD_BOOTSTRAP = False
+# LESSONS_BOOTSTRAP_CACHE_TIMEOUT = 300
+
+# Cache the list and detail responses of activities and curricula for at most this many seconds
+# (they are replaced whenever something they show changes; 0 turns the cache off).
+# Left unset, they are cached for 600 seconds with a cache shared between processes and not at all
+# with the local memory cache, where other processes would not see the changes
+# LESSONS_RESPONSE_CACHE_TIMEOUT = 600
+
+# Cache compiled lesson plans the same way
+# LESSONS_PLAN_CACHE_TIMEOUT = 600
+
+# Concurrent requests for a response missing from the cache wait for one of them to compute it.
+# With the lock, requests served by other processes wait too (this needs a cache shared between processes,
+# and is ignored with a warning otherwise); waiting for the lock stops after the lock timeout (in seconds)
+LESSONS_RESPONSE_CACHE_LOCK = False
+LESSONS_RESPONSE_CACHE_LOCK_TIMEOUT = 30
+
+# The local memory cache is per process: use a shared backend, e.g.
+# 'django.core.cache.backends.filebased.FileBasedCache', when running several processes
+# Cached responses depend on a version entry per row they show, so the cache holds far more
+# than the default 300 entries (a list of 400 activities alone needs over 400)
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'
+        , 'LOCATION': 'lessons'
+        , 'OPTIONS': {
+            'MAX_ENTRIES': 100000
+        }
+    }
+}
+
 # Internationalization
 # https://docs.djangoproject.com/en/1.7/topics/i18n/
 LANGUAGE_CODE = 'en-us'
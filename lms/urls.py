@@ -7,6 +7,8 @@ admin.autodiscover()
 
 from django.views.generic import TemplateView
 
+from lessons.views import HomeView
+
 class SimpleStaticView(TemplateView):
     def get_template_names(self):
         return [self.kwargs.get('template_name') + ".html"]
@@ -26,7 +28,7 @@ urlpatterns = patterns('',
     url(r'^api', include('lessons.urls', namespace='lessons')),
     url(r'^admin', include(admin.site.urls)),
 	url(r'^(?P<template_name>\w+)$', SimpleStaticView.as_view(), name='example'),
-    url(r'^$', TemplateView.as_view(template_name='lessons/curriculum-list-basic.html'), name='home'),
+    url(r'^$', HomeView.as_view(), name='home'),
 )
 
 # Override production settings with local development settings (if necessary)
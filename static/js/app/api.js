@@ -32,6 +32,24 @@ api.factory('Curriculum', ['$resource', function($resource) {
 				method: 'PATCH'
 				//, headers: {'Content-Type': 'application/json;charset=utf-8'}
 			}
+			// Add, insert, move or remove one activity; the response only describes the change
+			// Usage: Curriculum.append({ id:$id }, {'activityID': $activityID});
+			, 'append' : {
+				method: 'POST'
+				, url: '/api/curricula/:id/append/'
+			}
+			, 'insert' : {
+				method: 'POST'
+				, url: '/api/curricula/:id/insert/'
+			}
+			, 'move' : {
+				method: 'POST'
+				, url: '/api/curricula/:id/move/'
+			}
+			, 'remove' : {
+				method: 'POST'
+				, url: '/api/curricula/:id/remove/'
+			}
 		}
 	);
 }]);
@@ -9,20 +9,18 @@ activityControllers.controller('NewActivityModalCtrl', ['$scope'
     , '$modal'
     , 'Activity'
     , 'Tag'
-    , 'curriculumID'
-    , 'number'
+    , 'bootstrapService'
     , function ($scope
         , $modalInstance
         , $modal
         , Activity
         , Tag
-        , curriculumID
-        , number
+        , bootstrapService
     ) {
 
     console.log("Inside new activity modal window controller.");
-    // list of tags for new activity form
-    $scope.tags = Tag.query();
+    // list of tags for new activity form (loaded once for the whole app)
+    $scope.tags = bootstrapService.tags;
 
     // list of possible categories for new activity form
     $scope.categories = ["Offline", "Online", "Discussion", "Extension"];
@@ -30,14 +28,8 @@ activityControllers.controller('NewActivityModalCtrl', ['$scope'
     $scope.newActivity = new Activity();
 
     $scope.save = function() {
-        // Add curriculum and number to new activity object
-        $scope.newActivity.curriculum_rels = [
-            {
-               curriculumID: curriculumID
-               , number: number
-            }
-        
-        ];
+        // The caller adds the new activity to its curriculum once it is saved
+        $scope.newActivity.curriculum_rels = [];
         // Save new activity to DB
         console.log("Saving new activity to database.");
         return $scope.newActivity.$save().then(function(result) {
@@ -80,18 +72,20 @@ activityControllers.controller('EditActivityModalCtrl', ['$scope'
     , '$modal'
     , 'Activity'
     , 'Tag'
+    , 'bootstrapService'
     , 'activity'
     , function ($scope
         , $modalInstance
         , $modal
         , Activity
         , Tag
+        , bootstrapService
         , activity
     ) {
 
     console.log("Inside edit activity modal window controller.");
-    // list of tags for new activity form
-    $scope.tags = Tag.query();
+    // list of tags for new activity form (loaded once for the whole app)
+    $scope.tags = bootstrapService.tags;
 
     // list of possible categories for new activity form
     $scope.categories = ["Offline", "Online", "Discussion", "Extension"];
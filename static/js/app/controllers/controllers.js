@@ -21,6 +21,7 @@ lessonsControllers.controller('AppCtrl', ['$scope'
   , 'addActivityService'
   , 'utilitiesService'
   , 'inheritTagsService'
+  , 'bootstrapService'
   , function ($scope
     , $modal
     , Curriculum
@@ -30,16 +31,43 @@ lessonsControllers.controller('AppCtrl', ['$scope'
     , addActivityService
     , utilitiesService
     , inheritTagsService
+    , bootstrapService
   ){
 
+    // Curricula, tags and activities all come from a single bootstrap request
+
     // List of curricula for main app page
-    $scope.curricula = Curriculum.query(inheritTagsService.getCurriculaTags);
+    // Each curriculum comes with the Language and Technology tags inherited from its activities
+    $scope.curricula = bootstrapService.curricula;
 
     // List of tags to add tag to lesson
-    $scope.tags = Tag.query();
+    $scope.tags = bootstrapService.tags;
 
     // List of activities to add activity to curriculum
-    $scope.activities = Activity.query();
+    // Only the fields shown before an activity is opened (details are loaded when needed)
+    $scope.activities = bootstrapService.activities;
+
+    // Resolve a list of activity details for a modal window, loading it if the activity index left it out
+    function activityDetail(activityID, list, field) {
+        return function () {
+            if (!_.isUndefined(list)) {
+                return list;
+            }
+            return Activity.get({id: activityID, fields: field}).$promise.then(function (activity) {
+                return activity[field];
+            });
+        };
+    }
+
+    // Show the teaching notes of an activity, loading them if the activity index left them out
+    $scope.showNotes = function (activity) {
+        activity.notesShown = true;
+        if (_.isUndefined(activity.teaching_notes)) {
+            Activity.get({id: activity.id, fields: 'teaching_notes'}, function (response) {
+                activity.teaching_notes = response.teaching_notes;
+            });
+        }
+    };
 
     // Function to check whether objects in the HTML template are defined
     // Some objects we want to hide are actually undefined
@@ -92,22 +120,14 @@ lessonsControllers.controller('AppCtrl', ['$scope'
             var modalInstance = $modal.open({
                 templateUrl: 'static/partials/new-activity.html',
                 controller: 'NewActivityModalCtrl',
-                size: size,
-                resolve: {
-                    curriculumID: function () {
-                        return curriculum.id;
-                    },
-                    number: function() {
-                        return curriculum.activities.length + 1;
-                    }
-                }
+                size: size
             });
 
             modalInstance.result.then(function (newActivity) {
                 console.log("Successfully created new activity:");
                 console.log(newActivity);
 
-                // Add newly created activity to curriculum (without page refresh)  
+                // Add newly created activity to the end of the curriculum (the modal creates it in no curriculum)
                 console.log("Adding new activity to curriculum.");
                 curriculum = addActivityService.addActivity(curriculum, newActivity)
             }); 
@@ -126,8 +146,15 @@ lessonsControllers.controller('AppCtrl', ['$scope'
             controller: 'EditActivityModalCtrl',
             size: size,
             resolve: {
+                // The form edits the teaching notes too, which the activity index leaves out
                 activity: function () {
-                    return activity;
+                    if (!_.isUndefined(activity.teaching_notes)) {
+                        return activity;
+                    }
+                    return Activity.get({id: activity.id, fields: 'teaching_notes'}).$promise.then(function (response) {
+                        activity.teaching_notes = response.teaching_notes;
+                        return activity;
+                    });
                 }
             }
         });
@@ -200,9 +227,7 @@ lessonsControllers.controller('AppCtrl', ['$scope'
             controller: 'ActivityResourcesModalCtrl',
             size: size,
             resolve: {
-                resources: function () {
-                    return resources;
-                },
+                resources: activityDetail(activityID, resources, 'resources'),
                 activityID: function () {
                     return activityID;
                 }
@@ -216,9 +241,7 @@ lessonsControllers.controller('AppCtrl', ['$scope'
             controller: 'ActivityMaterialsModalCtrl',
             size: size,
             resolve: {
-                materials: function () {
-                    return materials;
-                },
+                materials: activityDetail(activityID, materials, 'materials'),
                 activityID: function () {
                     return activityID;
                 }
@@ -232,9 +255,7 @@ lessonsControllers.controller('AppCtrl', ['$scope'
             controller: 'ActivityStepsModalCtrl',
             size: size,
             resolve: {
-                steps: function () {
-                    return steps;
-                },
+                steps: activityDetail(activityID, steps, 'steps'),
                 activityID: function () {
                     return activityID;
                 }
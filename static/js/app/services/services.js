@@ -34,6 +34,47 @@ lessonsServices.service('utilitiesService', function() {
     };
 });
 
+// Loads curricula, tags and the index of activities for the app shell with one request
+// (or none when the page embeds them as window.lessonsBootstrap)
+// The response lists each object once by id; references are turned back into shared objects
+lessonsServices.service('bootstrapService', ['$http', '$q', '$window', function ($http, $q, $window) {
+    var service = this;
+
+    // Filled in place when the data arrives, so controllers can bind to them right away
+    this.curricula = [];
+    this.activities = [];
+    this.tags = [];
+
+    this.load = function(data) {
+        var tags = {};
+        var activities = {};
+        _.each(data.tags, function (tag, id) {
+            tags[id] = tag;
+            service.tags.push(tag);
+        });
+        _.each(data.activities, function (activity, id) {
+            activity.tags = _.map(activity.tags, function (tagID) { return tags[tagID]; });
+            activities[id] = activity;
+            service.activities.push(activity);
+        });
+        _.each(data.curricula, function (curriculum) {
+            curriculum.tags = _.map(curriculum.tags, function (tagID) { return tags[tagID]; });
+            curriculum.activities = _.map(curriculum.activities, function (activityID) { return activities[activityID]; });
+            service.curricula.push(curriculum);
+        });
+    };
+
+    if ($window.lessonsBootstrap) {
+        service.load($window.lessonsBootstrap);
+        this.promise = $q.when($window.lessonsBootstrap);
+    }
+    else {
+        this.promise = $http.get('/api/bootstrap/').success(function (data) {
+            service.load(data);
+        });
+    }
+}]);
+
 lessonsServices.service('inheritTagsService', [
     'utilitiesService'
     , function(
@@ -67,28 +108,10 @@ lessonsServices.service('inheritTagsService', [
         }
         return curriculum;
     };
-
-   // Function takes a list of curricula and inherits tags from activities
-    this.getCurriculaTags = function(curricula) {
-        _.each(curricula, function (curriculum, index, list) {
-        curriculum.tags = []
-            _.each(curriculum.activities, function (activity, index, list) {
-                _.each(activity.tags, function (tag, index, list) {
-                    // only inherit language and technology tags
-                    if (tag.category == "Language" | tag.category == "Technology") {
-                        // do not add duplicates to list
-                        if (!utilitiesService.containsObject(curriculum.tags, tag)) {
-                            curriculum.tags.push(tag);
-                        }
-                    }
-                });
-            });
-        });
-    };
 }]);
 
 
-// Submit PATCH request to API adding a new activity to a curriculum
+// Submit POST request to API adding a new activity to the end of a curriculum
 lessonsServices.service('addActivityService', [
     'Curriculum'
     , 'utilitiesService'
@@ -104,31 +127,14 @@ lessonsServices.service('addActivityService', [
             return curriculum;
         }
 
-        console.log("Creating list of activities to update curriculum:");
-        // Create new list of activity IDs for curriculum
-        var activityList = []
-        _.each(curriculum.activities, function (activity, index, list) {
-            activityList.push(
-                {
-                    'activityID': activity.id
-                    , 'number': index + 1 // indices start at 1
-                }
-            );
-        });
-        activityList.push(
-            {
-                'activityID': newActivity.id
-                , 'number': activityList.length + 1 // indices start at 1
-            }
-        );
-        console.log(activityList);
-
-        // Add activity to curriculum on back-end (custom "PATCH" request to API)
+        // Add activity to the end of the curriculum on back-end (only the new row is written)
         // Also update activities of curriculum displayed on front-end
-        console.log("Making PATCH request to add new activity to curriculum:");
-        Curriculum.update({ id:curriculum.id }, {'activity_rels': activityList}, function(response) {
-            curriculum.activities = response.activities;
+        console.log("Making POST request to add new activity to curriculum:");
+        Curriculum.append({ id:curriculum.id }, {'activityID': newActivity.id}, function(response) {
+            curriculum.tags = response.tags;
         });
+        if (!curriculum.activities) curriculum.activities = [];
+        curriculum.activities.push(newActivity);
 
         // Update curriculum tags
         console.log("Updating curriculum tags.");